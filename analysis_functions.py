@@ -1,28 +1,46 @@
 import networkx as nx
-import networkx.algorithms.community as nx_comm
 import numpy as np
-from copy import deepcopy
-import matplotlib.pyplot as plt
 import os
+from sparse_graph_functions import graph_to_csr, csr_diameter, communities_to_labels, csr_modularity, \
+    csr_scalar_assortativity
+from betweenness import betweenness, adaptive_betweenness
+from graph_statistics import degree_array, distribution, ccdf, strength_distribution, top_k_items
+from backbone import edge_arrays, wc_masks
+from community_detection import detect_communities, labels_to_cset, community_sizes
 
 
-def diameter(G, weighted=False):
+def diameter(G, weighted=False, approximate=False, disconnected='largest'):
     """
     Finds the diameter of a networkx graph
+    weighted: use the edge weights as edge lengths
+    approximate: return a cheap double sweep lower bound instead of the exact diameter
+    disconnected: 'largest' (largest component), 'max' (over all components), or 'inf'
+    The exact diameter uses the bounding diameters algorithm on the CSR adjacency, which needs a few searches
+    in practice instead of one per node.
     """
-    if weighted:
-        return nx.diameter(G, weight='weight')
-    else:
-        return nx.diameter(G)
+    A, _ = graph_to_csr(G, weight='weight' if weighted else None)
+    return csr_diameter(A, weighted=weighted, approximate=approximate, disconnected=disconnected)
 
 
-def betweenness_centrality(G, weighted=True):
-    if weighted:
-        betweenness = nx.betweenness_centrality(G, k=None, normalized=True, weight='weight', endpoints=False, seed=None)
-        return betweenness
+def betweenness_centrality(G, weighted=True, weight_mode='distance', n_jobs=1, eps=None, delta=0.1, top_k=None,
+                           seed=None):
+    """
+    Normalized betweenness centrality of a networkx graph
+    weighted: use the edge weights
+    weight_mode: 'distance' (weights are edge lengths) or 'similarity' (weights such as co-occurrence counts are
+                 inverted so that frequent pairs are close)
+    n_jobs: number of processes the source batches are spread across
+    eps: if given, sample sources adaptively until every value is within eps of the exact one with probability
+         1 - delta, or until the top_k ranking is correct up to eps (adaptive_betweenness)
+    """
+    A, nodes = graph_to_csr(G)
+    mode = weight_mode if weighted else None
+    if eps is None:
+        bc = betweenness(A, mode, directed=G.is_directed(), normalized=True, n_jobs=n_jobs)
     else:
-        betweenness = nx.betweenness_centrality(G, k=None, normalized=True, weight=None, endpoints=False, seed=None)
-        return betweenness
+        bc, _, _ = adaptive_betweenness(A, eps, delta, top_k, mode, directed=G.is_directed(), n_jobs=n_jobs,
+                                        seed=seed)
+    return dict(zip(nodes, bc.tolist()))
 
 
 def degree_centrality(G):
@@ -40,23 +58,15 @@ def degree_distribution(G, normalize=True):
     """
     Returns the degree distribution of G with the option of normalizing it by the total number of nodes
     """
-    deg_sequence = degree_sequence(G)
-    max_degree = max(deg_sequence)
-    ddist = np.zeros((max_degree + 1,))
-    for d in deg_sequence:
-        ddist[d] += 1
-    if normalize:
-        ddist = ddist / float(G.number_of_nodes())
-    return ddist
+    _, degrees = degree_array(G)
+    return distribution(degrees, normalize)
 
 
 def cumulative_degree_distribution(G):
     """
     returns the cumulative degree distribution of G
     """
-    ddist = degree_distribution(G)
-    cdist = [ddist[k:].sum() for k in range(len(ddist))]
-    return cdist
+    return ccdf(degree_distribution(G))
 
 
 def G_wc(G, wmin, cmin):
@@ -64,38 +74,32 @@ def G_wc(G, wmin, cmin):
     G: graph
     wmin: minimum weight between nodes
     cmin: minimum community size
+    Returns a read-only view of G without the edges with low weight and the nodes in small components
     """
-    # deepcopy of the graph
-    G_wc = deepcopy(G)
-
-    # remove edges will low weight
-    uv_pairs = []
-    for u, v, d in G_wc.edges(data=True):
-        if 'weight' in d.keys() and d['weight'] < wmin:
-            uv_pairs.append([u, v])
-    for uv in uv_pairs:
-        G_wc.remove_edge(uv[0], uv[1])
+    nodes, u, v, w = edge_arrays(G)
+    node_mask, edge_mask = wc_masks(len(nodes), u, v, w, wmin, cmin)
+    keep = {n for n, m in zip(nodes, node_mask) if m}
 
     print('Number of edges in original graph: ', G.number_of_edges())
-    print('Number of edges after removing edges: ', G_wc.number_of_edges())
-
-    # remove nodes in small small components
-    comp_gen = nx.connected_components(G_wc)
-    nodes_to_remove = []
-    for comp in comp_gen:
-        if len(comp) < cmin:
-            for node in comp:
-                nodes_to_remove.append(node)
-    for node in nodes_to_remove:
-        G_wc.remove_node(node)
+    print('Number of edges after removing edges: ', int((w >= wmin).sum()))
     print('Number of nodes in original graph: ', G.number_of_nodes())
-    print('Number of nodes after removing nodes: ', G_wc.number_of_nodes())
+    print('Number of nodes after removing nodes: ', len(keep))
 
-    return G_wc
+    return nx.subgraph_view(G, filter_node=keep.__contains__,
+                            filter_edge=lambda a, b: G[a][b].get('weight', np.inf) >= wmin)
 
 
-def detect_comm_write_to_file(G_reduced, G_wc, wmin, cmin, loc, loc_type, name=''):
-    cset = list(nx_comm.label_propagation_communities(G_wc))
+def detect_comm_write_to_file(G_reduced, G_wc, wmin, cmin, loc, loc_type, name='', method=None, resolution=1.,
+                              seed=0):
+    """
+    method: None for networkx label propagation, otherwise a method of community_detection.detect_communities
+    """
+    if method is None:
+        import networkx.algorithms.community as nx_comm
+        cset = list(nx_comm.label_propagation_communities(G_wc))
+    else:
+        A, nodes = graph_to_csr(G_wc)
+        cset = labels_to_cset(detect_communities(A, method, resolution, seed), nodes)
     comms_file = os.path.join(loc_type,
                               loc + '_ingredients_communities_w' + str(wmin) + '_c' + str(cmin) + '_' + name + '.txt')
     with open(comms_file, 'w') as fout:
@@ -108,42 +112,30 @@ def detect_comm_write_to_file(G_reduced, G_wc, wmin, cmin, loc, loc_type, name='
 
 
 def modularity(G, c):
-    d = dict()
-    for k, v in enumerate(c):
-        for n in v:
-            d[n] = k
-    L = 0
-    for u, v, data in G.edges.data():
-        L += data['weight']
-    Q, Qmax = 0, 1
-    for u in G.nodes():
-        for v in G.nodes():
-            if d[u] == d[v]:
-                Auv = 0
-                if G.has_edge(v, u):
-                    Auv = G[v][u]['weight']
-                Q += (Auv - G.in_degree(u, weight='weight') * G.out_degree(v, weight='weight') / L) / L
-                Qmax -= (G.in_degree(u, weight='weight') * G.out_degree(v, weight='weight') / L) / L
-    return Q, Qmax
+    """
+    Modularity of the partition c (iterable of node sets) of G, computed on the sparse weighted adjacency
+    from per-community strength sums. Works for directed and undirected graphs.
+    Returns Q and Qmax
+    """
+    A, nodes = graph_to_csr(G)
+    labels = communities_to_labels(c, nodes)
+    return csr_modularity(A, labels, directed=G.is_directed())
 
 
 def scalar_assortativity(G, d):
-    x = np.zeros(G.number_of_nodes())
-    for i, n in enumerate(G.nodes()):
-        x[i] = d[n]
-
-    A = np.array(nx.adjacency_matrix(G).todense().T)
-    M = 2 * A.sum().sum()
-    ki = A.sum(axis=1)  # row sum is in-degree
-    ko = A.sum(axis=0)  # column sum is out-degree
-    mu = (np.dot(ki, x) + np.dot(ko, x)) / M
-
-    R, Rmax = 0, 0
-    for i in range(G.number_of_nodes()):
-        for j in range(G.number_of_nodes()):
-            R += (A[i, j] * (x[i] - mu) * (x[j] - mu)) / M
-            Rmax += (A[i, j] * (x[i] - mu) ** 2) / M
-
+    """
+    Scalar assortativity of a node attribute, computed from the sparse adjacency
+    d: dictionary of node attribute values, or a list of such dictionaries (e.g. several nutrient fractions)
+    Returns R and Rmax (arrays with one entry per dictionary when d is a list)
+    """
+    A, nodes = graph_to_csr(G)
+    if isinstance(d, dict):
+        x = np.array([d[n] for n in nodes], dtype=float)
+    else:
+        x = np.array([[di[n] for di in d] for n in nodes], dtype=float)
+    R, Rmax = csr_scalar_assortativity(A, x)
+    if x.ndim == 1:
+        return float(R), float(Rmax)
     return R, Rmax
 
 
@@ -151,7 +143,14 @@ def scalar_assortativity(G, d):
 # Analysis Plotting/Printing Fxns #
 # ############################### #
 def plot_cset_hist(cset, show, save, filename):
-    comm_sizes = [len(comm) for comm in cset]
+    """
+    cset: list of communities (node sets), or a partition array with the community index of each node
+    """
+    if isinstance(cset, np.ndarray):
+        comm_sizes = community_sizes(cset)
+    else:
+        comm_sizes = [len(comm) for comm in cset]
+    import matplotlib.pyplot as plt
     plt.hist(comm_sizes, 20)
     plt.xlabel('community sizes')
     if save:
@@ -162,6 +161,13 @@ def plot_cset_hist(cset, show, save, filename):
         plt.close()
 
 
+def top_k_table(G_reduced, v, k=5):
+    """
+    Returns the k nodes with the highest values in v as a list of (node, title, value)
+    """
+    return [(node, G_reduced.nodes[node]['title'], value) for node, value in top_k_items(v, k)]
+
+
 def print_top_k(G_reduced, v, k=5, verbose=True):
     """
     G_reduced: networkx graph that contains recipes with titles
@@ -169,8 +175,10 @@ def print_top_k(G_reduced, v, k=5, verbose=True):
     k: number of nodes with the highest values in v to print
     """
     result = []
-    top_k_nodes = [key for key, value in sorted(v.items(), key=lambda x: x[1], reverse=True)[:k]]
-    top_k_values = [value for key, value in sorted(v.items(), key=lambda x: x[1], reverse=True)[:k]]
+    top_k_nodes, top_k_values = [], []
+    for key, value in top_k_items(v, k):
+        top_k_nodes.append(key)
+        top_k_values.append(value)
     if verbose:
         print(f"The top {k} nodes with the highest degree are: {top_k_nodes}")
     result.append("The top " + str(k) + " nodes with the highest degree are: ")
@@ -182,8 +190,48 @@ def print_top_k(G_reduced, v, k=5, verbose=True):
 
 
 def plot_degree_dist(G, show=True, save=False, save_name=''):
-    ddist = degree_distribution(G, normalize=False)
-    cdist = cumulative_degree_distribution(G)
+    _, degrees = degree_array(G)
+    ddist = distribution(degrees, normalize=False)
+    cdist = ccdf(ddist / float(len(degrees)))
+    plot_degree_dist_arrays(ddist, cdist, show, save, save_name)
+
+
+def plot_strength_dist(G, show=True, save=False, save_name='', bins=50):
+    _, strengths = degree_array(G, weight='weight')
+    sdist, edges = strength_distribution(strengths, bins, normalize=False, log_bins=True)
+    plot_strength_dist_arrays(sdist, edges, show, save, save_name)
+
+
+def plot_strength_dist_arrays(sdist, edges, show=True, save=False, save_name=''):
+    """
+    sdist: histogram of the weighted degrees (strengths)
+    edges: its bin edges (logarithmic, see graph_statistics.strength_distribution)
+    """
+    import matplotlib.pyplot as plt
+    cdist = ccdf(sdist / max(sdist.sum(), 1.))
+
+    plt.figure(figsize=(8, 12))
+    plt.subplot(211)
+    plt.bar(edges[:-1], sdist, width=np.diff(edges), align='edge', color='b')
+    plt.xscale('log')
+
+    plt.subplot(212)
+    plt.loglog(edges[:-1], cdist)
+    plt.grid(True)
+    if save:
+        plt.savefig(save_name)
+    if show:
+        plt.show()
+    else:
+        plt.close()
+
+
+def plot_degree_dist_arrays(ddist, cdist, show=True, save=False, save_name=''):
+    """
+    ddist: degree histogram
+    cdist: cumulative (complementary) degree distribution
+    """
+    import matplotlib.pyplot as plt
     k = np.arange(len(ddist))
 
     plt.figure(figsize=(8, 12))
@@ -199,3 +247,45 @@ def plot_degree_dist(G, show=True, save=False, save_name=''):
         plt.show()
     else:
         plt.close()
+
+
+# ########## #
+# Test cases #
+# ########## #
+def test_modularity(num_graphs=50, seed=0):
+    """
+    Compares modularity with networkx on a corpus of random weighted (di)graphs and partitions
+    """
+    import networkx.algorithms.community as nx_comm
+    rng = np.random.default_rng(seed)
+    for i in range(num_graphs):
+        n = int(rng.integers(5, 60))
+        G = nx.gnm_random_graph(n, int(rng.integers(n, 4 * n)), seed=i, directed=bool(i % 2))
+        for u, v in G.edges():
+            G[u][v]['weight'] = int(rng.integers(1, 10))
+        labels = rng.integers(0, int(rng.integers(1, 6)), n)
+        c = [set(np.flatnonzero(labels == k)) for k in np.unique(labels)]
+        Q, _ = modularity(G, c)
+        assert np.isclose(Q, nx_comm.modularity(G, c, weight='weight')), i
+
+
+def test_wc_grid(num_graphs=10, seed=0):
+    """
+    Compares the backbone sizes of wc_grid with the G_wc views on random weighted graphs, for thresholds below,
+    between, at, and above the edge weights
+    """
+    from backbone import wc_grid
+    rng = np.random.default_rng(seed)
+    wmin_list, cmin_list = [0, 1, 2.5, 3, 5, 9, 10], [1, 2, 3, 5, 8]
+    for i in range(num_graphs):
+        n = int(rng.integers(5, 40))
+        G = nx.gnm_random_graph(n, int(rng.integers(1, 2 * n)), seed=i)
+        for u, v in G.edges():
+            G[u][v]['weight'] = int(rng.integers(1, 10))
+        grid = wc_grid(G, wmin_list, cmin_list)
+        for a, wmin in enumerate(wmin_list):
+            for b, cmin in enumerate(cmin_list):
+                view = G_wc(G, wmin, cmin)
+                assert grid['nodes'][a, b] == view.number_of_nodes(), (i, wmin, cmin)
+                assert grid['edges'][a, b] == view.number_of_edges(), (i, wmin, cmin)
+                assert grid['components'][a, b] == nx.number_connected_components(view), (i, wmin, cmin)
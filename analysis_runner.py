@@ -0,0 +1,143 @@
+"""
+Runs the ingredients projection analyses for many locations concurrently.
+Each location's projection is loaded once and its CSR arrays are placed in shared memory, so the worker processes
+that run the diameter, degree, betweenness, and degree and strength distribution jobs attach to them without
+copying.
+"""
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import scipy.sparse as sp
+
+from betweenness import betweenness, adaptive_betweenness
+from graph_statistics import distribution, ccdf, strength_distribution
+from ingredients_graph_processing import load_graph
+from sparse_graph_functions import graph_to_csr, csr_diameter
+from stage_profiler import profiled
+
+METRICS = ['diameter', 'degree', 'betweenness', 'degree_distribution', 'strength_distribution']
+
+
+class SharedCSR:
+    """
+    CSR matrix whose arrays live in shared memory blocks.
+    Instances are small (names, shapes, and dtypes) and are pickled to the workers, which attach to the blocks.
+    """
+    def __init__(self, A):
+        self.shape = A.shape
+        self.arrays = {}
+        self._blocks = []
+        for key in ['indptr', 'indices', 'data']:
+            arr = getattr(A, key)
+            block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[:] = arr
+            self.arrays[key] = (block.name, arr.shape, arr.dtype.str)
+            self._blocks.append(block)
+
+    def __getstate__(self):
+        return {'shape': self.shape, 'arrays': self.arrays, '_blocks': []}
+
+    def attach(self):
+        """
+        Returns a CSR matrix backed by the shared blocks and the blocks (keep them open while the matrix is in use)
+        """
+        blocks, arrays = [], {}
+        for key, (name, shape, dtype) in self.arrays.items():
+            block = _attach_block(name)
+            blocks.append(block)
+            arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        A = sp.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=self.shape, copy=False)
+        return A, blocks
+
+    def release(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+def _attach_block(name):
+    try:
+        # the creating process owns the block, so the worker must not track (and unlink) it
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        return shared_memory.SharedMemory(name=name)
+
+
+def compute_metric(A, metric, weight_mode='similarity', eps=None, delta=0.1, top_k=None):
+    """
+    Computes one metric on the CSR projection A
+    weight_mode: how betweenness reads the weights, 'similarity' (co-occurrence counts, inverted so that frequent
+                 pairs are close), 'distance', or None (unweighted)
+    eps, delta, top_k: if eps is given, betweenness samples sources until its top_k ranking (or every value, when
+                       top_k is None) is correct up to eps with probability 1 - delta (adaptive_betweenness)
+    """
+    if metric == 'diameter':
+        return csr_diameter(A)
+    elif metric == 'degree':
+        return np.diff(A.indptr)
+    elif metric == 'betweenness':
+        if eps is None:
+            return betweenness(A, weight_mode=weight_mode)
+        bc, _, _ = adaptive_betweenness(A, eps, delta, top_k, weight_mode, seed=0)
+        return bc
+    elif metric == 'degree_distribution':
+        ddist = distribution(np.diff(A.indptr), normalize=False)
+        return {'ddist': ddist, 'cdist': ccdf(ddist / float(A.shape[0]))}
+    elif metric == 'strength_distribution':
+        sdist, edges = strength_distribution(np.asarray(A.sum(axis=1)).ravel(), normalize=False, log_bins=True)
+        return {'sdist': sdist, 'edges': edges}
+    else:
+        raise ValueError('Unsupported metric.')
+
+
+def _run_job(shared, metric, options):
+    t0 = time.time()
+    A, blocks = shared.attach()
+    try:
+        value = compute_metric(A, metric, **options)
+    finally:
+        del A
+        for block in blocks:
+            block.close()
+    return value, time.time() - t0
+
+
+@profiled()
+def run_all_locations(locations, metrics=METRICS, n_jobs=4, verbose=True, weight_mode='similarity', eps=None,
+                      delta=0.1, top_k=None):
+    """
+    locations: list of (loc, loc_type) pairs
+    metrics: metrics to compute for every location
+    weight_mode, eps, delta, top_k: betweenness options (compute_metric)
+    Returns a dictionary keyed by (loc_type, loc, metric) with
+        'value': the metric (node values are ordered as 'nodes')
+        'nodes': node order of the projection
+        'time': seconds spent in the job
+    and a dictionary keyed by (loc_type, loc) with the reduced recipe-ingredient graph (for node titles)
+    """
+    shared, nodes, graphs = {}, {}, {}
+    try:
+        for loc, loc_type in locations:
+            graphs[(loc_type, loc)] = load_graph(loc, loc_type, reduced=True, projI=False, projR=False)
+            Gi = load_graph(loc, loc_type, reduced=True, projI=True, projR=False)
+            A, nodes[(loc_type, loc)] = graph_to_csr(Gi)
+            shared[(loc_type, loc)] = SharedCSR(A)
+
+        results = {}
+        options = {'weight_mode': weight_mode, 'eps': eps, 'delta': delta, 'top_k': top_k}
+        with ProcessPoolExecutor(n_jobs) as executor:
+            futures = {executor.submit(_run_job, shared[key], metric, options): key + (metric,)
+                       for key in shared for metric in metrics}
+            for future in as_completed(futures):
+                key = futures[future]
+                value, elapsed = future.result()
+                results[key] = {'value': value, 'nodes': nodes[key[:2]], 'time': elapsed}
+                if verbose:
+                    print(key, 'done in', round(elapsed, 2), 's')
+    finally:
+        for s in shared.values():
+            s.release()
+    return results, graphs
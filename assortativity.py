@@ -5,56 +5,149 @@ from copy import deepcopy
 
 import numpy as np
 from analysis_functions import modularity
-from networkx.algorithms.community import modularity as nx_modularity
+from sparse_graph_functions import graph_to_csr, csr_modularity
+from modularity_sampling import class_labels, bootstrap_modularity, permutation_modularity
 from ingredients_graph_processing import load_graph
 import os
-import pandas as pd
+import pickle
 import networkx as nx
-import random
 from tqdm import tqdm
-from plotting_functions import modularity_plot, modularity_bootstrap_plot
-from scipy.stats import mode
+from plotting_functions import modularity_plot, modularity_bootstrap_plot, FigureQueue
+from results_store import default_store
+from stage_profiler import profiled, record_graph
 
 
 
-def tag_graph(G, Gi, df):
-    to_remove = []
+def parse_nutrient_value(value):
+    """
+    Nutrient values are strings with '-' for missing values
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.
+
+
+def dominant_macro(fats, carbs, protein):
+    """
+    Returns the strictly dominant macro-nutrient ('fats', 'carbs' or 'protein'), or None when there is a tie
+    """
+    if fats > carbs and fats > protein:
+        return 'fats'
+    elif carbs > fats and carbs > protein:
+        return 'carbs'
+    elif protein > fats and protein > carbs:
+        return 'protein'
+    return None
+
+
+def build_ingredient_macro_index(df, agg='median'):
+    """
+    One pass over the dataset that aggregates the fat/carb/protein values of each ingredient across all recipes it
+    appears in and labels the ingredient with its dominant macro-nutrient.
+    df: dataframe with the 'ingredient information' column
+    agg: 'median' or 'mean'
+    Returns a dictionary from ingredient name to 'fats', 'carbs' or 'protein' (ingredients without a dominant
+    macro-nutrient are left out)
+    """
+    if agg == 'median':
+        agg_fn = np.median
+    elif agg == 'mean':
+        agg_fn = np.mean
+    else:
+        raise ValueError('Unsupported aggregation.')
+
+    values = {}
+    for ingredients in df['ingredient information']:
+        if not isinstance(ingredients, dict):
+            continue
+        for name, info in ingredients.items():
+            # entries without some macro-nutrient count it as 0, like the entry macros of mmap_dataset
+            values.setdefault(name, []).append((parse_nutrient_value(info.get('lipid (fat) (g)')),
+                                                parse_nutrient_value(info.get('carbohydrates')),
+                                                parse_nutrient_value(info.get('protein (g)'))))
+    macro_index = {}
+    for name, vals in values.items():
+        nut = dominant_macro(*agg_fn(np.array(vals), axis=0))
+        if nut is not None:
+            macro_index[name] = nut
+    return macro_index
+
+
+def build_ingredient_macro_index_from_dataset(dataset, agg='median'):
+    """
+    Same as build_ingredient_macro_index from the entry arrays of a memory-mapped dataset (mmap_dataset.py).
+    The entries are grouped by ingredient with one sort instead of a pass over the dataframe.
+    """
+    if agg not in ['median', 'mean']:
+        raise ValueError('Unsupported aggregation.')
+    ingredient, macros = dataset.ingredient_entry_macros()
+    order = np.argsort(ingredient, kind='stable')
+    ingredient, macros = np.asarray(ingredient)[order], np.asarray(macros)[order]
+    starts = np.flatnonzero(np.r_[True, ingredient[1:] != ingredient[:-1]])
+    ends = np.r_[starts[1:], len(ingredient)]
+    vocab = dataset.ingredient_vocab
+    macro_index = {}
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        vals = macros[start:end]
+        fats, carbs, protein = np.median(vals, axis=0) if agg == 'median' else vals.mean(axis=0)
+        nut = dominant_macro(fats, carbs, protein)
+        if nut is not None:
+            macro_index[str(vocab[ingredient[start]])] = nut
+    return macro_index
+
+
+def _macro_index_key(data_file, agg, dataset):
+    """
+    What a persisted index was built from: the aggregation, the source file (the metadata of a dataset, which is
+    rewritten on every write and append), and its modification time
+    """
+    source = os.path.abspath(os.path.join(dataset.path, 'metadata.json') if dataset is not None else data_file)
+    return {'agg': agg, 'source': source, 'mtime': os.path.getmtime(source) if os.path.exists(source) else None}
+
+
+def save_ingredient_macro_index(macro_index, filename='ingredient_macro_index.pkl', key=None):
+    with open(filename, 'wb') as fout:
+        pickle.dump({'key': key, 'index': macro_index}, fout)
+
+
+def load_ingredient_macro_index(filename='ingredient_macro_index.pkl', data_file='RDB_full_data_filtered.pkl',
+                                agg='median', dataset=None):
+    """
+    Loads the persisted ingredient macro-nutrient index, and builds it again from data_file when it is missing or
+    was built with another aggregation or from another or older source
+    dataset: memory-mapped dataset (mmap_dataset.MappedDataset) the index is built from instead of data_file
+    """
+    key = _macro_index_key(data_file, agg, dataset)
+    if os.path.exists(filename):
+        with open(filename, 'rb') as fin:
+            saved = pickle.load(fin)
+        cached = saved.get('key') if isinstance(saved, dict) and 'index' in saved else None
+        # without the source, any index of the same aggregation is better than none
+        if cached is not None and cached['agg'] == agg and \
+                (key['mtime'] is None or (cached['source'], cached['mtime']) == (key['source'], key['mtime'])):
+            return saved['index']
+    if dataset is not None:
+        macro_index = build_ingredient_macro_index_from_dataset(dataset, agg)
+    else:
+        import pandas as pd
+        macro_index = build_ingredient_macro_index(pd.read_pickle(data_file), agg)
+    save_ingredient_macro_index(macro_index, filename, key)
+    return macro_index
+
+
+def tag_graph(G, Gi, macro_index):
+    """
+    Labels each ingredient of Gi with its dominant macro-nutrient from macro_index.
+    Ingredients that cannot be labeled are left out of the returned subgraph.
+    """
+    tags = {}
     for node in Gi.nodes():
-        remove = False
-        ingredient_name = G.nodes[node]['title']
-        nnode = list(G.neighbors(node))[0]  # recipe that uses this ingredient
-        recipe_name = G.nodes[nnode]['title']
-        df_idx_list = list(df.index[df['recipe title'] == recipe_name])
-        ingredient_nutrients = {}
-        for df_idx in df_idx_list:
-            try:
-                row = df.iloc[[df_idx]]
-                ingredient_nutrients = list(row['ingredient information'])[0][ingredient_name]
-            except:
-                to_remove.append(node)
-                continue
-        if len(ingredient_nutrients) == 0:
-            to_remove.append(node)
-            remove = True
-        else:
-            fats = float(ingredient_nutrients['lipid (fat) (g)']) if ingredient_nutrients['lipid (fat) (g)'] != '-' else 0
-            carbs = float(ingredient_nutrients['carbohydrates']) if ingredient_nutrients['carbohydrates'] != '-' else 0
-            protein = float(ingredient_nutrients['protein (g)']) if ingredient_nutrients['protein (g)'] != '-' else 0
-            if fats > carbs and fats > protein:
-                nut = 'fats'
-            elif carbs > fats and carbs > protein:
-                nut = 'carbs'
-            elif protein > fats and protein > carbs:
-                nut = 'protein'
-            else:
-                to_remove.append(node)
-                remove = True
-        if not remove:
-            nx.set_node_attributes(Gi, {node: {'title': ingredient_name, 'main nutrient': nut}})
-
-    Gi_new = deepcopy(Gi)
-    Gi_new.remove_nodes_from(to_remove)
-    return Gi_new
+        nut = macro_index.get(G.nodes[node]['title'])
+        if nut is not None:
+            tags[node] = {'title': G.nodes[node]['title'], 'main nutrient': nut}
+    nx.set_node_attributes(Gi, tags)
+    return Gi.subgraph(tags.keys())
 
 
 def get_modularity_classes(G):
@@ -64,52 +157,39 @@ def get_modularity_classes(G):
     return classes
 
 
-def downsample_graph_nodes(G, frac_remain=0.1):
-    nodes = G.nodes()
-    n_final = int(np.ceil(len(nodes) * frac_remain))
-    downsampled_nodes = random.sample(nodes, n_final)
-    G_sampled = G.subgraph(downsampled_nodes)
-    return G_sampled
-
-
-def compute_modularity(loc, loc_type, frac_remain_list, bootstrap=False):
+@profiled()
+def compute_modularity(loc, loc_type, frac_remain_list, macro_index, bootstrap=False, n_boot=10, seed=0, n_jobs=1):
     """
-    Computes modularity
+    Computes modularity of the nutrient classes on the full graph and on random node subsets
+    n_boot: number of bootstrap replicates per fraction (each with its own seeded RNG stream)
+    n_jobs: number of processes the replicates are spread across
     """
     # load and tag the graphs
     G_orig = load_graph(loc, loc_type + '_data', reduced=True, projI=False, projR=False)
     G_i = load_graph(loc, loc_type + '_data', reduced=True, projI=True, projR=False)
-    filename = os.path.join(loc_type + "_data", loc)
-    df = pd.read_pickle(filename + '.pkl')
-    G = tag_graph(G_orig, G_i, df)
-    c = get_modularity_classes(G)
-    Q_nx = nx_modularity(G, c.values(), weight='weight')
-
-    Q_nx_samp_list = []
-    Q_bootstrap = {}
-    for frac_remain in frac_remain_list:
-        G_samp = downsample_graph_nodes(G, frac_remain=frac_remain)
-        c_samp = get_modularity_classes(G_samp)
-        Q_nx_samp_list.append(nx_modularity(G_samp, c_samp.values(), weight='weight'))
-        if not bootstrap:
-            continue
-        Q_bootstrap[str(frac_remain)] = []
-        for _ in range(10):
-            G_samp = downsample_graph_nodes(G, frac_remain=frac_remain)
-            c_samp = get_modularity_classes(G_samp)
-            Q_bootstrap[str(frac_remain)].append(nx_modularity(G_samp, c_samp.values(), weight='weight'))
+    G = tag_graph(G_orig, G_i, macro_index)
+    record_graph(G, 'tagged ingredients projection')
+    A, nodes = graph_to_csr(G)
+    labels = class_labels(G, nodes)
+    Q_nx, _ = csr_modularity(A, labels)
+
+    samples = bootstrap_modularity(A, labels, frac_remain_list, n_boot if bootstrap else 1, seed, n_jobs)
+    Q_nx_samp_list = [samples[str(frac_remain)][0] for frac_remain in frac_remain_list]
+    Q_bootstrap = samples if bootstrap else {}
     return Q_nx, Q_nx_samp_list, Q_bootstrap
 
 
-def modularity_analysis(loc_list, loc_type, save_plots, show_plots, bootstrap=False):
+def modularity_analysis(loc_list, loc_type, save_plots, show_plots, bootstrap=False, n_boot=10, seed=0, n_jobs=1,
+                        queue=None, frac_remain_list=(0.5, 0.8, 0.99)):
     Q = []
     Q_samp_lists = []
     Q_bootstraps = []
-    frac_remain_list = [0.5, 0.8, 0.99]
     for _ in frac_remain_list:
         Q_samp_lists.append([])
+    macro_index = load_ingredient_macro_index()
     for loc in tqdm(loc_list, total=len(loc_list), bar_format='{l_bar}{bar:30}{r_bar}', colour='white'):
-        Q_loc, Qsamp_loc, Q_bootstrap = compute_modularity(loc, loc_type, frac_remain_list, bootstrap)
+        Q_loc, Qsamp_loc, Q_bootstrap = compute_modularity(loc, loc_type, frac_remain_list, macro_index, bootstrap,
+                                                           n_boot, seed, n_jobs)
         Q.append(Q_loc)
         for Qs, Qs_loc in zip(Q_samp_lists, Qsamp_loc):
             Qs.append(Qs_loc)
@@ -122,7 +202,7 @@ def modularity_analysis(loc_list, loc_type, save_plots, show_plots, bootstrap=Fa
     legend.extend(['Q_sampled_' + str(frac) for frac in frac_remain_list])
     y = [Q]
     y.extend(Q_samp_lists)
-    modularity_plot(y, loc_list, legend, title='full vs sampled', save_path=filename, show=show_plots)
+    modularity_plot(y, loc_list, legend, title='full vs sampled', save_path=filename, show=show_plots, queue=queue)
 
     if bootstrap:
         bootstrap_trace = {'mode': [], 'min': [], 'max': []}
@@ -132,15 +212,45 @@ def modularity_analysis(loc_list, loc_type, save_plots, show_plots, bootstrap=Fa
         for Q_bootstrap in Q_bootstraps:
             for k, vals in Q_bootstrap.items():
                 bootstrap_traces[k]['mode'].append(np.mean(vals))
-                bootstrap_traces[k]['min'].append(min(vals))
-                bootstrap_traces[k]['max'].append(max(vals))
-        modularity_bootstrap_plot(Q, bootstrap_traces, loc_list, 'full vs sampled', filename, False)
+                bootstrap_traces[k]['min'].append(np.min(vals))
+                bootstrap_traces[k]['max'].append(np.max(vals))
+        modularity_bootstrap_plot(Q, bootstrap_traces, loc_list, 'full vs sampled', filename, False, queue)
+
+
+@profiled()
+def modularity_significance(loc_list, loc_type, n_perm=10000, seed=0, save=True, store=None):
+    """
+    Label-permutation test of the modularity of the fats/carbs/protein classes for each location
+    store: ResultsStore the results are saved to when save is True (the default store when not given), as the
+           'modularity_Q', 'modularity_z', and 'modularity_p' scalars keyed by n_perm and seed
+    Returns a dictionary from location to the observed Q, z-score, and p-value
+    """
+    with default_store(store, save) as store:
+        macro_index = load_ingredient_macro_index()
+        results = {}
+        for loc in tqdm(loc_list, total=len(loc_list), bar_format='{l_bar}{bar:30}{r_bar}', colour='white'):
+            G_orig = load_graph(loc, loc_type + '_data', reduced=True, projI=False, projR=False)
+            G_i = load_graph(loc, loc_type + '_data', reduced=True, projI=True, projR=False)
+            G = tag_graph(G_orig, G_i, macro_index)
+            A, nodes = graph_to_csr(G)
+            res = permutation_modularity(A, class_labels(G, nodes), n_perm, seed)
+            results[loc] = {'Q': res['Q'], 'z': res['z'], 'p': res['p']}
+            if save:
+                for name, value in results[loc].items():
+                    store.upsert_scalar(loc_type + '_data', loc, 'modularity_' + name, value,
+                                        {'n_perm': n_perm, 'seed': seed})
+        return results
 
 
 def main():
     save_plots = True
     show_plots = False
     bootstrap = True
+    n_boot = 1000
+    seed = 0
+    n_jobs = os.cpu_count()
+    permutation_test = True
+    n_perm = 10000
     countries = ['Argentine', 'Australian', 'Canadian', 'Chinese',
                  'English', 'French', 'German', 'Greek',
                  'Indian', 'Irish', 'Italian',
@@ -150,14 +260,22 @@ def main():
                'Mexican', 'South American', 'US']
     continents = ['Asian', 'European', 'Latin American', 'North American']
 
-    loc_type = 'country'
-    modularity_analysis(countries, loc_type, save_plots, show_plots, bootstrap)
+    # all figures are exported together at the end
+    with FigureQueue() as queue:
+        loc_type = 'country'
+        modularity_analysis(countries, loc_type, save_plots, show_plots, bootstrap, n_boot, seed, n_jobs, queue)
+        if permutation_test:
+            modularity_significance(countries, loc_type, n_perm, seed)
 
-    loc_type = 'region'
-    modularity_analysis(regions, loc_type, save_plots, show_plots, bootstrap)
+        loc_type = 'region'
+        modularity_analysis(regions, loc_type, save_plots, show_plots, bootstrap, n_boot, seed, n_jobs, queue)
+        if permutation_test:
+            modularity_significance(regions, loc_type, n_perm, seed)
 
-    loc_type = 'continent'
-    modularity_analysis(continents, loc_type, save_plots, show_plots, bootstrap)
+        loc_type = 'continent'
+        modularity_analysis(continents, loc_type, save_plots, show_plots, bootstrap, n_boot, seed, n_jobs, queue)
+        if permutation_test:
+            modularity_significance(continents, loc_type, n_perm, seed)
 
 
 if __name__ == "__main__":
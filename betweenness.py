@@ -0,0 +1,296 @@
+"""
+Betweenness centrality engine on the CSR adjacency of a graph.
+Brandes' algorithm is run over batches of sources that can be spread across processes, and the partial dependency
+sums are merged. Sources can also be sampled adaptively until empirical-Bernstein confidence intervals show that the
+estimate is accurate enough, or that its top-k ranking is.
+"""
+from collections import deque
+from heapq import heappush, heappop
+from multiprocessing import Pool
+
+import numpy as np
+
+from mmap_dataset import TemporaryDataset, open_dataset
+
+
+def edge_lengths(A, weight_mode='distance'):
+    """
+    Converts the weights of a CSR adjacency matrix into edge lengths
+    weight_mode: 'distance' (weights are lengths), 'similarity' (weights are inverted, so frequent pairs are close),
+                 or None (unweighted)
+    """
+    L = A.copy()
+    if weight_mode is None:
+        L.data = np.ones_like(L.data)
+    elif weight_mode == 'similarity':
+        L.data = 1. / L.data
+    elif weight_mode != 'distance':
+        raise ValueError('Unsupported weight mode.')
+    return L
+
+
+def _brandes_bfs(indptr, indices, s, n):
+    S = []
+    P = [[] for _ in range(n)]
+    sigma = [0.] * n
+    sigma[s] = 1.
+    dist = [-1] * n
+    dist[s] = 0
+    Q = deque([s])
+    while Q:
+        v = Q.popleft()
+        S.append(v)
+        dv = dist[v] + 1
+        for w in indices[indptr[v]:indptr[v + 1]].tolist():
+            if dist[w] < 0:
+                dist[w] = dv
+                Q.append(w)
+            if dist[w] == dv:
+                sigma[w] += sigma[v]
+                P[w].append(v)
+    return S, P, sigma
+
+
+def _brandes_dijkstra(indptr, indices, lengths, s, n):
+    S = []
+    P = [[] for _ in range(n)]
+    sigma = [0.] * n
+    sigma[s] = 1.
+    dist = {}
+    seen = {s: 0}
+    heap = [(0, s, s)]
+    while heap:
+        d, pred, v = heappop(heap)
+        if v in dist:
+            continue
+        sigma[v] += sigma[pred]
+        S.append(v)
+        dist[v] = d
+        start, end = indptr[v], indptr[v + 1]
+        for w, length in zip(indices[start:end].tolist(), lengths[start:end].tolist()):
+            vw_dist = d + length
+            if w not in dist and (w not in seen or vw_dist < seen[w]):
+                seen[w] = vw_dist
+                heappush(heap, (vw_dist, v, w))
+                sigma[w] = 0.
+                P[w] = [v]
+            elif vw_dist == seen[w]:
+                sigma[w] += sigma[v]
+                P[w].append(v)
+    return S, P, sigma
+
+
+def brandes_partial(indptr, indices, lengths, sources, n, weighted=True, squares=False):
+    """
+    Sum of the dependencies of all nodes on the given sources (unscaled betweenness restricted to these sources)
+    squares: also return the sum of the squared dependencies (for the variance of sampled estimates)
+    The neighbors of a node are read from the (possibly memory-mapped) indices and lengths arrays when it is visited,
+    so only indptr is converted to a list, like the other per-node arrays of the search.
+    """
+    indptr = indptr.tolist()
+    bc = np.zeros(n)
+    sq = np.zeros(n) if squares else None
+    for s in sources:
+        if weighted:
+            S, P, sigma = _brandes_dijkstra(indptr, indices, lengths, s, n)
+        else:
+            S, P, sigma = _brandes_bfs(indptr, indices, s, n)
+        delta = dict.fromkeys(S, 0.)
+        while S:
+            w = S.pop()
+            coeff = (1 + delta[w]) / sigma[w]
+            for v in P[w]:
+                delta[v] += sigma[v] * coeff
+            if w != s:
+                bc[w] += delta[w]
+                if squares:
+                    sq[w] += delta[w] ** 2
+    return (bc, sq) if squares else bc
+
+
+# Each worker opens the temporary dataset of the edge lengths once, when the pool starts. brandes_partial reads the
+# mapped arrays in place, so the workers share their pages (through the OS page cache) instead of each holding a copy
+_worker_graph = {}
+
+
+def _init_worker(path, weighted):
+    L = open_dataset(path).matrix('lengths')
+    _worker_graph.update(indptr=L.indptr, indices=L.indices, lengths=L.data, n=L.shape[0], weighted=weighted)
+
+
+def _worker_partial(args):
+    sources, squares = args
+    g = _worker_graph
+    return brandes_partial(g['indptr'], g['indices'], g['lengths'], sources, g['n'], g['weighted'], squares)
+
+
+class BetweennessEngine:
+    """
+    Computes betweenness from batches of sources, optionally in a pool of worker processes.
+    Use it as a context manager so that the worker pool is closed afterwards.
+    """
+    def __init__(self, A, weight_mode='distance', n_jobs=1, batch_size=64):
+        L = edge_lengths(A, weight_mode)
+        self.n = L.shape[0]
+        self.weighted = weight_mode is not None
+        self.batch_size = batch_size
+        self.graph = (L.indptr, L.indices, L.data, self.n, self.weighted)
+        self.shared, self.pool = None, None
+        if n_jobs > 1:
+            self.shared = TemporaryDataset({'lengths': L})
+            self.pool = Pool(n_jobs, initializer=_init_worker, initargs=(self.shared.path, self.weighted))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.shared is not None:
+            self.shared.close()
+            self.shared = None
+
+    def partial(self, sources, squares=False):
+        """
+        Dependency sums over the given sources, merged across the source batches
+        squares: also return the sums of the squared dependencies
+        """
+        if self.pool is None:
+            indptr, indices, lengths, n, weighted = self.graph
+            return brandes_partial(indptr, indices, lengths, sources, n, weighted, squares)
+        batches = [(sources[i:i + self.batch_size], squares) for i in range(0, len(sources), self.batch_size)]
+        bc, sq = np.zeros(self.n), np.zeros(self.n)
+        for part in self.pool.imap_unordered(_worker_partial, batches):
+            if squares:
+                bc += part[0]
+                sq += part[1]
+            else:
+                bc += part
+        return (bc, sq) if squares else bc
+
+
+def rescale(bc, n, directed=False, normalized=True, k=None):
+    """
+    Rescales dependency sums the same way networkx does
+    k: number of sampled sources (None when all sources were used)
+    """
+    if normalized:
+        scale = 1 / ((n - 1) * (n - 2)) if n > 2 else None
+    else:
+        scale = 0.5 if not directed else None
+    if scale is None:
+        return bc
+    if k is not None:
+        scale = scale * n / k
+    return bc * scale
+
+
+def top_k_separated(est, k, half_width, eps=0.):
+    """
+    True when the k largest estimates est +- half_width (a number or one half width per node) are separated from the
+    remaining ones up to eps: every node outside the top k has at most eps more betweenness than any node in it, for
+    every betweenness vector within the intervals. With eps = 0 the top-k set is exact.
+    """
+    if k >= len(est):
+        return True
+    half_width = np.broadcast_to(half_width, est.shape)
+    order = np.argsort(-est, kind='stable')
+    top, rest = order[:k], order[k:]
+    return (est[top] - half_width[top]).min() >= (est[rest] + half_width[rest]).max() - eps
+
+
+def betweenness(A, weight_mode='distance', directed=False, normalized=True, n_jobs=1, batch_size=64):
+    """
+    Exact betweenness over all sources of the CSR graph A
+    """
+    n = A.shape[0]
+    with BetweennessEngine(A, weight_mode, n_jobs, batch_size) as engine:
+        bc = engine.partial(np.arange(n))
+    return rescale(bc, n, directed, normalized)
+
+
+def bernstein_half_width(total, total_sq, m, log_term):
+    """
+    Empirical-Bernstein half width (Maurer and Pontil, 2009) of the mean of m samples in [0, 1], from their sum and
+    sum of squares. The true mean is within it with probability 1 - delta when log_term = log(4 / delta).
+    Nodes whose contributions barely vary get a half width close to 7 log_term / (3 (m - 1)).
+    """
+    mean = total / m
+    var = np.maximum(total_sq / m - mean ** 2, 0) * m / (m - 1)
+    return np.sqrt(2 * var * log_term / m) + 7 * log_term / (3 * (m - 1))
+
+
+def adaptive_betweenness(A, eps=0.01, delta=0.1, top_k=None, weight_mode='distance', directed=False,
+                         n_jobs=1, batch_size=64, seed=None):
+    """
+    Normalized betweenness estimated from uniformly sampled sources.
+    Sources are added in rounds of doubling size. After each round, every node gets an empirical-Bernstein confidence
+    interval with a union bound over the nodes and the rounds. Sampling stops when, with probability at least
+    1 - delta, every estimate is within eps of the exact normalized betweenness, or (when top_k is given) when the
+    top_k nodes are ranked correctly up to eps: no node outside them has more than eps more betweenness than a node
+    in them (top_k_separated). The ranking used by print_top_k and top_k_table is then correct up to eps.
+    A source s adds delta_s(v) / (n - 2) in [0, 1] to node v. Most nodes get almost the same contribution from
+    every source, so their intervals are much narrower than a Hoeffding bound, which only uses the range.
+    When the intervals cannot get narrow enough before all the sources are used (e.g. when the betweenness of the
+    k-th and (k + 1)-th nodes differs by less than eps), the result is the exact betweenness.
+    Returns the estimates, the largest half width (0 when all sources were used), and the number of sources used.
+    """
+    n = A.shape[0]
+    if n <= 2:
+        return np.zeros(n), 0., n
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(n)
+    # the normalized estimate is n / (n - 1) times the mean per-source contribution
+    c = n / (n - 1)
+    total, total_sq = np.zeros(n), np.zeros(n)
+    m, rnd = 0, 0
+    step = max(batch_size, 2)
+    with BetweennessEngine(A, weight_mode, n_jobs, batch_size) as engine:
+        while m < n:
+            rnd += 1
+            sources = order[m:min(n, m + step)]
+            part, part_sq = engine.partial(sources, squares=True)
+            total += part
+            total_sq += part_sq
+            m += len(sources)
+            step *= 2
+            if m == n:
+                break
+            est = rescale(total, n, directed, normalized=True, k=m)
+            # two-sided intervals for n nodes, with delta / 2 ** rnd spent on round rnd
+            log_term = np.log(4 * n * 2 ** rnd / delta)
+            half_width = c * bernstein_half_width(total / (n - 2), total_sq / (n - 2) ** 2, m, log_term)
+            if half_width.max() <= eps:
+                return est, half_width.max(), m
+            if top_k is not None and top_k_separated(est, top_k, half_width, eps):
+                return est, half_width.max(), m
+    return rescale(total, n, directed, normalized=True), 0., n
+
+
+# ########## #
+# Test cases #
+# ########## #
+def test_adaptive_betweenness():
+    """
+    The top-k test with per-node half widths, and the sampled estimates against the exact betweenness of a graph
+    with one dominant hub
+    """
+    est = np.array([0.5, 0.3, 0.25, 0.1])
+    assert top_k_separated(est, 2, np.array([0.01, 0.01, 0.01, 0.15]))
+    assert not top_k_separated(est, 2, 0.04)
+    assert top_k_separated(est, 2, 0.04, eps=0.05)
+    import networkx as nx
+    import scipy.sparse as sp
+    G = nx.star_graph(400)
+    nx.add_path(G, range(1, 401))
+    A = sp.csr_matrix(nx.to_scipy_sparse_array(G, format='csr'))
+    exact = betweenness(A, None)
+    est, half_width, m = adaptive_betweenness(A, eps=0.3, delta=0.1, top_k=1, weight_mode=None, seed=0)
+    assert m < A.shape[0] and np.argmax(est) == 0 and np.all(np.abs(est - exact) <= half_width)
+    est, half_width, m = adaptive_betweenness(A, eps=1e-4, delta=0.1, weight_mode=None, seed=0)
+    assert m == A.shape[0] and half_width == 0. and np.allclose(est, exact)
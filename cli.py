@@ -0,0 +1,320 @@
+"""
+Command-line entry point of the pipeline.
+Every stage is a subcommand, and the location sets and thresholds that the scripts' main() functions define come from
+a JSON config file (defaults below). Example:
+    python cli.py config > study.json
+    python cli.py --config study.json --jobs 8 --cache-dir runs/study all
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+
+from printing_functions import print_colored
+import stage_profiler
+
+LOC_TYPES = ['country', 'region', 'continent']
+DATASET_DIR = 'dataset'
+
+DEFAULT_CONFIG = {
+    'data_file': 'RDB_full_data.pkl',
+    'seed': 0,
+    'locations': {
+        'country': ['Argentine', 'Australian', 'Canadian', 'Chinese', 'English', 'French', 'German', 'Greek',
+                    'Indian', 'Irish', 'Italian', 'Mexican', 'Nigerian', 'Thai', 'US'],
+        'region': ['Australian', 'Canadian', 'Chinese and Mongolian', 'French', 'Indian Subcontinent', 'Italian',
+                   'Mexican', 'South American', 'US'],
+        'continent': ['Asian', 'European', 'Latin American', 'North American'],
+    },
+    'process': {
+        'min_recip': {'country': 2500, 'region': 5000, 'continent': 10000},
+        # memory-mapped copy of the core arrays for the worker processes (mmap_dataset.py)
+        'write_dataset': True,
+        # near-duplicate recipes (recipe_dedup.py): mode is null (off), 'mark', 'drop', or 'collapse'
+        'dedup': {'mode': None, 'threshold': 0.8, 'match_titles': True, 'loc_type': 'country', 'num_perm': 128,
+                  'bands': 16},
+    },
+    'ingredients': {
+        # [dmin_r, dmin_i] per location type, and per location where it differs
+        'dmin': {'country': [5, 3], 'region': [5, 7], 'continent': [10, 70]},
+        'dmin_overrides': {'country': {'Italian': [5, 25], 'Mexican': [5, 25]},
+                           'region': {'Italian': [5, 40], 'Mexican': [5, 40]},
+                           'continent': {'North American': [10, 40]}},
+        'null_samples': 0,
+    },
+    'nutrients': {
+        'main_nutrients': ['Total fats (g)', 'Protein (g)', 'Carbohydrates (g)', 'Sugars, total (g)',
+                           'Fiber, total dietary (g)'],
+        'labels': ['Fats', 'Proteins', 'Carbs', 'Sugars', 'Fiber'],
+        'wmin': 0.15,
+    },
+    'analysis': {
+        'top_k': 50,
+        # betweenness on the co-occurrence weights: 'similarity' (frequent pairs are close), 'distance', or null
+        'betweenness_weights': 'similarity',
+        # error of the sampled betweenness top-k ranking (null for the exact betweenness), and its failure probability
+        'betweenness_eps': None,
+        'betweenness_delta': 0.1,
+        'individual_plots': True,
+        'save_plots': True,
+    },
+    'assortativity': {
+        'frac_remain_list': [0.5, 0.8, 0.99],
+        'bootstrap': True,
+        'n_boot': 1000,
+        'permutation_test': True,
+        'n_perm': 10000,
+    },
+}
+
+DIRS = [os.path.join('figures', 'degree_dist'), os.path.join('figures', 'radar'), os.path.join('figures', 'matrix'),
+        os.path.join('figures', 'modularity')]
+
+
+# ###### #
+# Config #
+# ###### #
+def merge_config(base, update):
+    """
+    Recursively updates a copy of base with the entries of update
+    """
+    merged = copy.deepcopy(base)
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_config(filename=None):
+    if filename is None:
+        return copy.deepcopy(DEFAULT_CONFIG)
+    with open(filename, 'r') as f:
+        return merge_config(DEFAULT_CONFIG, json.load(f))
+
+
+def make_dirs():
+    for path in DIRS:
+        os.makedirs(path, exist_ok=True)
+
+
+def location_lists(cfg, loc_types):
+    return {loc_type: cfg['locations'][loc_type] for loc_type in loc_types}
+
+
+def ingredient_thresholds(cfg, loc_type, loc):
+    dmin_r, dmin_i = cfg['ingredients']['dmin_overrides'].get(loc_type, {}).get(loc,
+                                                                                cfg['ingredients']['dmin'][loc_type])
+    return dmin_r, dmin_i
+
+
+# ###### #
+# Stages #
+# ###### #
+def run_process(cfg, args):
+    import pandas as pd
+    import process_data
+    df = pd.read_pickle(cfg['data_file'])
+    dedup = cfg['process']['dedup']
+    if dedup['mode'] is not None:
+        from recipe_dedup import deduplicate
+        df = deduplicate(df, dedup['mode'], dedup['threshold'], dedup['match_titles'], dedup['loc_type'],
+                         dedup['num_perm'], dedup['bands'], cfg['seed'], verbose=args.verbose)
+    df = process_data.generate_normalized_nutri_info(df)
+    df.to_pickle('RDB_full_data_filtered.pkl')
+    if cfg['process']['write_dataset']:
+        from mmap_dataset import write_dataset
+        write_dataset(df, DATASET_DIR)
+    for loc_type in args.loc_types:
+        dfs = process_data.generate_location_dfs(df, cfg['process']['min_recip'][loc_type], loc_type)
+        process_data.save_location_dfs(dfs, path=loc_type + '_data')
+
+
+def run_build(cfg, args):
+    from construct_graphs import build_graph_for_list
+    for loc_type, loc_list in location_lists(cfg, args.loc_types).items():
+        build_graph_for_list(loc_list, loc_type + '_data')
+
+
+def run_reduce_ingredients(cfg, args):
+    import ingredients_graph_processing as igp
+    for loc_type, loc_list in location_lists(cfg, args.loc_types).items():
+        for loc in loc_list:
+            dmin_r, dmin_i = ingredient_thresholds(cfg, loc_type, loc)
+            igp.load_reduce_save(loc, loc_type + '_data', dmin_r, dmin_i, verbose=args.verbose, save=True)
+            igp.load_reduced_project_save(loc, loc_type + '_data', save=True,
+                                          null_samples=cfg['ingredients']['null_samples'], seed=cfg['seed'],
+                                          n_jobs=args.jobs)
+
+
+def run_reduce_nutrients(cfg, args):
+    import nutrients_graph_processing as ngp
+    for loc_type, loc_list in location_lists(cfg, args.loc_types).items():
+        for loc in loc_list:
+            ngp.load_reduce_save(loc, loc_type + '_data', cfg['nutrients']['main_nutrients'],
+                                 cfg['nutrients']['wmin'], verbose=args.verbose, save=True)
+            ngp.load_reduced_project_save(loc, loc_type + '_data', save=True)
+
+
+def run_analyze_ingredients(cfg, args):
+    from ingredients_graphs_analysis import analyze_graph, analyze_all_graphs
+    from results_store import ResultsStore
+    top_k, weight_mode = cfg['analysis']['top_k'], cfg['analysis']['betweenness_weights']
+    eps, delta = cfg['analysis']['betweenness_eps'], cfg['analysis']['betweenness_delta']
+    with ResultsStore() as store:
+        if args.jobs > 1:
+            locations = [(loc, loc_type + '_data')
+                         for loc_type, loc_list in location_lists(cfg, args.loc_types).items() for loc in loc_list]
+            diams = analyze_all_graphs(locations, top_k=top_k, show=False, save=True, n_jobs=args.jobs, store=store,
+                                       weight_mode=weight_mode, eps=eps, delta=delta)
+        else:
+            diams = {}
+            for loc_type, loc_list in location_lists(cfg, args.loc_types).items():
+                for loc in loc_list:
+                    print_colored(loc, 'y')
+                    diams[(loc_type + '_data', loc)] = analyze_graph(loc, loc_type + '_data', top_k=top_k,
+                                                                      show=False, save=True, store=store,
+                                                                      weight_mode=weight_mode, eps=eps, delta=delta)
+        for (loc_type, loc), diam in diams.items():
+            store.upsert_scalar(loc_type, loc, 'diameter', diam)
+
+
+def run_analyze_nutrients(cfg, args):
+    from nutrients_graphs_analysis import categories, plot_nutrients_analysis
+    from plotting_functions import FigureQueue
+    main_nutrients, labels = cfg['nutrients']['main_nutrients'], cfg['nutrients']['labels']
+    _, combs_list = categories(main_nutrients)
+    combs, _ = categories(labels)
+    with FigureQueue() as queue:
+        for loc_type, loc_list in location_lists(cfg, args.loc_types).items():
+            plot_nutrients_analysis(loc_list, loc_type, cfg['analysis']['individual_plots'], combs, combs_list,
+                                    main_nutrients, labels, cfg['analysis']['save_plots'], False, verbose=args.verbose,
+                                    queue=queue)
+
+
+def run_assortativity(cfg, args):
+    from assortativity import modularity_analysis, modularity_significance, load_ingredient_macro_index
+    from plotting_functions import FigureQueue
+    acfg = cfg['assortativity']
+    if os.path.exists(DATASET_DIR):
+        # builds and saves the ingredient index from the mapped arrays, the analyses then load the saved index
+        from mmap_dataset import open_dataset
+        load_ingredient_macro_index(dataset=open_dataset(DATASET_DIR))
+    with FigureQueue() as queue:
+        for loc_type, loc_list in location_lists(cfg, args.loc_types).items():
+            modularity_analysis(loc_list, loc_type, cfg['analysis']['save_plots'], False, acfg['bootstrap'],
+                                acfg['n_boot'], cfg['seed'], args.jobs, queue, acfg['frac_remain_list'])
+            if acfg['permutation_test']:
+                modularity_significance(loc_list, loc_type, acfg['n_perm'], cfg['seed'])
+
+
+def run_report(cfg, args):
+    from ingredients_graphs_analysis_result_plots_and_tabels import plot_graph_diameter_results, \
+        table_graph_centralities, table_modularity_significance
+    from results_store import ResultsStore
+    with ResultsStore() as store:
+        plot_graph_diameter_results(store, show=False, save=True)
+        for centrality in ['degree_centrality', 'betweenness_centrality']:
+            for loc_type in args.loc_types:
+                table_graph_centralities(store, centrality, loc_type + '_data')
+        for loc_type in args.loc_types:
+            table_modularity_significance(store, loc_type + '_data',
+                                          {'n_perm': cfg['assortativity']['n_perm'], 'seed': cfg['seed']})
+
+
+def run_update(cfg, args):
+    """
+    Adds the recipes of the --delta pickle to the dataset, the location data, and the reduced ingredients graphs of
+    the locations it touches
+    """
+    import pandas as pd
+    from incremental_updates import apply_delta
+    if not os.path.exists(DATASET_DIR):
+        raise FileNotFoundError('the update needs the dataset written by the process stage (' + DATASET_DIR + ')')
+    touched = apply_delta(pd.read_pickle(args.delta), DATASET_DIR, location_lists(cfg, args.loc_types),
+                          lambda loc_type, loc: ingredient_thresholds(cfg, loc_type, loc), n_jobs=args.jobs,
+                          verbose=args.verbose)
+    print_colored('Updated: ' + ', '.join(loc_type + '/' + loc for loc, loc_type in touched), 'g')
+
+
+STAGES = [('process', run_process, 'normalize the nutrients and split the data by location'),
+          ('build', run_build, 'build the recipe-ingredient and recipe-nutrient graphs'),
+          ('reduce-ingredients', run_reduce_ingredients, 'prune and project the ingredients graphs'),
+          ('reduce-nutrients', run_reduce_nutrients, 'prune and project the nutrients graphs'),
+          ('analyze-ingredients', run_analyze_ingredients, 'diameters and centralities of the ingredients graphs'),
+          ('analyze-nutrients', run_analyze_nutrients, 'nutrient pair plots of the nutrients graphs'),
+          ('assortativity', run_assortativity, 'modularity of the macro-nutrient classes'),
+          ('report', run_report, 'diameter plots and centrality and modularity tables from the store')]
+
+
+def run_all(cfg, args):
+    for name, stage, _ in STAGES:
+        print_colored(name, 'g')
+        with stage_profiler.stage(name):
+            stage(cfg, args)
+
+
+def comma_list(value):
+    return [v for v in value.split(',') if v]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Recipe analysis pipeline')
+    parser.add_argument('--config', default=None, help='JSON config file (merged over the defaults)')
+    parser.add_argument('--jobs', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--cache-dir', default='.',
+                        help='directory the location data, graphs, results, and figures are read from and written to')
+    parser.add_argument('--loc-types', type=comma_list, default=LOC_TYPES,
+                        help='comma-separated location types (default: ' + ','.join(LOC_TYPES) + ')')
+    parser.add_argument('--profile', action='store_true', help='write a stage profiler trace to results/trace.json')
+    parser.add_argument('--profile-stages', type=comma_list, default=[],
+                        help='comma-separated stages or instrumented functions to run under a profiler '
+                             '(with --profile)')
+    parser.add_argument('--verbose', action='store_true')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, _, help_text in STAGES:
+        subparsers.add_parser(name, help=help_text)
+    subparsers.add_parser('all', help='run every stage in order')
+    subparsers.add_parser('config', help='print the config in use (JSON)')
+    update = subparsers.add_parser('update', help='add new recipes to the ingredients graphs of their locations')
+    update.add_argument('delta', help='pickled dataframe of the new recipes (columns of the combined data file)')
+    args = parser.parse_args(argv)
+    for loc_type in args.loc_types:
+        if loc_type not in LOC_TYPES:
+            parser.error('unsupported location type: ' + loc_type)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cfg = load_config(args.config)
+    if args.command == 'config':
+        json.dump(cfg, sys.stdout, indent=1)
+        print()
+        return
+
+    # the data file is given relative to where the command is run, everything else lives in the cache directory
+    cfg['data_file'] = os.path.abspath(cfg['data_file'])
+    if args.command == 'update':
+        args.delta = os.path.abspath(args.delta)
+    os.makedirs(args.cache_dir, exist_ok=True)
+    os.chdir(args.cache_dir)
+    make_dirs()
+    profiler = stage_profiler.enable(profile_stages=args.profile_stages) if args.profile else None
+
+    stages = {name: stage for name, stage, _ in STAGES}
+    stages['all'] = run_all
+    stages['update'] = run_update
+    try:
+        with stage_profiler.stage(args.command):
+            stages[args.command](cfg, args)
+    finally:
+        if profiler is not None:
+            profiler.save()
+            profiler.summary(depth=1 if args.command == 'all' else 0)
+
+
+if __name__ == "__main__":
+    main()
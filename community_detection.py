@@ -0,0 +1,339 @@
+"""
+Community detection on the sparse weighted projection: label propagation, Louvain, and Leiden.
+Every method is deterministic for a given seed and returns a partition array (community index of each node).
+Example (runtime and modularity of every method on the projection of a location):
+    python community_detection.py --loc Italian --loc-type country
+"""
+import argparse
+import time
+from multiprocessing import Pool
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse import csgraph
+
+from mmap_dataset import TemporaryDataset, open_dataset
+from sparse_graph_functions import csr_modularity
+from printing_functions import print_colored
+
+
+def relabel(labels):
+    """
+    Renumbers community labels as 0, 1, ... in order of first appearance
+    """
+    _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=int)
+    rank[np.argsort(first)] = np.arange(len(first))
+    return rank[inverse]
+
+
+def community_sizes(labels):
+    """
+    Number of nodes in each community of a partition array
+    """
+    return np.bincount(labels)
+
+
+def labels_to_cset(labels, nodes):
+    """
+    Converts a partition array into a list of node sets (the format used by networkx)
+    """
+    cset = [set() for _ in range(labels.max() + 1)]
+    for n, c in zip(nodes, labels):
+        cset[c].add(n)
+    return cset
+
+
+def _neighbors(A, indptr, i):
+    """
+    (neighbor, weight) pairs of node i. They are read from A when i is visited, so the indices and data arrays of a
+    memory-mapped A are not copied (indptr is the list of A.indptr, which is as small as the per-node state)
+    """
+    start, end = indptr[i], indptr[i + 1]
+    return zip(A.indices[start:end].tolist(), A.data[start:end].tolist())
+
+
+# ################# #
+# Label propagation #
+# ################# #
+def label_propagation(A, seed=0, max_iter=100):
+    """
+    Asynchronous weighted label propagation. Nodes are visited in a seeded random order and adopt the label with the
+    largest total edge weight among their neighbors. Ties keep the current label if possible, otherwise the
+    smallest label wins, so the result only depends on the seed.
+    """
+    n = A.shape[0]
+    rng = np.random.default_rng(seed)
+    indptr = A.indptr.tolist()
+    labels = list(range(n))
+    for _ in range(max_iter):
+        changed = False
+        for i in rng.permutation(n).tolist():
+            if indptr[i] == indptr[i + 1]:
+                continue
+            weights = {}
+            for j, w in _neighbors(A, indptr, i):
+                lab = labels[j]
+                weights[lab] = weights.get(lab, 0) + w
+            best = max(weights.values())
+            if weights.get(labels[i], None) == best:
+                continue
+            labels[i] = min(lab for lab, w in weights.items() if w == best)
+            changed = True
+        if not changed:
+            break
+    return relabel(np.array(labels))
+
+
+# ####### #
+# Louvain #
+# ####### #
+def _local_moving(A, resolution, rng, init=None):
+    """
+    Moves single nodes to the neighboring community with the largest modularity gain until no move improves it
+    init: initial community of each node (singletons when None)
+    """
+    n = A.shape[0]
+    indptr = A.indptr.tolist()
+    k = np.asarray(A.sum(axis=1)).ravel().tolist()
+    two_m = sum(k)
+    labels = list(range(n)) if init is None else init.tolist()
+    tot = [0.] * n  # total strength of each community
+    for i, lab in enumerate(labels):
+        tot[lab] += k[i]
+    moved = False
+    improved = True
+    while improved:
+        improved = False
+        for i in rng.permutation(n).tolist():
+            ci = labels[i]
+            weights = {}
+            for j, w in _neighbors(A, indptr, i):
+                if j != i:
+                    lab = labels[j]
+                    weights[lab] = weights.get(lab, 0) + w
+            tot[ci] -= k[i]
+            scale = resolution * k[i] / two_m
+            best, best_gain = ci, weights.get(ci, 0) - scale * tot[ci]
+            for lab, w in weights.items():
+                gain = w - scale * tot[lab]
+                if gain > best_gain:
+                    best, best_gain = lab, gain
+            tot[best] += k[i]
+            if best != ci:
+                labels[i] = best
+                improved = moved = True
+    return relabel(np.array(labels)), moved
+
+
+def _split_disconnected(A, labels):
+    """
+    Splits every community into its connected components. This only guarantees connected communities; the
+    refinement phase of the Leiden algorithm (leiden below) also merges the parts that are well connected.
+    """
+    rows = np.repeat(np.arange(A.shape[0]), np.diff(A.indptr))
+    intra = labels[rows] == labels[A.indices]
+    A_intra = sp.csr_matrix((A.data[intra], (rows[intra], A.indices[intra])), shape=A.shape)
+    _, comps = csgraph.connected_components(A_intra, directed=False)
+    return relabel(comps)
+
+
+def _aggregate(A, labels):
+    """
+    Graph of communities: A' = P^T A P where P is the node-community membership matrix
+    """
+    P = sp.csr_matrix((np.ones(len(labels)), (np.arange(len(labels)), labels)))
+    return sp.csr_matrix(P.T @ A @ P)
+
+
+def louvain(A, resolution=1., seed=0, split_disconnected=False, max_levels=20):
+    """
+    Louvain modularity maximization on a symmetric CSR adjacency matrix
+    resolution: modularity resolution parameter (larger values give smaller communities)
+    split_disconnected: split the communities that are not connected into their components after each level
+    """
+    rng = np.random.default_rng(seed)
+    labels = np.arange(A.shape[0])
+    G = sp.csr_matrix(A)
+    for _ in range(max_levels):
+        level_labels, moved = _local_moving(G, resolution, rng)
+        if split_disconnected:
+            level_labels = _split_disconnected(G, level_labels)
+        labels = level_labels[labels]
+        if not moved:
+            break
+        G = _aggregate(G, level_labels)
+    return relabel(labels)
+
+
+# ###### #
+# Leiden #
+# ###### #
+def _refine(A, labels, resolution, rng):
+    """
+    Refinement phase of the Leiden algorithm. Every node starts in its own refined community, and the nodes that are
+    still alone are visited in random order and merged into the refined community of their own community (labels)
+    with the largest modularity gain. Only nodes and refined communities S that are well connected to the rest of
+    their community C are merged: w(S, C - S) >= resolution * k(S) * (k(C) - k(S)) / 2m.
+    Merges are greedy (the limit of the randomized choice of the Leiden paper with a vanishing randomness).
+    Returns the refined partition, whose communities are subsets of those of labels
+    """
+    n = A.shape[0]
+    indptr = A.indptr.tolist()
+    k = np.asarray(A.sum(axis=1)).ravel().tolist()
+    two_m = sum(k)
+    labels = labels.tolist()
+    tot_comm = {}
+    for i, c in enumerate(labels):
+        tot_comm[c] = tot_comm.get(c, 0) + k[i]
+    # weight from every node to the rest of its community
+    ext = [sum(w for j, w in _neighbors(A, indptr, i) if j != i and labels[j] == labels[i]) for i in range(n)]
+    refined = list(range(n))
+    tot = k[:]  # total strength of each refined community
+    size = [1] * n
+    for i in rng.permutation(n).tolist():
+        ri, c = refined[i], labels[i]
+        if size[ri] > 1 or ext[i] < resolution * k[i] * (tot_comm[c] - k[i]) / two_m:
+            continue
+        weights = {}
+        for j, w in _neighbors(A, indptr, i):
+            if j != i and labels[j] == c:
+                lab = refined[j]
+                weights[lab] = weights.get(lab, 0) + w
+        scale = resolution * k[i] / two_m
+        best, best_gain = ri, 0.
+        for lab, w in weights.items():
+            if ext[lab] < resolution * tot[lab] * (tot_comm[c] - tot[lab]) / two_m:
+                continue
+            gain = w - scale * tot[lab]
+            if gain > best_gain:
+                best, best_gain = lab, gain
+        if best != ri:
+            # the edges between i and best become internal
+            ext[best] += ext[i] - 2 * weights[best]
+            tot[best] += k[i]
+            size[best] += 1
+            tot[ri], size[ri] = 0., 0
+            refined[i] = best
+    return relabel(np.array(refined))
+
+
+def leiden(A, resolution=1., seed=0, max_levels=20):
+    """
+    Leiden modularity maximization on a symmetric CSR adjacency matrix (Traag, Waltman, and van Eck, 2019).
+    Every level moves nodes as Louvain does, refines the communities (_refine), and aggregates the graph by the
+    refined communities, with the unrefined ones as the starting partition of the aggregate graph. Communities are
+    therefore split when a part of them is not well connected, and are connected at every level.
+    resolution: modularity resolution parameter (larger values give smaller communities)
+    """
+    rng = np.random.default_rng(seed)
+    labels = np.arange(A.shape[0])  # node of the aggregate graph of each node of A
+    G = sp.csr_matrix(A)
+    init = None
+    for _ in range(max_levels):
+        level_labels, moved = _local_moving(G, resolution, rng, init)
+        refined = _refine(G, level_labels, resolution, rng)
+        if not moved and refined.max() + 1 == G.shape[0]:
+            break
+        # each refined community lies in one community, which is its starting community in the aggregate graph
+        init = np.zeros(refined.max() + 1, dtype=int)
+        init[refined] = level_labels
+        labels = refined[labels]
+        G = _aggregate(G, refined)
+        level_labels = init
+    return relabel(level_labels[labels])
+
+
+METHODS = ['label_propagation', 'louvain', 'louvain_connected', 'leiden']
+
+
+def detect_communities(A, method='louvain', resolution=1., seed=0):
+    """
+    A: symmetric CSR adjacency matrix
+    method: 'label_propagation', 'louvain', 'louvain_connected' (Louvain with disconnected communities split), or
+            'leiden'
+    """
+    if method == 'label_propagation':
+        return label_propagation(A, seed)
+    elif method == 'louvain':
+        return louvain(A, resolution, seed, split_disconnected=False)
+    elif method == 'louvain_connected':
+        return louvain(A, resolution, seed, split_disconnected=True)
+    elif method == 'leiden':
+        return leiden(A, resolution, seed)
+    else:
+        raise ValueError('Unsupported community detection method.')
+
+
+# Each worker opens the temporary dataset of the graph once, when the pool starts, instead of receiving the graph
+# with every resolution. The methods read the neighbors of the mapped graph in place (_neighbors), so the workers
+# share its pages; only the aggregate graphs of the later levels are built in each worker.
+_worker_graph = {}
+
+
+def _init_worker(path):
+    _worker_graph['A'] = open_dataset(path).matrix('A')
+
+
+def _detect_star(args):
+    return detect_communities(_worker_graph['A'], *args)
+
+
+def resolution_sweep(A, resolutions, method='louvain', seed=0, n_jobs=1):
+    """
+    Runs the detection for every resolution, in parallel across n_jobs processes
+    Returns a list of partition arrays and a list of community-size histograms
+    """
+    jobs = [(method, res, seed) for res in resolutions]
+    if n_jobs > 1:
+        with TemporaryDataset({'A': A}) as shared, \
+                Pool(n_jobs, initializer=_init_worker, initargs=(shared.path,)) as pool:
+            partitions = pool.map(_detect_star, jobs)
+    else:
+        partitions = [detect_communities(A, *job) for job in jobs]
+    return partitions, [community_sizes(labels) for labels in partitions]
+
+
+def benchmark(A, methods=METHODS, seed=0, verbose=True):
+    """
+    Times each method on A and reports the modularity and number of communities it finds
+    """
+    results = {}
+    for method in methods:
+        t0 = time.time()
+        labels = detect_communities(A, method, seed=seed)
+        elapsed = time.time() - t0
+        Q, _ = csr_modularity(A, labels)
+        results[method] = {'time': elapsed, 'modularity': Q, 'communities': int(labels.max() + 1)}
+        if verbose:
+            print_colored(method, 'g')
+            print('time: ', elapsed, 's, modularity: ', Q, ', communities: ', labels.max() + 1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runtime, modularity, and number of communities of each method')
+    parser.add_argument('--loc', default=None,
+                        help='location whose reduced ingredients projection is used (a synthetic one by default)')
+    parser.add_argument('--loc-type', default='country')
+    parser.add_argument('--recipes', type=int, default=20000, help='recipes of the synthetic incidence')
+    parser.add_argument('--ingredients', type=int, default=2000, help='ingredients of the synthetic incidence')
+    parser.add_argument('--methods', nargs='+', default=METHODS, choices=METHODS)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.loc is not None:
+        from ingredients_graph_processing import load_graph
+        from sparse_graph_functions import graph_to_csr
+        A, _ = graph_to_csr(load_graph(args.loc, args.loc_type + '_data', reduced=True, projI=True, projR=False))
+    else:
+        import synthetic_data
+        B = synthetic_data.sample_incidence(np.random.default_rng(args.seed), args.recipes, args.ingredients)
+        A = sp.csr_matrix(B.T @ B)
+        A.setdiag(0)
+        A.eliminate_zeros()
+    print_colored('Graph: ' + str(A.shape[0]) + ' nodes, ' + str(A.nnz // 2) + ' edges', 'y')
+    benchmark(A, args.methods, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ import os
 import pandas as pd
 import networkx as nx
 from tqdm import tqdm
+from stage_profiler import profiled
 
 
 def build_ingredients_graph(df, all_ingredients, save_gml=True, path=''):
@@ -49,9 +50,6 @@ def build_nutrients_graph(df, all_nutrients, save_gml=True, path=''):
     for idx, ingri in enumerate(all_nutrients):
         nutrients_dict[ingri] = idx + nutrients_start_idx
 
-    # initialize graph
-    ingredients_graph = nx.Graph()
-
     # Nutrients Graph
     nutrients_graph = nx.Graph()
 
@@ -80,9 +78,10 @@ def build_nutrients_graph(df, all_nutrients, save_gml=True, path=''):
         # print('Saving nutrients gml')
         nx.write_gml(nutrients_graph, path + '_nutrients.gml')
     # print('Done')
-    return ingredients_graph
+    return nutrients_graph
 
 
+@profiled()
 def build_graphs(df, path=''):
     # load ingredients and nutrients and create dictionaries
     all_ingredients = set().union(*df['ingredient information'])
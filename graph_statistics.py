@@ -0,0 +1,80 @@
+"""
+Vectorized statistics on degree/strength arrays: distributions, CCDFs, and top-k selection
+"""
+import numpy as np
+
+
+def degree_array(G, weight=None):
+    """
+    Returns the nodes of G and an array of their degrees (strengths when weight is given)
+    """
+    nodes, degrees = [], []
+    for n, d in G.degree(weight=weight):
+        nodes.append(n)
+        degrees.append(d)
+    return nodes, np.array(degrees, dtype=int if weight is None else float)
+
+
+def distribution(degrees, normalize=True):
+    """
+    Histogram of integer degrees (entry k is the number, or fraction, of nodes with degree k)
+    """
+    ddist = np.bincount(degrees).astype(float)
+    if normalize:
+        ddist = ddist / float(len(degrees))
+    return ddist
+
+
+def ccdf(ddist):
+    """
+    Complementary cumulative distribution: entry k is the sum of ddist[k:]
+    """
+    return np.cumsum(ddist[::-1])[::-1]
+
+
+def strength_distribution(strengths, bins=50, normalize=True, log_bins=False):
+    """
+    Histogram of (weighted) node strengths
+    log_bins: logarithmic bins between the smallest and largest positive strengths (nodes with strength 0 are not
+              counted), linear bins when there are fewer than two distinct positive strengths
+    Returns the counts (or fractions) and the bin edges
+    """
+    strengths = np.asarray(strengths, dtype=float)
+    if log_bins:
+        positive = strengths[strengths > 0]
+        if len(positive) > 0 and positive.max() > positive.min():
+            bins = np.logspace(np.log10(positive.min()), np.log10(positive.max()), bins + 1)
+    sdist, edges = np.histogram(strengths, bins=bins)
+    sdist = sdist.astype(float)
+    if normalize:
+        sdist = sdist / float(len(strengths))
+    return sdist, edges
+
+
+def top_k(values, k):
+    """
+    Indices of the k largest values in decreasing order. Ties keep their original order, as with a stable sort.
+    Uses a partial partition, so only the selected entries are sorted.
+    """
+    values = np.asarray(values)
+    n = len(values)
+    k = min(k, n)
+    if k <= 0:
+        return np.array([], dtype=int)
+    if k < n:
+        kth = values[np.argpartition(values, n - k)[n - k]]  # k-th largest value
+        above = np.flatnonzero(values > kth)
+        ties = np.flatnonzero(values == kth)[:k - len(above)]
+        idx = np.concatenate([above, ties])
+    else:
+        idx = np.arange(n)
+    return idx[np.lexsort((idx, -values[idx]))]
+
+
+def top_k_items(d, k):
+    """
+    The k (key, value) pairs of the dictionary d with the largest values, in decreasing order
+    """
+    keys = list(d.keys())
+    vals = list(d.values())
+    return [(keys[i], vals[i]) for i in top_k(vals, k)]
@@ -0,0 +1,77 @@
+"""
+Cold-start import time benchmark of the analysis modules.
+Every module is imported in a fresh interpreter several times and the median time is compared with its budget.
+The benchmark also checks that the plotting backends are not loaded by the import.
+Exits with status 1 if a module is over budget or loads a plotting backend.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+import numpy as np
+
+# seconds
+BUDGETS = {
+    'analysis_functions': 1.0,
+    'assortativity': 1.0,
+    'ingredients_graphs_analysis': 1.0,
+    'nutrients_graphs_analysis': 1.0,
+    'plotting_functions': 0.5,
+    'analysis_runner': 1.0,
+    'community_detection': 1.0,
+}
+LAZY_MODULES = ['matplotlib', 'plotly', 'scipy.stats', 'pandas']
+
+_SNIPPET = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+t = time.perf_counter() - t0
+print(json.dumps({{'time': t, 'loaded': [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+
+def import_time(module, repeats=5):
+    """
+    Median import time of module over repeats fresh interpreters, and the lazy modules the import loaded
+    """
+    times, loaded = [], set()
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, '-c', _SNIPPET.format(module=module, lazy=LAZY_MODULES)],
+                             capture_output=True, text=True, check=True).stdout
+        res = json.loads(out.strip().splitlines()[-1])
+        times.append(res['time'])
+        loaded.update(res['loaded'])
+    return float(np.median(times)), sorted(loaded)
+
+
+def run_benchmark(budgets=BUDGETS, repeats=5, scale=1.):
+    """
+    scale: multiplies every budget (e.g. for slower machines)
+    Returns the results as a dictionary from module to (time, budget, loaded lazy modules) and whether all passed
+    """
+    results, passed = {}, True
+    for module, budget in budgets.items():
+        t, loaded = import_time(module, repeats)
+        ok = t <= budget * scale and not loaded
+        passed = passed and ok
+        results[module] = (t, budget * scale, loaded)
+        print(f"{'ok  ' if ok else 'FAIL'} {module:<30} {t:7.3f} s (budget {budget * scale:.3f} s)"
+              + (f" loaded {', '.join(loaded)}" if loaded else ''))
+    return results, passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time benchmark')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--scale', type=float, default=1., help='multiplies every budget')
+    parser.add_argument('modules', nargs='*', help='modules to benchmark (default: all with a budget)')
+    args = parser.parse_args()
+    budgets = {m: BUDGETS.get(m, 1.) for m in args.modules} if args.modules else BUDGETS
+    _, passed = run_benchmark(budgets, args.repeats, args.scale)
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
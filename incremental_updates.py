@@ -0,0 +1,257 @@
+"""
+Incremental update of the ingredients graphs when recipes are added.
+The state of a location (saved in <dataset>/incremental/<loc_type>/<loc>.npz) holds, over the dataset's ingredient
+vocabulary:
+    the dataset rows of the location's recipes,
+    the ingredient degrees among the recipes with at least dmin_r ingredients,
+    the number of low degree ingredients of each of those recipes,
+    the co-occurrence counts C = B_kᵀ·B_k of the recipes B_k that survive the pruning.
+This is the pruning of ingredients_graph_processing.remove_recipes_and_ingredients_with_small_degree: recipes with
+fewer than dmin_r ingredients are removed, then ingredients with degree below dmin_i (or a title shorter than 2
+characters) together with every recipe that uses one of them.
+New recipes are rows appended to the incidence, so the co-occurrences grow by ΔBᵀ·ΔB of the new surviving rows.
+Degrees only increase, so an ingredient can only leave the low degree set, and the old recipes it held back are added
+in the same way once they have no low degree ingredient left. Only the locations of the delta are touched, and only
+the entries of C in the rows and columns of the added recipes change.
+The recipe projection (_reduced_ingProjR) and the null model scores of the projection are not updated.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import networkx as nx
+import scipy.sparse as sp
+
+from mmap_dataset import LOC_TYPES, append_dataset, map_locations
+import process_data
+from printing_functions import print_colored
+from stage_profiler import profiled
+
+STATE_DIR = 'incremental'
+
+
+# ############## #
+# Location state #
+# ############## #
+def _resize(C, n):
+    """
+    C as an n x n CSR matrix (the ingredient vocabulary only grows)
+    """
+    C = sp.csr_matrix(C)
+    if C.shape[0] < n:
+        C = sp.csr_matrix((C.data, C.indices, np.concatenate([C.indptr, np.full(n - C.shape[0], C.indptr[-1])])),
+                          shape=(n, n))
+    return C
+
+
+def _pad(arr, n):
+    return np.concatenate([arr, np.zeros(n - len(arr), dtype=arr.dtype)])
+
+
+def short_titles(dataset):
+    """
+    Mask of the ingredients whose title is shorter than 2 characters (always pruned)
+    """
+    return np.char.str_len(np.asarray(dataset.ingredient_vocab)) < 2
+
+
+def _low_degree(deg, short, dmin_i):
+    return (deg < dmin_i) | short
+
+
+def _cooccurrence(B):
+    B = sp.csr_matrix(B, dtype=np.int64)
+    return sp.csr_matrix(B.T @ B)
+
+
+def empty_state(dataset, dmin_r, dmin_i):
+    n = dataset.metadata['n_ingredients']
+    return {'rows': np.zeros(0, dtype=np.int64), 'deg': np.zeros(n, dtype=np.int64),
+            'n_low': np.zeros(0, dtype=np.int64), 'C': sp.csr_matrix((n, n), dtype=np.int64),
+            'dmin_r': dmin_r, 'dmin_i': dmin_i}
+
+
+@profiled('incremental.build_state')
+def build_state(dataset, loc_type, loc, dmin_r, dmin_i):
+    """
+    State of a location computed from all its recipes (what the incremental updates reproduce)
+    """
+    return update_state(empty_state(dataset, dmin_r, dmin_i), dataset, dataset.location_rows(loc_type, loc))
+
+
+def update_state(state, dataset, new_rows):
+    """
+    Adds the recipes of the dataset rows new_rows to the state of a location
+    """
+    n = dataset.metadata['n_ingredients']
+    dmin_r, dmin_i = state['dmin_r'], state['dmin_i']
+    short = short_titles(dataset)
+    B = dataset.incidence
+    rows, n_low, C = state['rows'], state['n_low'], _resize(state['C'], n)
+    deg_old = _pad(state['deg'], n)
+
+    # recipes with fewer than dmin_r ingredients are pruned first and never count; they are marked with n_low = -1
+    B_new = B[new_rows]
+    big = np.diff(B_new.indptr) >= dmin_r
+    deg = deg_old + np.asarray(B_new[big].sum(axis=0)).ravel().astype(np.int64)
+    low_old, low = _low_degree(deg_old, short, dmin_i), _low_degree(deg, short, dmin_i)
+    cleared = low_old & ~low
+
+    # old recipes held back by a low degree ingredient that is not low anymore
+    n_low = n_low.copy()
+    added = []
+    waiting = np.flatnonzero(n_low > 0)
+    if cleared.any() and len(waiting) > 0:
+        before = n_low[waiting]
+        n_low[waiting] -= (B[rows[waiting]] @ cleared.astype(np.int64)).astype(np.int64)
+        added.append(rows[waiting[(before > 0) & (n_low[waiting] == 0)]])
+
+    new_low = np.where(big, B_new @ low.astype(np.int64), -1).astype(np.int64)
+    added.append(np.asarray(new_rows)[new_low == 0])
+    added = np.concatenate(added)
+    if len(added) > 0:
+        C = C + _cooccurrence(B[np.sort(added)])
+
+    return {'rows': np.concatenate([rows, new_rows]).astype(np.int64), 'deg': deg,
+            'n_low': np.concatenate([n_low, new_low]), 'C': C, 'dmin_r': dmin_r, 'dmin_i': dmin_i}
+
+
+def kept_recipes(state):
+    """
+    Positions (in the location) of the recipes that survive the pruning
+    """
+    return np.flatnonzero(state['n_low'] == 0)
+
+
+def kept_ingredients(state):
+    # the diagonal of C counts the surviving recipes of each ingredient
+    return np.flatnonzero(state['C'].diagonal() > 0)
+
+
+def projection(state):
+    """
+    Ingredient co-occurrence weights of the pruned graph (the ingredients projection) without the diagonal
+    """
+    C = state['C'].copy()
+    C.setdiag(0)
+    C.eliminate_zeros()
+    return C
+
+
+def state_file(dataset_path, loc_type, loc):
+    return os.path.join(dataset_path, STATE_DIR, loc_type, loc + '.npz')
+
+
+def save_state(state, filename):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    C = state['C']
+    np.savez(filename, rows=state['rows'], deg=state['deg'], n_low=state['n_low'], C_data=C.data,
+             C_indices=C.indices, C_indptr=C.indptr, C_shape=np.array(C.shape),
+             dmin=np.array([state['dmin_r'], state['dmin_i']]))
+
+
+def load_state(filename):
+    with np.load(filename) as f:
+        C = sp.csr_matrix((f['C_data'], f['C_indices'], f['C_indptr']), shape=tuple(f['C_shape']))
+        return {'rows': f['rows'], 'deg': f['deg'], 'n_low': f['n_low'], 'C': C,
+                'dmin_r': int(f['dmin'][0]), 'dmin_i': int(f['dmin'][1])}
+
+
+# ###### #
+# Graphs #
+# ###### #
+def reduced_graphs(state, dataset):
+    """
+    The pruned recipe-ingredient graph and its ingredients projection, with the node numbering of construct_graphs:
+    recipes are numbered by their position in the location, and ingredients follow them
+    """
+    positions = kept_recipes(state)
+    rows = state['rows'][positions]
+    start = len(state['rows'])
+    titles, urls = dataset.array('recipe_title'), dataset.array('recipe_url')
+    locations = {loc_type: (dataset.array(loc_type + '_vocab'), dataset.array(loc_type + '_code'))
+                 for loc_type in LOC_TYPES}
+    G = nx.Graph()
+    for pos, row in zip(positions, rows):
+        attrs = {'url': int(urls[row]), 'title': str(titles[row])}
+        attrs.update({loc_type: str(vocab[codes[row]]) for loc_type, (vocab, codes) in locations.items()})
+        G.add_node(int(pos), **attrs)
+    ingredient_vocab = dataset.ingredient_vocab
+    ingredients = kept_ingredients(state)
+    G.add_nodes_from((start + int(i), {'title': str(ingredient_vocab[i])}) for i in ingredients)
+    B = dataset.incidence[rows]
+    for pos, k in zip(positions, range(len(rows))):
+        G.add_edges_from((int(pos), start + int(i)) for i in B.indices[B.indptr[k]:B.indptr[k + 1]])
+
+    P = sp.triu(projection(state)).tocoo()
+    G_i = nx.Graph()
+    G_i.add_nodes_from((start + int(i), {'bipartite': 1}) for i in ingredients)
+    G_i.add_weighted_edges_from((start + int(i), start + int(j), int(w)) for i, j, w in zip(P.row, P.col, P.data))
+    return G, G_i
+
+
+def save_reduced_graphs(loc, loc_type, G, G_i):
+    from ingredients_graph_processing import save_graph
+    save_graph(loc, loc_type + '_data', G, graph_type='_reduced')
+    save_graph(loc, loc_type + '_data', G_i, graph_type='_reduced_ingProjI')
+
+
+# ############# #
+# Delta updates #
+# ############# #
+def _append_location_df(loc, loc_type, delta):
+    filename = os.path.join(loc_type + '_data', loc + '.pkl')
+    df = pd.concat([pd.read_pickle(filename), delta], ignore_index=True) if os.path.exists(filename) else \
+        delta.reset_index(drop=True)
+    df.to_pickle(filename)
+
+
+def _update_location(dataset, loc_type, loc, group, new_rows, dmin_r, dmin_i, save_graphs):
+    """
+    Updates the state, the dataframe, and (when save_graphs) the reduced graphs of one location with the recipes of
+    group (its part of the delta), which are the dataset rows new_rows
+    Returns the number of recipes and ingredients left after the pruning
+    """
+    filename = state_file(dataset.path, loc_type, loc)
+    if os.path.exists(filename):
+        state = load_state(filename)
+        if (state['dmin_r'], state['dmin_i']) != (dmin_r, dmin_i):
+            raise ValueError('thresholds of ' + loc + ' changed, rebuild its state with build_state')
+        state = update_state(state, dataset, new_rows)
+    else:
+        # first update of the location: its state is built from all its recipes, which include the delta
+        state = build_state(dataset, loc_type, loc, dmin_r, dmin_i)
+    save_state(state, filename)
+    _append_location_df(loc, loc_type, group)
+    if save_graphs:
+        save_reduced_graphs(loc, loc_type, *reduced_graphs(state, dataset))
+    return len(kept_recipes(state)), len(kept_ingredients(state))
+
+
+@profiled('incremental.apply_delta')
+def apply_delta(delta, dataset_path, locations, thresholds, save_graphs=True, n_jobs=1, verbose=False):
+    """
+    Adds the recipes of the dataframe delta (columns of get_dataRDB) to the dataset, the location dataframes, the
+    location states, and the reduced ingredients graphs.
+    locations: dictionary from location type to the locations that are kept up to date
+    thresholds: function (loc_type, loc) -> (dmin_r, dmin_i)
+    n_jobs: number of processes the locations are updated in (the workers open the appended dataset once)
+    Returns the (loc, loc_type) pairs that were updated
+    """
+    if 'normalized nutrients by energy' not in delta:
+        delta = process_data.generate_normalized_nutri_info(delta.copy())
+    _, new_rows = append_dataset(dataset_path, delta)
+    delta = delta.reset_index(drop=True)
+    touched = []
+    for loc_type, loc_list in locations.items():
+        for loc, group in delta.groupby(loc_type):
+            if loc in loc_list:
+                touched.append((loc, loc_type, group))
+    jobs = [(loc_type, loc, (group, new_rows[group.index.to_numpy()]) + tuple(thresholds(loc_type, loc)) +
+             (save_graphs,)) for loc, loc_type, group in touched]
+    kept = map_locations(dataset_path, _update_location, jobs, n_jobs)
+    if verbose:
+        for (loc, _, group), (n_recipes, n_ingredients) in zip(touched, kept):
+            print_colored(loc + ': ' + str(len(group)) + ' new recipes, ' + str(n_recipes) + ' recipes and ' +
+                          str(n_ingredients) + ' ingredients after pruning', 'y')
+    return [(loc, loc_type) for loc, loc_type, _ in touched]
@@ -0,0 +1,136 @@
+"""
+Top-k ingredient similarity search over the recipe x ingredient incidence B.
+With n_i the number of recipes of ingredient i, c_ij the number of recipes of both, and N the number of recipes:
+    cosine   c_ij / sqrt(n_i * n_j)
+    jaccard  c_ij / (n_i + n_j - c_ij)
+    pmi      log(c_ij * N / (n_i * n_j))
+The exact search computes the co-occurrences of a block of query ingredients with every ingredient at once,
+B[:, q]ᵀ·B, so the full projection BᵀB is never built. This is the supported search at every scale.
+method='lsh' scores only the MinHash LSH candidates (minhash.py) over the recipe sets of the ingredients, for
+comparisons with similarity_benchmark.py. LSH finds the pairs with a high Jaccard similarity, but the most similar
+ingredients of an ingredient usually have a low one (well below 0.5), so a banding selective enough to be fast misses
+them, and one that finds them makes almost every ingredient a candidate.
+"""
+import numpy as np
+import scipy.sparse as sp
+
+from minhash import minhash_signatures, LSHIndex
+from stage_profiler import profiled
+
+METRICS = ['cosine', 'jaccard', 'pmi']
+
+
+def similarity(counts, n_q, n_j, n_recipes, metric):
+    """
+    Similarity of ingredient pairs from their co-occurrence counts and recipe counts (elementwise)
+    """
+    counts = counts.astype(float)
+    if metric == 'cosine':
+        return counts / np.sqrt(n_q * n_j)
+    if metric == 'jaccard':
+        return counts / (n_q + n_j - counts)
+    if metric == 'pmi':
+        return np.log(counts * n_recipes / (n_q * n_j))
+    raise ValueError('Unsupported metric: ' + metric)
+
+
+def _top_k(indices, scores, k):
+    if k <= 0:
+        return indices[:0], scores[:0]
+    if len(indices) > k:
+        # everything tied with the k-th score is kept, so that ties are broken by index below
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        keep = scores >= kth
+        indices, scores = indices[keep], scores[keep]
+    order = np.lexsort((indices, -scores))[:k]
+    return indices[order], scores[order]
+
+
+class SimilarityIndex:
+    """
+    B: recipe x ingredient incidence (sparse, nonzero entries are the recipe's ingredients)
+    names: ingredient names (queries can be given by name or index)
+    method: 'exact' (blocked sparse products) or 'lsh' (MinHash LSH candidates only, see the module docstring)
+    num_perm, bands: MinHash signature length and number of LSH bands of the 'lsh' method
+    min_count: pairs that co-occur in fewer recipes are ignored (PMI overrates rare pairs)
+    """
+    def __init__(self, B, names=None, method='exact', num_perm=128, bands=32, seed=0, block_size=256, min_count=1):
+        B = sp.csr_matrix(B, dtype=np.int64)
+        B.data[:] = 1
+        self.B = B
+        self.Bc = B.tocsc()
+        self.n_recipes = B.shape[0]
+        self.counts = np.diff(self.Bc.indptr)
+        self.names = None if names is None else np.asarray(names)
+        self._index = None if names is None else {str(name): i for i, name in enumerate(self.names)}
+        if method not in ['exact', 'lsh']:
+            raise ValueError('Unsupported method: ' + method)
+        self.method = method
+        self.block_size = block_size
+        self.min_count = min_count
+        self.lsh = None
+        if method == 'lsh':
+            # the sets are the recipes of each ingredient, i.e. the rows of Bᵀ
+            self.lsh = LSHIndex(minhash_signatures(self.Bc.T, num_perm, seed), bands)
+
+    @classmethod
+    def from_dataset(cls, dataset, loc_type=None, loc=None, **kwargs):
+        """
+        Index over a MappedDataset (mmap_dataset.py), for the whole dataset or the recipes of one location
+        """
+        B = dataset.incidence if loc is None else dataset.location_incidence(loc_type, loc)
+        return cls(B, names=dataset.ingredient_vocab, **kwargs)
+
+    def ingredient(self, query):
+        if isinstance(query, (int, np.integer)):
+            return int(query)
+        if self._index is None or query not in self._index:
+            raise KeyError('unknown ingredient: ' + str(query))
+        return self._index[query]
+
+    def _scored(self, q, cols, counts, metric):
+        keep = (cols != q) & (counts >= self.min_count)
+        cols, counts = cols[keep], counts[keep]
+        return cols, similarity(counts, self.counts[q], self.counts[cols], self.n_recipes, metric)
+
+    def _exact(self, queries, k, metric):
+        results = []
+        for start in range(0, len(queries), self.block_size):
+            block = queries[start:start + self.block_size]
+            C = sp.csr_matrix(self.Bc[:, block].T @ self.B)
+            for r, q in enumerate(block):
+                cols, counts = C.indices[C.indptr[r]:C.indptr[r + 1]], C.data[C.indptr[r]:C.indptr[r + 1]]
+                results.append(_top_k(*self._scored(q, cols, counts, metric), k))
+        return results
+
+    def _approximate(self, queries, k, metric):
+        results = []
+        for q in queries:
+            cols = self.lsh.candidates(q)
+            # exact co-occurrences of the candidates only
+            counts = np.asarray((self.Bc[:, [q]].T @ self.Bc[:, cols]).todense()).ravel()
+            cols, counts = cols[counts > 0], counts[counts > 0]
+            results.append(_top_k(*self._scored(q, cols, counts, metric), k))
+        return results
+
+    @profiled('similarity.query')
+    def query(self, ingredients, k=10, metric='cosine'):
+        """
+        Top k most similar ingredients of each of the ingredients (names or indices)
+        Returns a list with, for each query, a list of (ingredient, score) in decreasing score order
+        """
+        if metric not in METRICS:
+            raise ValueError('Unsupported metric: ' + metric)
+        single = isinstance(ingredients, (str, int, np.integer))
+        queries = [self.ingredient(q) for q in ([ingredients] if single else ingredients)]
+        raw = self._exact(queries, k, metric) if self.method == 'exact' else self._approximate(queries, k, metric)
+        results = [[(str(self.names[j]) if self.names is not None else int(j), float(s))
+                    for j, s in zip(cols, scores)] for cols, scores in raw]
+        return results[0] if single else results
+
+    def query_indices(self, queries, k=10, metric='cosine'):
+        """
+        Top k ingredient indices and scores for a list of ingredient indices (no name lookup)
+        """
+        queries = list(queries)
+        return self._exact(queries, k, metric) if self.method == 'exact' else self._approximate(queries, k, metric)
@@ -1,9 +1,8 @@
 import networkx as nx
-import numpy as np
-from copy import deepcopy
-import matplotlib.pyplot as plt
 from tqdm import tqdm
 import os
+from null_models import score_projection
+from stage_profiler import profiled
 
 
 # ########################## #
@@ -138,6 +137,7 @@ def save_reduced_graphs(loc_list, loc_type, loc_graphs):
 # ############################# #
 # Functions that do many things #
 # ############################# #
+@profiled('ingredients.load_reduce_save')
 def load_reduce_save(loc, loc_type, dmin_r=1, dmin_i=1, verbose=False, save=True):
     graph = load_graph(loc, loc_type)
     graph = remove_recipes_and_ingredients_with_small_degree(graph, dmin_r, dmin_i, verbose)
@@ -146,12 +146,20 @@ def load_reduce_save(loc, loc_type, dmin_r=1, dmin_i=1, verbose=False, save=True
     return graph
 
 
-def load_reduced_project_save(loc, loc_type, save=True):
+@profiled('ingredients.load_reduced_project_save')
+def load_reduced_project_save(loc, loc_type, save=True, null_samples=0, seed=0, n_jobs=1):
+    """
+    null_samples: if > 0, number of degree-preserving randomized incidences used to add over-representation
+                  scores to the edges of the ingredients projection
+    """
     graph = load_graph(loc, loc_type, reduced=True)
     recipe_graph, ingredients_graph = project_on_recipes(graph)
+    if null_samples > 0:
+        ingredients_graph = score_projection(graph, ingredients_graph, null_samples, seed=seed, n_jobs=n_jobs)
     if save:
         save_graph(loc, loc_type, recipe_graph, graph_type='_reduced_ingProjR')
         save_graph(loc, loc_type, ingredients_graph, graph_type='_reduced_ingProjI')
+    return recipe_graph, ingredients_graph
 
 
 # #################################################################################################################### #
@@ -1,53 +1,122 @@
-import networkx as nx
-import networkx.algorithms.community as nx_comm
-import numpy as np
-from copy import deepcopy
-import matplotlib.pyplot as plt
-from tqdm import tqdm
 import os
-from ingredients_graph_processing import load_graph, save_graph
-from colorama import init, Fore, Back, Style
-from analysis_functions import *
+from ingredients_graph_processing import load_graph
+from analysis_functions import diameter, degree_centrality, betweenness_centrality, top_k_table, plot_degree_dist, \
+    plot_degree_dist_arrays, plot_strength_dist, plot_strength_dist_arrays, G_wc, detect_comm_write_to_file, \
+    plot_cset_hist
 from printing_functions import print_colored
+from backbone import wc_grid
+from analysis_runner import run_all_locations, METRICS
+from results_store import ResultsStore, default_store
+from stage_profiler import profiled, record_graph
 
 
-def analyze_graph(loc, loc_type, top_k=10, show=True, save=False):
+@profiled()
+def backbone_communities(G, Gi, loc, loc_type, wmin_list, cmin_list, points, show=True, save=False, method=None):
+    """
+    Sizes of the (wmin, cmin) backbones of the projection Gi on the grid wmin_list x cmin_list, from a single sweep
+    over the edge weights (wc_grid), and the communities of the backbones at the chosen grid points, which are
+    detected on filtered views of Gi (G_wc) and written to file.
+    G: reduced recipe-ingredient graph (for node titles)
+    points: list of (wmin, cmin) pairs of the grid; the points whose backbone is empty are skipped
+    method: community detection method of detect_comm_write_to_file
+    Returns the grid and a dictionary from (wmin, cmin) to the communities found
+    """
+    for wmin, cmin in points:
+        if wmin not in wmin_list or cmin not in cmin_list:
+            raise ValueError('Backbone point ' + str((wmin, cmin)) + ' is not on the grid.')
+    grid = wc_grid(Gi, wmin_list, cmin_list)
+    print_colored('Backbone nodes (rows: wmin = ' + str(list(wmin_list)) + ', columns: cmin = ' + str(list(cmin_list)) +
+                  '):', 'g')
+    print(grid['nodes'])
+    csets = {}
+    for wmin, cmin in points:
+        if grid['nodes'][list(wmin_list).index(wmin), list(cmin_list).index(cmin)] == 0:
+            print('Empty backbone for wmin =', wmin, 'and cmin =', cmin)
+            continue
+        Gi_wc = G_wc(Gi, wmin, cmin)
+        cset_wc = detect_comm_write_to_file(G, Gi_wc, wmin, cmin, loc, loc_type, name='normal', method=method)
+        print('Number of communities found: ', len(cset_wc))
+        filename = os.path.join('figures', 'communities',
+                                loc_type + '_ ' + loc + '_w' + str(wmin) + '_c' + str(cmin) + '.png')
+        plot_cset_hist(cset_wc, show, save, filename)
+        csets[(wmin, cmin)] = cset_wc
+    return grid, csets
+
+
+@profiled()
+def analyze_graph(loc, loc_type, top_k=10, show=True, save=False, store=None, params=None, backbone=None,
+                  weight_mode='similarity', eps=None, delta=0.1):
+    """
+    store: ResultsStore the centralities are saved to (the default store is used when save is True)
+    params: run parameters the results are keyed by in the store
+    weight_mode: how the betweenness reads the co-occurrence weights of the projection: 'similarity' (inverted, so
+                 that frequent pairs are close), 'distance', or None (unweighted)
+    eps, delta: if eps is given, the betweenness is estimated from sampled sources until its top_k ranking is
+                correct up to eps with probability 1 - delta (exact betweenness otherwise)
+    backbone: None, or a dictionary with the wmin_list, cmin_list, and points (and optionally method) arguments of
+              backbone_communities to also detect the communities of backbones of the projection
+    """
     G = load_graph(loc, loc_type, reduced=True, projI=False, projR=False)
     Gi = load_graph(loc, loc_type, reduced=True, projI=True, projR=False)
+    record_graph(G, 'recipe-ingredient')
+    record_graph(Gi, 'ingredients projection')
     k = top_k
+    with default_store(store, save) as store:
+        print_colored('Diameter:', 'g')
+        diam = diameter(Gi)
+        print(diam)
+
+        print_colored('Top ' + str(k) + ' in degree centrality: ', 'g')
+        degree_cent1 = degree_centrality(Gi)
+        if save:
+            store.upsert_ranking(loc_type, loc, 'degree_centrality', top_k_table(G, degree_cent1, k), params)
+
+        print_colored('Top ' + str(k) + ' in betweenness centrality: ', 'g')
+        betweenness1 = betweenness_centrality(Gi, weighted=weight_mode is not None, weight_mode=weight_mode, eps=eps,
+                                              delta=delta, top_k=k, seed=0)
+        if save:
+            store.upsert_ranking(loc_type, loc, 'betweenness_centrality', top_k_table(G, betweenness1, k), params)
+
+        filename = os.path.join('figures', 'degree_dist', loc_type + '_ ' + loc + '_dd.png')
+        plot_degree_dist(Gi, show=show, save=save, save_name=filename)
+        filename = os.path.join('figures', 'degree_dist', loc_type + '_ ' + loc + '_sd.png')
+        plot_strength_dist(Gi, show=show, save=save, save_name=filename)
 
-    print_colored('Diameter:', 'g')
-    diam = diameter(Gi)
-    print(diam)
-
-    print_colored('Top ' + str(k) + ' in degree centrality: ', 'g')
-    degree_cent1 = degree_centrality(Gi)
-    res1 = print_top_k(G, degree_cent1, k, verbose=False)
-    if save:
-        filename = os.path.join('results', 'degree_centrality', loc_type + '_ ' + loc + '_dc.txt')
-        with open(filename, 'w') as f:
-            for line in res1:
-                f.write(f"{line}\n")
-
-    print_colored('Top ' + str(k) + ' in betweenness centrality: ', 'g')
-    betweenness1 = betweenness_centrality(Gi, weighted=True)
-    res3 = print_top_k(G, betweenness1, k, verbose=False)
-    if save:
-        filename = os.path.join('results', 'betweenness_centrality', loc_type + '_ ' + loc + '_bc.txt')
-        with open(filename, 'w') as f:
-            for line in res3:
-                f.write(f"{line}\n")
-
-    filename = os.path.join('figures', 'degree_dist', loc_type + '_ ' + loc + '_dd.png')
-    plot_degree_dist(Gi, show=show, save=save, save_name=filename)
-
-    # wmin, cmin = 3, 3
-    # Gi_wc = G_wc(Gi, wmin, cmin)
-    # cset_wc = detect_comm_write_to_file(G, Gi_wc, wmin, cmin, loc, loc_type, name='normal')
-    # print('Number of communities found: ', len(cset_wc))
-    # filename = os.path.join('figures', 'communities', loc_type + '_ ' + loc + '.png')
-    # plot_cset_hist(cset_wc, show, save, filename)
-    return diam
+        if backbone is not None:
+            backbone_communities(G, Gi, loc, loc_type, show=show, save=save, **backbone)
+        return diam
+
+
+@profiled()
+def analyze_all_graphs(locations, top_k=10, show=True, save=False, n_jobs=4, store=None, params=None,
+                       weight_mode='similarity', eps=None, delta=0.1):
+    """
+    Same analyses as analyze_graph for a list of (loc, loc_type) pairs, with the projections loaded once into
+    shared memory and the diameter, degree, betweenness, and degree distribution jobs of all locations run
+    concurrently.
+    Returns a dictionary from (loc_type, loc) to the diameter
+    """
+    results, graphs = run_all_locations(locations, n_jobs=n_jobs, weight_mode=weight_mode, eps=eps, delta=delta,
+                                        top_k=top_k)
+    with default_store(store, save) as store:
+        diams = {}
+        for loc, loc_type in locations:
+            G = graphs[(loc_type, loc)]
+            res = {metric: results[(loc_type, loc, metric)] for metric in METRICS}
+            nodes = res['degree']['nodes']
+            diams[(loc_type, loc)] = res['diameter']['value']
+
+            if save:
+                for metric, name in [('degree', 'degree_centrality'), ('betweenness', 'betweenness_centrality')]:
+                    v = dict(zip(nodes, res[metric]['value'].tolist()))
+                    store.upsert_ranking(loc_type, loc, name, top_k_table(G, v, top_k), params)
+            filename = os.path.join('figures', 'degree_dist', loc_type + '_ ' + loc + '_dd.png')
+            ddist = res['degree_distribution']['value']
+            plot_degree_dist_arrays(ddist['ddist'], ddist['cdist'], show=show, save=save, save_name=filename)
+            filename = os.path.join('figures', 'degree_dist', loc_type + '_ ' + loc + '_sd.png')
+            sdist = res['strength_distribution']['value']
+            plot_strength_dist_arrays(sdist['sdist'], sdist['edges'], show=show, save=save, save_name=filename)
+        return diams
 
 
 # def common_ingredients():
@@ -85,7 +154,16 @@ def main():
     analyze_continent = True
     save_data = True
     show_plots = False
+    parallel = True
+    n_jobs = os.cpu_count()
     top_k = 50
+    # betweenness on the co-occurrence weights: 'similarity' (frequent pairs are close), 'distance', or None
+    weight_mode = 'similarity'
+    # error of the sampled betweenness ranking (None for the exact betweenness), and its failure probability
+    eps, delta = None, 0.1
+    # communities of backbones of the projections (when parallel is False), e.g.
+    # {'wmin_list': [1, 2, 3, 5, 10], 'cmin_list': [3, 5, 10], 'points': [(3, 3), (5, 10)]}
+    backbone = None
     countries = ['Argentine', 'Australian', 'Canadian', 'Chinese',
                  'English', 'French', 'German', 'Greek',
                  'Indian', 'Irish', 'Italian',
@@ -95,39 +173,32 @@ def main():
                'Mexican', 'South American', 'US']
     continents = ['Asian', 'European', 'Latin American', 'North American']
 
+    loc_lists = {}
     if analyze_country:
-        all_diam = []
-        for loc in countries:
-            print_colored(loc, 'y')
-            diam = analyze_graph(loc, loc_type='country_data', top_k=top_k, show=show_plots, save=save_data)
-            all_diam.append(loc + ": " + str(diam))
-        if save_data:
-            filename = os.path.join('results', 'diameter', 'country_data_diam.txt')
-            with open(filename, 'w') as f:
-                for line in all_diam:
-                    f.write(f"{line}\n")
+        loc_lists['country_data'] = countries
     if analyze_region:
-        all_diam = []
-        for loc in regions:
-            print_colored(loc, 'y')
-            analyze_graph(loc, loc_type='region_data', top_k=top_k, show=show_plots, save=save_data)
-            all_diam.append(loc + ": " + str(diam))
-        if save_data:
-            filename = os.path.join('results', 'diameter', 'region_data_diam.txt')
-            with open(filename, 'w') as f:
-                for line in all_diam:
-                    f.write(f"{line}\n")
+        loc_lists['region_data'] = regions
     if analyze_continent:
-        all_diam = []
-        for loc in continents:
-            print_colored(loc, 'y')
-            analyze_graph(loc, loc_type='continent_data', top_k=top_k, show=show_plots, save=save_data)
-            all_diam.append(loc + ": " + str(diam))
-        if save_data:
-            filename = os.path.join('results', 'diameter', 'continent_data_diam.txt')
-            with open(filename, 'w') as f:
-                for line in all_diam:
-                    f.write(f"{line}\n")
+        loc_lists['continent_data'] = continents
+
+    store = ResultsStore() if save_data else None
+    if parallel:
+        locations = [(loc, loc_type) for loc_type, loc_list in loc_lists.items() for loc in loc_list]
+        diams = analyze_all_graphs(locations, top_k=top_k, show=show_plots, save=save_data, n_jobs=n_jobs,
+                                   store=store, weight_mode=weight_mode, eps=eps, delta=delta)
+    else:
+        diams = {}
+        for loc_type, loc_list in loc_lists.items():
+            for loc in loc_list:
+                print_colored(loc, 'y')
+                diams[(loc_type, loc)] = analyze_graph(loc, loc_type=loc_type, top_k=top_k, show=show_plots,
+                                                       save=save_data, store=store, backbone=backbone,
+                                                       weight_mode=weight_mode, eps=eps, delta=delta)
+
+    if save_data:
+        for (loc_type, loc), diam in diams.items():
+            store.upsert_scalar(loc_type, loc, 'diameter', diam)
+        store.close()
 
 
 if __name__ == "__main__":
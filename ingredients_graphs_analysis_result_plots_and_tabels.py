@@ -1,63 +1,69 @@
 import csv
 
 from plotting_functions import *
+from results_store import ResultsStore
 import os
 
 
-def plot_graph_diameter_results(show=True, save=False):
+def plot_graph_diameter_results(store, show=True, save=False):
     path = os.path.join('results', 'diameter')
-    country_data = os.path.join(path, 'country_data_diam.txt')
-    region_data = os.path.join(path, 'region_data_diam.txt')
-    continent_data = os.path.join(path, 'continent_data_diam.txt')
-    diameters_plot(country_data, 'Countries', show_plot=show, save_plot=save)
-    diameters_plot(region_data, 'Regions', show_plot=show, save_plot=save)
-    diameters_plot(continent_data, 'Continent', show_plot=show, save_plot=save)
-
-
-def table_graph_centralities(centrality_file, loc_type):
-    directory_path = os.path.join('results', centrality_file)
-    loc_type += '_ '
-
-    # Create a dictionary to store the extracted data
-    data_dict = {}
-
-    # Loop through all files in the directory
-    for file_name in os.listdir(directory_path):
-        if file_name.startswith(loc_type) and file_name.endswith('.txt'):
-            # Extract the location name from the file name
-            location_name = file_name[len(loc_type):-len('_--.txt')]
-
-            # Open the file and extract the data
-            with open(os.path.join(directory_path, file_name), 'r') as file:
-                file_lines = file.readlines()
-                data_dict[location_name] = {}
-                for line in file_lines[1:]:
-                    parts = line.strip().split(':')
-                    name = parts[1].split('(')[0].strip()
-                    value = parts[1].split('(')[1].split(')')[0].strip()
-                    data_dict[location_name][name] = value
-
-    # Save the extracted data to a CSV file
-    csv_path = os.path.join(directory_path, loc_type[:-1] + 'data.csv')
+    if save:
+        os.makedirs(path, exist_ok=True)
+    for loc_type, title in [('country_data', 'Countries'), ('region_data', 'Regions'),
+                            ('continent_data', 'Continent')]:
+        rows = store.get_scalars(loc_type, 'diameter')
+        if not rows:
+            continue
+        locations = [loc for loc, _ in rows]
+        values = [value for _, value in rows]
+        save_path = os.path.join(path, loc_type + '_diam.png') if save else None
+        diameters_bar_plot(locations, values, title, save_path, show)
+
+
+def table_graph_centralities(store, centrality, loc_type, params=None):
+    """
+    Saves a CSV table with one row per location and the ranked nodes of the centrality for that location
+    """
+    rankings = store.get_rankings(loc_type, centrality, params)
+    csv_path = os.path.join('results', centrality, loc_type + '_data.csv')
+    os.makedirs(os.path.dirname(csv_path), exist_ok=True)
     with open(csv_path, 'w', newline='') as csv_file:
         writer = csv.writer(csv_file)
         # Write the data rows
-        for location_name, data in data_dict.items():
-            row_values = [location_name] + [f"{name} ({value})" for name, value in data.items()]
+        for location_name, data in rankings.items():
+            row_values = [location_name] + [f"{title} ({value})" for _, title, value in data]
             writer.writerow(row_values)
 
 
-def main():
-    plot_graph_diameter_results(show=False, save=True)
+def table_modularity_significance(store, loc_type, params=None):
+    """
+    Saves a CSV table with the observed modularity, z-score, and p-value of the macro-nutrient classes of each location
+    params: run parameters of the permutation test ({'n_perm': ..., 'seed': ...})
+    """
+    values = {name: dict(store.get_scalars(loc_type, 'modularity_' + name, params)) for name in ['Q', 'z', 'p']}
+    if not values['Q']:
+        return
+    csv_path = os.path.join('results', 'modularity_significance', loc_type + '.csv')
+    os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+    with open(csv_path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['location', 'Q', 'z', 'p'])
+        for location_name in values['Q']:
+            writer.writerow([location_name] + [values[name].get(location_name) for name in ['Q', 'z', 'p']])
 
-    table_graph_centralities('degree_centrality', 'country_data')
-    table_graph_centralities('degree_centrality', 'region_data')
-    table_graph_centralities('degree_centrality', 'continent_data')
 
-    table_graph_centralities('betweenness_centrality', 'country_data')
-    table_graph_centralities('betweenness_centrality', 'region_data')
-    table_graph_centralities('betweenness_centrality', 'continent_data')
+def main():
+    store = ResultsStore()
+    plot_graph_diameter_results(store, show=False, save=True)
+
+    table_graph_centralities(store, 'degree_centrality', 'country_data')
+    table_graph_centralities(store, 'degree_centrality', 'region_data')
+    table_graph_centralities(store, 'degree_centrality', 'continent_data')
 
+    table_graph_centralities(store, 'betweenness_centrality', 'country_data')
+    table_graph_centralities(store, 'betweenness_centrality', 'region_data')
+    table_graph_centralities(store, 'betweenness_centrality', 'continent_data')
+    store.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,134 @@
+"""
+MinHash signatures and LSH banding for sets stored as the rows of a sparse matrix.
+The signature of a set holds, for each of num_perm universal hash functions h(x) = (a * x + b) mod (2^31 - 1), the
+minimum of h over the elements of the set. The fraction of equal signature entries of two sets estimates their Jaccard
+similarity. LSH splits the signatures into bands of rows_per_band entries. Two sets become candidates when all the
+entries of at least one band are equal, which happens with probability 1 - (1 - J^rows_per_band)^bands.
+"""
+import numpy as np
+import scipy.sparse as sp
+
+PRIME = 2 ** 31 - 1
+EMPTY = PRIME  # signature entry of an empty set (above every hash value)
+
+
+def hash_parameters(num_perm, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(1, PRIME, num_perm, dtype=np.uint64), rng.integers(0, PRIME, num_perm, dtype=np.uint64)
+
+
+def minhash_signatures(X, num_perm=128, seed=0, chunk=16):
+    """
+    X: sparse matrix whose rows are the sets (the column indices of their nonzeros are the elements)
+    Returns a num_sets x num_perm array of signatures (uint32)
+    chunk: number of hash functions evaluated at once (bounds the memory to chunk x nnz values)
+    """
+    X = sp.csr_matrix(X)
+    a, b = hash_parameters(num_perm, seed)
+    elements = X.indices.astype(np.uint64)
+    starts = X.indptr[:-1]
+    nonempty = np.diff(X.indptr) > 0
+    sig = np.full((X.shape[0], num_perm), EMPTY, dtype=np.uint32)
+    for k in range(0, num_perm, chunk):
+        h = (a[k:k + chunk, None] * elements[None, :] + b[k:k + chunk, None]) % PRIME
+        if len(elements) > 0:
+            # reduceat over the start of every nonempty row gives the row minima
+            sig[nonempty, k:k + chunk] = np.minimum.reduceat(h, starts[nonempty], axis=1).T
+    return sig
+
+
+def estimated_jaccard(sig, i, others):
+    """
+    Fraction of equal signature entries of set i and each of the sets others
+    """
+    return (sig[others] == sig[i]).mean(axis=1)
+
+
+class LSHIndex:
+    """
+    Banded LSH index over MinHash signatures.
+    The buckets of every band map the bytes of the band's entries to the sets that share them (empty sets are left out).
+    """
+    def __init__(self, sig, bands=32):
+        num_perm = sig.shape[1]
+        if num_perm % bands != 0:
+            raise ValueError('the number of hash functions (' + str(num_perm) + ') is not a multiple of bands')
+        self.sig = sig
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.buckets = []
+        nonempty = np.flatnonzero((sig != EMPTY).any(axis=1))
+        for band in range(bands):
+            keys = self._band(band, nonempty)
+            # sets with equal keys become one bucket (sorted so that every bucket is one run)
+            order = np.argsort(keys, kind='stable')
+            keys, members = keys[order], nonempty[order]
+            bounds = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1], [True]]))
+            self.buckets.append({keys[s].tobytes(): members[s:e] for s, e in zip(bounds[:-1], bounds[1:])
+                                 if e - s > 1})
+
+    def _band(self, band, rows):
+        block = np.ascontiguousarray(self.sig[rows, band * self.rows_per_band:(band + 1) * self.rows_per_band])
+        return block.view(np.dtype((np.void, block.dtype.itemsize * self.rows_per_band))).ravel()
+
+    def candidates(self, i):
+        """
+        Sets that share at least one band with set i (i itself excluded)
+        """
+        found = [bucket[key] for band, bucket in enumerate(self.buckets)
+                 for key in [self._band(band, [i])[0].tobytes()] if key in bucket]
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        found = np.unique(np.concatenate(found))
+        return found[found != i]
+
+    def candidate_pairs(self, max_bucket=None, window=10):
+        """
+        All pairs (i, j), i < j, that share at least one band, as an array of shape (n_pairs, 2)
+        max_bucket: buckets with more sets (e.g. small sets that share a frequent element) would add a quadratic
+                    number of pairs. Their sets are sorted by their whole signature instead, and each set is paired
+                    with the next window sets only, which keeps the sets with equal or close signatures.
+        """
+        pairs = []
+        by_size = {}
+        for bucket in self.buckets:
+            for members in bucket.values():
+                if max_bucket is not None and len(members) > max_bucket:
+                    rows = np.ascontiguousarray(self.sig[members])
+                    members = members[np.argsort(rows.view(np.dtype((np.void, rows.shape[1] * 4))).ravel())]
+                    for shift in range(1, window + 1):
+                        pairs.append(np.stack([members[:-shift], members[shift:]], axis=1))
+                else:
+                    by_size.setdefault(len(members), []).append(members)
+        # the pairs of all the buckets of one size at once
+        for size, buckets in by_size.items():
+            members = np.stack(buckets)
+            i, j = np.triu_indices(size, 1)
+            pairs.append(np.stack([members[:, i].ravel(), members[:, j].ravel()], axis=1))
+        return unique_pairs(pairs, len(self.sig))
+
+
+def unique_pairs(pairs, n):
+    """
+    Sorted unique pairs (i, j), i < j, of a list of (n_pairs, 2) arrays over n sets
+    """
+    if sum(len(p) for p in pairs) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    pairs = np.sort(np.concatenate(pairs), axis=1).astype(np.int64)
+    # one integer key per pair, sorted and deduplicated
+    keys = np.sort(pairs[:, 0] * n + pairs[:, 1])
+    keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+    return np.stack([keys // n, keys % n], axis=1)
+
+
+def candidate_probability(jaccard, bands, rows_per_band):
+    return 1 - (1 - jaccard ** rows_per_band) ** bands
+
+
+# ########## #
+# Test cases #
+# ########## #
+def test_unique_pairs():
+    pairs = unique_pairs([np.array([[3, 1], [1, 3]]), np.zeros((0, 2), dtype=np.int64), np.array([[0, 2]])], 4)
+    assert pairs.tolist() == [[0, 2], [1, 3]]
+    assert unique_pairs([np.zeros((0, 2), dtype=np.int64)] * 2, 10).shape == (0, 2)
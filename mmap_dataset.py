@@ -0,0 +1,298 @@
+"""
+Memory-mapped dataset of the core arrays of the (processed) recipe data.
+write_dataset stores, once, as .npy files in one directory (append_dataset adds recipes to it):
+    the recipe x ingredient incidence (CSR indptr/indices) and the fat/carbs/protein values of each of its entries,
+    the recipe x nutrient matrix ('normalized nutrients by energy'),
+    the ingredient, nutrient, and location vocabularies,
+    the recipe metadata (url index, title, and location codes),
+and a metadata.json that describes them.
+MappedDataset opens the arrays read-only with np.load(mmap_mode='r') and reads only the pages it touches. It
+pickles as its path only, so a process it is sent to reopens the same files instead of receiving a copy.
+The macro-nutrient index of assortativity.py, the incremental updates, and the similarity index read from it.
+Worker pools get the path of a dataset in their initializer and open it once per worker instead of each receiving a
+copy of the arrays. The mapped pages are shared by all the workers (through the OS page cache) as long as the
+workers read the arrays in place: betweenness.py and community_detection.py read the neighbors of a node when they
+visit it, and only the per-task state (node labels and distances, sampled submatrices, the row sets of a curveball
+chain) is allocated in each worker:
+    map_locations runs a function of (dataset, loc_type, loc) for many locations (incremental updates),
+    TemporaryDataset writes the CSR matrices and arrays of a computation (a projection, an incidence) to a
+    temporary dataset for the pools of betweenness.py, modularity_sampling.py, null_models.py, and
+    community_detection.py.
+"""
+import json
+import os
+import shutil
+import tempfile
+from multiprocessing import Pool
+
+import numpy as np
+import scipy.sparse as sp
+
+LOC_TYPES = ['continent', 'region', 'country']
+ENTRY_MACROS = [('fat', 'lipid (fat) (g)'), ('carbs', 'carbohydrates'), ('protein', 'protein (g)')]
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.
+
+
+def _extend_vocabulary(vocab, values):
+    """
+    Appends the values that are not in vocab (in sorted order) and returns the vocabulary and its index
+    """
+    vocab = list(vocab)
+    idx = {name: i for i, name in enumerate(vocab)}
+    for name in sorted(set(values) - set(idx)):
+        idx[name] = len(vocab)
+        vocab.append(name)
+    return vocab, idx
+
+
+def _encode(df, ingredient_idx, nutrient_idx, index_dtype):
+    """
+    Incidence row sizes, entry ingredient indices, entry fat/carbs/protein values, and the nutrient matrix of the
+    recipes of df
+    """
+    n = len(df)
+    sizes = np.fromiter((len(info) for info in df['ingredient information']), dtype=np.int64, count=n)
+    indices = np.empty(sizes.sum(), dtype=index_dtype)
+    macros = np.zeros((sizes.sum(), len(ENTRY_MACROS)))
+    nutrient_matrix = np.zeros((n, len(nutrient_idx)))
+    e = 0
+    for i, (info, nutri) in enumerate(zip(df['ingredient information'], df['normalized nutrients by energy'])):
+        # entries of each row are sorted by ingredient index, as in a canonical CSR matrix
+        for name in sorted(info, key=ingredient_idx.__getitem__):
+            indices[e] = ingredient_idx[name]
+            macros[e] = [_to_float(info[name][key]) for _, key in ENTRY_MACROS]
+            e += 1
+        for name, value in nutri.items():
+            nutrient_matrix[i, nutrient_idx[name]] = value
+    return sizes, indices, macros, nutrient_matrix
+
+
+def _save(path, arrays):
+    for name, arr in arrays.items():
+        np.save(os.path.join(path, name + '.npy'), arr)
+    metadata = {'n_recipes': len(arrays['recipe_url']), 'n_ingredients': len(arrays['ingredient_vocab']),
+                'n_nutrients': len(arrays['nutrient_vocab']), 'nnz': int(arrays['incidence_indptr'][-1]),
+                'entry_macros': [name for name, _ in ENTRY_MACROS],
+                'arrays': {name: {'shape': list(arr.shape), 'dtype': arr.dtype.str} for name, arr in arrays.items()}}
+    with open(os.path.join(path, 'metadata.json'), 'w') as f:
+        json.dump(metadata, f, indent=1)
+
+
+def _recipe_arrays(df, loc_idx):
+    arrays = {'recipe_url': df['url idx'].astype(np.int64).to_numpy(),
+              'recipe_title': np.asarray(df['recipe title'], dtype=str)}
+    for loc_type in LOC_TYPES:
+        arrays[loc_type + '_code'] = np.array([loc_idx[loc_type][loc] for loc in df[loc_type]], dtype=np.int32)
+    return arrays
+
+
+def write_dataset(df, path):
+    """
+    Writes the core arrays of the dataframe df (with the 'normalized nutrients by energy' column of process_data)
+    to the directory path
+    """
+    os.makedirs(path, exist_ok=True)
+    ingredients, ingredient_idx = _extend_vocabulary([], set().union(*df['ingredient information']))
+    nutrients, nutrient_idx = _extend_vocabulary([], set().union(*df['normalized nutrients by energy']))
+    sizes, indices, macros, nutrient_matrix = _encode(df, ingredient_idx, nutrient_idx, np.int64)
+    indptr = np.concatenate([[0], np.cumsum(sizes)])
+    index_dtype = np.int32 if indptr[-1] < 2 ** 31 else np.int64
+
+    arrays = {'incidence_indptr': indptr.astype(index_dtype), 'incidence_indices': indices.astype(index_dtype),
+              'entry_macros': macros, 'nutrients': nutrient_matrix,
+              'ingredient_vocab': np.array(ingredients, dtype=str), 'nutrient_vocab': np.array(nutrients, dtype=str)}
+    loc_idx = {}
+    for loc_type in LOC_TYPES:
+        vocab, loc_idx[loc_type] = _extend_vocabulary([], df[loc_type])
+        arrays[loc_type + '_vocab'] = np.array(vocab, dtype=str)
+    arrays.update(_recipe_arrays(df, loc_idx))
+    _save(path, arrays)
+    return MappedDataset(path)
+
+
+def append_dataset(path, df):
+    """
+    Appends the recipes of df to the dataset in path. New ingredients, nutrients, and locations are added at the
+    end of their vocabularies, so the indices of the existing entries do not change.
+    Returns the updated dataset and the indices of the appended recipes
+    """
+    ds = MappedDataset(path)
+    old = {name: np.asarray(ds.array(name)) for name in ds.metadata['arrays']}
+    ingredients, ingredient_idx = _extend_vocabulary(old['ingredient_vocab'].tolist(),
+                                                     set().union(*df['ingredient information']))
+    nutrients, nutrient_idx = _extend_vocabulary(old['nutrient_vocab'].tolist(),
+                                                 set().union(*df['normalized nutrients by energy']))
+    sizes, indices, macros, nutrient_matrix = _encode(df, ingredient_idx, nutrient_idx, np.int64)
+    indptr = np.concatenate([old['incidence_indptr'].astype(np.int64), old['incidence_indptr'][-1] + np.cumsum(sizes)])
+    index_dtype = np.int32 if indptr[-1] < 2 ** 31 else np.int64
+
+    old_nutrients = np.zeros((len(old['nutrients']), len(nutrients)))
+    old_nutrients[:, :old['nutrients'].shape[1]] = old['nutrients']
+    arrays = {'incidence_indptr': indptr.astype(index_dtype),
+              'incidence_indices': np.concatenate([old['incidence_indices'], indices]).astype(index_dtype),
+              'entry_macros': np.concatenate([old['entry_macros'], macros]),
+              'nutrients': np.concatenate([old_nutrients, nutrient_matrix]),
+              'ingredient_vocab': np.array(ingredients, dtype=str), 'nutrient_vocab': np.array(nutrients, dtype=str)}
+    loc_idx = {}
+    for loc_type in LOC_TYPES:
+        vocab, loc_idx[loc_type] = _extend_vocabulary(old[loc_type + '_vocab'].tolist(), df[loc_type])
+        arrays[loc_type + '_vocab'] = np.array(vocab, dtype=str)
+    for name, arr in _recipe_arrays(df, loc_idx).items():
+        arrays[name] = np.concatenate([old[name], arr])
+    n_old = len(old['recipe_url'])
+    del ds, old
+    _save(path, arrays)
+    return MappedDataset(path), np.arange(n_old, n_old + len(df))
+
+
+class MappedDataset:
+    """
+    Read-only view of a dataset written by write_dataset. Arrays are memory-mapped on first use.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'metadata.json'), 'r') as f:
+            self.metadata = json.load(f)
+        self._arrays = {}
+
+    def __getstate__(self):
+        # workers reopen the files instead of receiving copies of the arrays
+        return {'path': self.path, 'metadata': self.metadata, '_arrays': {}}
+
+    def array(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+        return self._arrays[name]
+
+    @property
+    def incidence(self):
+        """
+        Recipe x ingredient incidence (CSR) backed by the mapped index arrays
+        """
+        indices = self.array('incidence_indices')
+        data = np.broadcast_to(np.float64(1.), indices.shape)
+        return sp.csr_matrix((data, indices, self.array('incidence_indptr')),
+                             shape=(self.metadata['n_recipes'], self.metadata['n_ingredients']), copy=False)
+
+    @property
+    def nutrients(self):
+        return self.array('nutrients')
+
+    @property
+    def ingredient_vocab(self):
+        return self.array('ingredient_vocab')
+
+    @property
+    def nutrient_vocab(self):
+        return self.array('nutrient_vocab')
+
+    def location_rows(self, loc_type, loc):
+        """
+        Indices of the recipes of a location
+        """
+        k = np.flatnonzero(self.array(loc_type + '_vocab') == loc)
+        if len(k) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self.array(loc_type + '_code') == k[0])
+
+    def location_incidence(self, loc_type, loc):
+        """
+        Incidence rows of the recipes of a location (a copy of only those rows)
+        """
+        return self.incidence[self.location_rows(loc_type, loc)]
+
+    def matrix(self, name):
+        """
+        CSR matrix written by write_arrays, backed by the mapped arrays
+        """
+        return sp.csr_matrix((self.array(name + '_data'), self.array(name + '_indices'), self.array(name + '_indptr')),
+                             shape=tuple(self.metadata['matrices'][name]), copy=False)
+
+    def ingredient_entry_macros(self):
+        """
+        Ingredient index and fat/carbs/protein values of every entry of the incidence
+        """
+        return self.array('incidence_indices'), self.array('entry_macros')
+
+
+def open_dataset(path):
+    return MappedDataset(path)
+
+
+# ############ #
+# Worker pools #
+# ############ #
+def write_arrays(path, matrices=None, arrays=None):
+    """
+    Writes CSR matrices (as their indptr, indices, and data arrays) and arrays to the directory path, which
+    open_dataset then reads with MappedDataset.matrix and MappedDataset.array
+    """
+    os.makedirs(path, exist_ok=True)
+    metadata = {'matrices': {}, 'arrays': {}}
+    files = dict(arrays or {})
+    for name, A in (matrices or {}).items():
+        A = sp.csr_matrix(A)
+        metadata['matrices'][name] = list(A.shape)
+        files.update({name + '_indptr': A.indptr, name + '_indices': A.indices, name + '_data': A.data})
+    for name, arr in files.items():
+        arr = np.asarray(arr)
+        np.save(os.path.join(path, name + '.npy'), arr)
+        metadata['arrays'][name] = {'shape': list(arr.shape), 'dtype': arr.dtype.str}
+    with open(os.path.join(path, 'metadata.json'), 'w') as f:
+        json.dump(metadata, f, indent=1)
+    return MappedDataset(path)
+
+
+class TemporaryDataset:
+    """
+    Matrices and arrays written to a temporary directory (write_arrays) for the workers of a pool, which open it with
+    open_dataset(path) in their initializer. Use it as a context manager so that the files are removed afterwards.
+    """
+    def __init__(self, matrices=None, arrays=None):
+        self.path = tempfile.mkdtemp(prefix='dataset_')
+        try:
+            write_arrays(self.path, matrices, arrays)
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+_worker_dataset = {}
+
+
+def _init_worker(path):
+    _worker_dataset['dataset'] = open_dataset(path)
+
+
+def _run_location(job):
+    func, loc_type, loc, args = job
+    return func(_worker_dataset['dataset'], loc_type, loc, *args)
+
+
+def map_locations(path, func, jobs, n_jobs=1):
+    """
+    Runs func(dataset, loc_type, loc, *args) for every (loc_type, loc, args) job on the dataset in path. With
+    n_jobs > 1 the jobs run in a process pool whose workers open the dataset once, in their initializer.
+    func must be a module-level function. Returns the results in the order of jobs.
+    """
+    jobs = [(func, loc_type, loc, tuple(args)) for loc_type, loc, args in jobs]
+    if n_jobs > 1 and len(jobs) > 1:
+        with Pool(min(n_jobs, len(jobs)), initializer=_init_worker, initargs=(path,)) as pool:
+            return pool.map(_run_location, jobs, chunksize=1)
+    _init_worker(path)
+    return [_run_location(job) for job in jobs]
@@ -0,0 +1,164 @@
+"""
+Sampling-based modularity statistics on the sparse projection: bootstrap under node downsampling and a
+label-permutation null model
+"""
+from multiprocessing import Pool
+
+import numpy as np
+import scipy.sparse as sp
+
+from mmap_dataset import TemporaryDataset, open_dataset
+from sparse_graph_functions import csr_modularity
+
+
+def class_labels(G, nodes, classes=('fats', 'carbs', 'protein'), attr='main nutrient'):
+    """
+    Array with the index of the class of each node (ordered as nodes)
+    """
+    class_idx = {c: i for i, c in enumerate(classes)}
+    return np.array([class_idx[G.nodes[n][attr]] for n in nodes])
+
+
+def subset_modularity(A, labels, idx, directed=False):
+    """
+    Modularity of the partition labels restricted to the subgraph induced by the node indices idx
+    """
+    return csr_modularity(A[idx][:, idx], labels[idx], directed)[0]
+
+
+def sample_subset(rng, n, frac_remain):
+    """
+    Sorted random subset of ceil(n * frac_remain) node indices
+    """
+    n_final = int(np.ceil(n * frac_remain))
+    return np.sort(rng.choice(n, n_final, replace=False))
+
+
+# The graph is handed to each worker once, when the pool starts, instead of with every chunk of replicates. Pools
+# get the path of a temporary dataset that every worker opens, so they share one copy of the graph.
+_worker_graph = {}
+
+
+def _init_worker(A, labels, directed):
+    _worker_graph.update(A=A, labels=labels, directed=directed)
+
+
+def _init_mapped_worker(path, directed):
+    dataset = open_dataset(path)
+    _init_worker(dataset.matrix('A'), dataset.array('labels'), directed)
+
+
+def _bootstrap_chunk(args):
+    frac_remain, seeds = args
+    A, labels, directed = _worker_graph['A'], _worker_graph['labels'], _worker_graph['directed']
+    Q = np.zeros(len(seeds))
+    for i, seed in enumerate(seeds):
+        idx = sample_subset(np.random.default_rng(seed), A.shape[0], frac_remain)
+        Q[i] = subset_modularity(A, labels, idx, directed)
+    return Q
+
+
+def bootstrap_modularity(A, labels, frac_remain_list, n_boot=1000, seed=0, n_jobs=1, chunk_size=100,
+                         directed=False):
+    """
+    Modularity of the partition labels on many random node subsets of the CSR graph A
+    frac_remain_list: fractions of nodes kept in each subset
+    n_boot: number of replicates per fraction
+    Every replicate draws from its own RNG stream spawned from seed, so the results do not depend on n_jobs.
+    Returns a dictionary from str(frac_remain) to an array of n_boot modularity values
+    """
+    seed_seq = np.random.SeedSequence(seed)
+    jobs = []
+    for frac_remain, frac_seq in zip(frac_remain_list, seed_seq.spawn(len(frac_remain_list))):
+        seeds = frac_seq.spawn(n_boot)
+        jobs.extend((frac_remain, seeds[i:i + chunk_size]) for i in range(0, n_boot, chunk_size))
+    if n_jobs > 1:
+        with TemporaryDataset({'A': A}, {'labels': labels}) as shared, \
+                Pool(n_jobs, initializer=_init_mapped_worker, initargs=(shared.path, directed)) as pool:
+            chunks = pool.map(_bootstrap_chunk, jobs)
+    else:
+        _init_worker(A, labels, directed)
+        chunks = [_bootstrap_chunk(job) for job in jobs]
+
+    Q_bootstrap = {str(frac_remain): [] for frac_remain in frac_remain_list}
+    for (frac_remain, _), Q in zip(jobs, chunks):
+        Q_bootstrap[str(frac_remain)].append(Q)
+    return {key: np.concatenate(val) for key, val in Q_bootstrap.items()}
+
+
+# ############################ #
+# Label-permutation null model #
+# ############################ #
+def permutation_modularity(A, labels, n_perm=1000, seed=0, chunk_size=None, directed=False):
+    """
+    Tests whether the modularity of the partition labels is larger than expected by chance.
+    The labels are shuffled across nodes, which keeps the class sizes fixed, and Q is recomputed for every
+    permutation. The edge list and the per-node strength vectors are computed once, so each permutation costs a
+    comparison over the edges and a bincount over the nodes, vectorized over chunks of permutations.
+    Returns a dictionary with the observed Q, the null values, the z-score, and the one-sided p-value
+    """
+    A = sp.csr_matrix(A)
+    if not directed:
+        # networkx counts self loops twice in the degree of undirected graphs
+        A = A + sp.diags(A.diagonal())
+    L = A.sum()
+    rows = np.repeat(np.arange(A.shape[0]), np.diff(A.indptr))
+    cols, data = A.indices, A.data
+    k_out = np.asarray(A.sum(axis=1)).ravel()
+    k_in = np.asarray(A.sum(axis=0)).ravel()
+    n_comm = labels.max() + 1
+    if chunk_size is None:
+        chunk_size = max(1, 2 ** 24 // max(len(data), 1))
+
+    def modularity_rows(P):
+        m = P.shape[0]
+        intra = (P[:, rows] == P[:, cols]) @ data
+        offset = P + n_comm * np.arange(m)[:, None]
+        K_out = np.bincount(offset.ravel(), weights=np.tile(k_out, m), minlength=m * n_comm).reshape(m, n_comm)
+        K_in = np.bincount(offset.ravel(), weights=np.tile(k_in, m), minlength=m * n_comm).reshape(m, n_comm)
+        return intra / L - (K_in * K_out).sum(axis=1) / L ** 2
+
+    Q_obs = modularity_rows(labels[None, :])[0]
+    rng = np.random.default_rng(seed)
+    Q_null = []
+    for start in range(0, n_perm, chunk_size):
+        m = min(chunk_size, n_perm - start)
+        Q_null.append(modularity_rows(rng.permuted(np.tile(labels, (m, 1)), axis=1)))
+    Q_null = np.concatenate(Q_null)
+    p = (1 + (Q_null >= Q_obs).sum()) / (1 + n_perm)
+    return {'Q': Q_obs, 'null': Q_null, 'z': z_score(Q_obs, Q_null), 'p': p}
+
+
+def z_score(Q_obs, Q_null):
+    """
+    (Q_obs - mean) / std of the null values. When the null values have no spread (e.g. a single class, whose
+    permutations all give the same Q), the z-score is 0 if Q_obs equals them and -inf or inf otherwise.
+    """
+    if len(Q_null) == 0:
+        return np.nan
+    if Q_null.max() > Q_null.min():
+        return (Q_obs - Q_null.mean()) / Q_null.std()
+    # the mean and std of equal values can be off by a rounding error, so the values are compared directly
+    if np.isclose(Q_obs, Q_null[0]):
+        return 0.
+    return np.inf if Q_obs > Q_null[0] else -np.inf
+
+
+# ########## #
+# Test cases #
+# ########## #
+def test_permutation_modularity_degenerate():
+    """
+    Null distributions without spread: one class (every permutation is the observed partition), and constant nulls
+    above and below the observed value
+    """
+    A = sp.csr_matrix(np.array([[0, 1, 1, 0], [1, 0, 1, 0], [1, 1, 0, 1], [0, 0, 1, 0]], dtype=float))
+    res = permutation_modularity(A, np.zeros(4, dtype=int), n_perm=20)
+    assert np.all(res['null'] == res['Q']) and res['z'] == 0. and res['p'] == 1.
+    assert z_score(0.1, np.full(10, 0.3)) == -np.inf
+    assert z_score(0.3, np.full(10, 0.1)) == np.inf
+    assert np.isclose(z_score(0.3, np.array([0.1, 0.3])), 1.)
+
+
+if __name__ == "__main__":
+    test_permutation_modularity_degenerate()
@@ -0,0 +1,148 @@
+"""
+Degree-preserving null models of the recipe x ingredient bipartite graph.
+Randomized incidences keep every recipe size and every ingredient frequency, and the co-occurrence weights they
+produce give the expected weight of each edge of the ingredient projection.
+"""
+import random
+from multiprocessing import Pool
+
+import numpy as np
+import scipy.sparse as sp
+
+from mmap_dataset import TemporaryDataset, open_dataset
+
+
+def incidence_from_graph(G):
+    """
+    Recipe x ingredient incidence matrix of a (reduced) recipe-ingredient graph
+    Returns the CSR incidence, the recipe nodes (rows), and the ingredient nodes (columns)
+    """
+    recipes = [node for node in G.nodes if 'url' in G.nodes[node]]
+    ingredients = [node for node in G.nodes if 'url' not in G.nodes[node]]
+    recipe_idx = {n: i for i, n in enumerate(recipes)}
+    ingredient_idx = {n: i for i, n in enumerate(ingredients)}
+    rows, cols = [], []
+    for u, v in G.edges():
+        if u in ingredient_idx:
+            u, v = v, u
+        rows.append(recipe_idx[u])
+        cols.append(ingredient_idx[v])
+    B = sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(recipes), len(ingredients)))
+    return B, recipes, ingredients
+
+
+def curveball(rows, n_trades, rng):
+    """
+    Bipartite curveball Markov chain (Strona et al., 2014). Each trade picks two recipes and randomly redistributes
+    the ingredients that only one of them uses, which keeps recipe sizes and ingredient frequencies unchanged.
+    rows: list of ingredient sets, one per recipe (modified in place)
+    rng: random.Random instance
+    """
+    n = len(rows)
+    for _ in range(n_trades):
+        a, b = rng.randrange(n), rng.randrange(n)
+        if a == b:
+            continue
+        ra, rb = rows[a], rows[b]
+        a_only = ra - rb
+        b_only = rb - ra
+        if not a_only or not b_only:
+            continue
+        pool = list(a_only) + list(b_only)
+        rng.shuffle(pool)
+        shared = ra & rb
+        rows[a] = shared | set(pool[:len(a_only)])
+        rows[b] = shared | set(pool[len(a_only):])
+    return rows
+
+
+def rows_to_incidence(rows, n_cols):
+    indptr = np.zeros(len(rows) + 1, dtype=int)
+    indptr[1:] = np.cumsum([len(r) for r in rows])
+    indices = np.fromiter((c for r in rows for c in r), dtype=int, count=indptr[-1])
+    return sp.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(rows), n_cols))
+
+
+def pair_cooccurrence(B, pair_u, pair_v):
+    """
+    Number of recipes that use both ingredients of each (pair_u, pair_v) pair.
+    Only the columns of the pairs are multiplied, the full co-occurrence matrix BᵀB is never built.
+    """
+    if len(pair_u) == 0:
+        return np.zeros(0)
+    Bc = sp.csc_matrix(B)
+    return np.asarray(Bc[:, pair_u].multiply(Bc[:, pair_v]).sum(axis=0)).ravel()
+
+
+# The incidence is handed to each worker once, when the pool starts, instead of with every sample. Pools get the path
+# of a temporary dataset that every worker opens, so they share one copy of the incidence and the pairs.
+_worker_data = {}
+
+
+def _init_worker(B, pair_u, pair_v, n_trades):
+    _worker_data.update(B=B, pair_u=pair_u, pair_v=pair_v, n_trades=n_trades)
+
+
+def _init_mapped_worker(path, n_trades):
+    dataset = open_dataset(path)
+    _init_worker(dataset.matrix('B'), dataset.array('pair_u'), dataset.array('pair_v'), n_trades)
+
+
+def _randomized_sample(seed_seq):
+    d = _worker_data
+    rng = random.Random(int(seed_seq.generate_state(1)[0]))
+    # the chain trades on its own row sets, built from the rows of the (mapped) incidence for every sample
+    indptr, indices = d['B'].indptr.tolist(), d['B'].indices
+    rows = curveball([set(indices[indptr[i]:indptr[i + 1]].tolist()) for i in range(len(indptr) - 1)], d['n_trades'],
+                     rng)
+    return pair_cooccurrence(rows_to_incidence(rows, d['B'].shape[1]), d['pair_u'], d['pair_v'])
+
+
+def expected_cooccurrence(B, pair_u, pair_v, n_samples=100, n_trades=None, seed=0, n_jobs=1):
+    """
+    Mean and standard deviation of the co-occurrence of each ingredient pair over randomized incidences.
+    Every sample runs its own curveball chain from the observed incidence with an independent seeded RNG stream.
+    n_trades: trades per chain (default 5 times the number of recipes)
+    """
+    if n_trades is None:
+        n_trades = 5 * B.shape[0]
+    seeds = np.random.SeedSequence(seed).spawn(n_samples)
+    if n_jobs > 1:
+        with TemporaryDataset({'B': B}, {'pair_u': pair_u, 'pair_v': pair_v}) as shared, \
+                Pool(n_jobs, initializer=_init_mapped_worker, initargs=(shared.path, n_trades)) as pool:
+            samples = pool.imap_unordered(_randomized_sample, seeds)
+            total, total_sq = _accumulate(samples, len(pair_u))
+    else:
+        _init_worker(B, pair_u, pair_v, n_trades)
+        total, total_sq = _accumulate(map(_randomized_sample, seeds), len(pair_u))
+    mean = total / n_samples
+    std = np.sqrt(np.maximum(total_sq / n_samples - mean ** 2, 0))
+    return mean, std
+
+
+def _accumulate(samples, n_pairs):
+    total, total_sq = np.zeros(n_pairs), np.zeros(n_pairs)
+    for values in samples:
+        total += values
+        total_sq += values ** 2
+    return total, total_sq
+
+
+def score_projection(G, Gi, n_samples=100, n_trades=None, seed=0, n_jobs=1):
+    """
+    Adds over-representation scores to the edges of the ingredient projection Gi of the recipe-ingredient graph G:
+        'expected_weight': mean co-occurrence under the null model
+        'weight_ratio': observed / expected co-occurrence
+        'weight_zscore': (observed - expected) / standard deviation under the null model
+    """
+    B, _, ingredients = incidence_from_graph(G)
+    ingredient_idx = {n: i for i, n in enumerate(ingredients)}
+    edges = list(Gi.edges(data='weight'))
+    pair_u = np.array([ingredient_idx[u] for u, _, _ in edges], dtype=int)
+    pair_v = np.array([ingredient_idx[v] for _, v, _ in edges], dtype=int)
+    mean, std = expected_cooccurrence(B, pair_u, pair_v, n_samples, n_trades, seed, n_jobs)
+    for (u, v, w), m, s in zip(edges, mean, std):
+        Gi[u][v]['expected_weight'] = float(m)
+        Gi[u][v]['weight_ratio'] = float(w / m) if m > 0 else float('inf')
+        Gi[u][v]['weight_zscore'] = float((w - m) / s) if s > 0 else 0.
+    return Gi
@@ -1,9 +1,7 @@
 import networkx as nx
-import numpy as np
-from copy import deepcopy
-import matplotlib.pyplot as plt
 from tqdm import tqdm
 import os
+from stage_profiler import profiled
 
 
 # ########################## #
@@ -153,6 +151,7 @@ def save_reduced_graphs(loc_list, loc_type, loc_graphs):
 # ############################# #
 # Functions that do many things #
 # ############################# #
+@profiled('nutrients.load_reduce_save')
 def load_reduce_save(loc, loc_type, main_nutrients, wmin, verbose=False, save=True):
     G, G_ing = load_ingredients_and_nutrients_graphs(loc, loc_type)
     G = remove_nodes_and_edges(G, G_ing, main_nutrients, wmin, verbose)
@@ -161,12 +160,14 @@ def load_reduce_save(loc, loc_type, main_nutrients, wmin, verbose=False, save=Tr
     return G
 
 
+@profiled('nutrients.load_reduced_project_save')
 def load_reduced_project_save(loc, loc_type, save=True):
     graph = load_nutri_graph(loc, loc_type, reduced=True)
     recipe_graph, nutrients_graph = create_bipartite_graph_and_project_it(graph)
     if save:
         save_graph(loc, loc_type, recipe_graph, graph_type='_reduced_nutProjR')
         save_graph(loc, loc_type, nutrients_graph, graph_type='_reduced_nutProjN')
+    return recipe_graph, nutrients_graph
 
 
 # #################################################################################################################### #
@@ -1,16 +1,14 @@
-import pickle
+import json
 
-import networkx as nx
 import numpy as np
-from copy import deepcopy
-import matplotlib.pyplot as plt
 from tqdm import tqdm
-import os
 from nutrients_graph_processing import load_nutri_graph
 from printing_functions import print_colored
-from plotting_functions import radial_graph_plot, matrix_plot
+from plotting_functions import radial_graph_plot, matrix_plot, FigureQueue
 from itertools import combinations
-from graph_processing_funtions import find_degree_one_nodes
+from null_models import incidence_from_graph
+from results_store import default_store
+from stage_profiler import profiled
 
 
 def categories(main_nutrients):
@@ -21,114 +19,176 @@ def categories(main_nutrients):
     return combs, combs_list
 
 
+def mask_weights(nutrient_titles, groups, combs_list, nutrients):
+    """
+    Weights of the nutrients projection for the nutrient pairs in combs_list (number of recipes that connect both
+    nutrients) and the number of recipes that connect only to each of the nutrients, from the recipe groups of
+    group_recipes_by_mask
+    nutrient_titles: title of the nutrient of each mask bit
+    """
+    pair_idx = {}
+    for k, (a, b) in enumerate(combs_list):
+        pair_idx[(a, b)] = pair_idx[(b, a)] = k
+    self_idx = {nutrient: i for i, nutrient in enumerate(nutrients)}
+    vals = np.zeros(len(combs_list))
+    self_vals = np.zeros(len(nutrients))
+    for mask, group in groups.items():
+        bits = mask_bits(mask)
+        if len(bits) == 1 and nutrient_titles[bits[0]] in self_idx:
+            self_vals[self_idx[nutrient_titles[bits[0]]]] += len(group)
+        for i, j in combinations(bits, 2):
+            k = pair_idx.get((nutrient_titles[i], nutrient_titles[j]))
+            if k is not None:
+                vals[k] += len(group)
+    vm = max(vals.max(), self_vals.max())
+    return vals / vm, self_vals / vm
+
+
 def get_loc_weights(loc, loc_type, combs_list, nutrients):
     G_reduced = load_nutri_graph(loc, loc_type, reduced=True, projN=False, projR=False)
-    G = load_nutri_graph(loc, loc_type, reduced=True, projN=True, projR=False)
-    nutrient_ids = []
-    for node in G.nodes():
-        nutrient_ids.append(node)
-    node_title_dict = {}
-    for node_id in nutrient_ids:
-        node_title_dict[G_reduced.nodes[node_id]['title']] = node_id
-
-    vals = []
-    for comb in combs_list:
-        if G.has_edge(node_title_dict[comb[0]], node_title_dict[comb[1]]):
-            v = G[node_title_dict[comb[0]]][node_title_dict[comb[1]]]['weight']
-        else:
-            v = 0
-        vals.append(v)
-
-    self_vals = {}
-    deg_one_nodes = find_degree_one_nodes(G_reduced)
-    for node in deg_one_nodes:
-        if 'url' in G_reduced.nodes[node]:  # recipe node
-            neighbor = list(G_reduced.neighbors(node))[0]
-            if neighbor in self_vals:
-                self_vals[neighbor] += 1
-            else:
-                self_vals[neighbor] = 1
-    self_vals_nutrients = {}
-    for nutrient in nutrients:
-        nutrient_id = node_title_dict[nutrient]
-        if nutrient_id in self_vals:
-            self_vals_nutrients[nutrient] = self_vals[nutrient_id]
-        else:
-            self_vals_nutrients[nutrient] = 0
-    self_vals = list(self_vals_nutrients.values())
-    vm = max(max(vals), max(self_vals))
-    vals = list(np.array(vals) / vm)
-    self_vals = list(np.array(self_vals) / vm)
-    return vals, self_vals
+    nutrient_nodes, groups, _ = group_recipes_by_mask(G_reduced)
+    nutrient_titles = [G_reduced.nodes[node]['title'] for node in nutrient_nodes]
+    vals, self_vals = mask_weights(nutrient_titles, groups, combs_list, nutrients)
+    return list(vals), list(self_vals)
+
+
+@profiled()
+def nutrient_weight_tensor(loc_list, loc_type, combs_list, nutrients, save=True, verbose=False, store=None):
+    """
+    Normalized nutrient-pair weights and single-nutrient recipe counts for all locations at once.
+    Each reduced recipe-nutrient graph is read once and its recipes are grouped by nutrient mask; the recipe sets
+    connecting the nutrients are also saved to store (the default ResultsStore when not given) when save is True.
+    Returns W (locations x nutrient pairs in combs_list) and S (locations x nutrients)
+    """
+    with default_store(store, save) as store:
+        W = np.zeros((len(loc_list), len(combs_list)))
+        S = np.zeros((len(loc_list), len(nutrients)))
+        for i, loc in enumerate(tqdm(loc_list, total=len(loc_list), bar_format='{l_bar}{bar:30}{r_bar}',
+                                     colour='white')):
+            if verbose:
+                print_colored(loc, 'y')
+            G = load_nutri_graph(loc, loc_type + '_data', reduced=True, projN=False, projR=False)
+            nutrient_nodes, groups, _ = group_recipes_by_mask(G)
+            if save:
+                get_recipes_that_connect_nutrients(loc, loc_type, G, (nutrient_nodes, groups), store)
+            nutrient_titles = [G.nodes[node]['title'] for node in nutrient_nodes]
+            W[i], S[i] = mask_weights(nutrient_titles, groups, combs_list, nutrients)
+        return W, S
 
 
 def plot_nutrients_analysis(loc_list, loc_type, individual_plots, combs, combs_list,
-                            main_nutrients, main_nutrients_labels, save_plots, show_plots, verbose=False):
+                            main_nutrients, main_nutrients_labels, save_plots, show_plots, verbose=False, queue=None,
+                            store=None):
+    """
+    queue: FigureQueue the figures are added to (a new queue is created and flushed at the end when not given)
+    store: ResultsStore the recipes connecting the nutrients are saved to (the default store when not given)
+    """
+    flush = queue is None
+    if flush:
+        queue = FigureQueue()
+    W, S = nutrient_weight_tensor(loc_list, loc_type, combs_list, main_nutrients, verbose=verbose, store=store)
     vals_dic = {}
-    for loc in tqdm(loc_list, total=len(loc_list), bar_format='{l_bar}{bar:30}{r_bar}', colour='white'):
-        if verbose:
-            print_colored(loc, 'y')
-        get_recipes_that_connect_nutrients(loc, loc_type)
-        vals, self_vals = get_loc_weights(loc, loc_type + '_data', combs_list, main_nutrients)
-        vals_dic[loc] = vals
+    for i, loc in enumerate(loc_list):
+        vals_dic[loc] = W[i]
         if individual_plots:
             filename_r = 'figures/radar/' + loc_type + '_' + loc + '_nutrients_radar.png'
             filename_m = 'figures/matrix/' + loc_type + '_' + loc + '_nutrients_matrix.png'
             title = 'Nutrients for ' + loc_type + ' ' + loc + ' data'
-            radial_graph_plot({loc: vals}, combs, title, filename_r, save_plots, show_plots)
-            matrix_plot(vals, self_vals, main_nutrients_labels, title, filename_m, save_plots, show_plots)
+            radial_graph_plot({loc: W[i]}, combs, title, filename_r, save_plots, show_plots, queue)
+            matrix_plot(W[i], S[i], main_nutrients_labels, title, filename_m, save_plots, show_plots, queue)
     filename = 'figures/radar/' + loc_type + '_nutrients_radar.png'
     title = 'Nutrients for ' + loc_type + ' data'
-    radial_graph_plot(vals_dic, combs, title, filename, save_plots, show_plots)
-
-
-def get_recipes_that_connect_nutrients(loc, loc_type):
-    G = load_nutri_graph(loc, loc_type + '_data', reduced=True, projN=False, projR=False)
-
-    recipes = [node for node in G.nodes if 'url' in G.nodes[node]]
-    nutrients = [node for node in G.nodes if 'url' not in G.nodes[node]]
+    radial_graph_plot(vals_dic, combs, title, filename, save_plots, show_plots, queue)
+    if flush:
+        queue.flush()
+
+
+def incidence_masks(B):
+    """
+    Encodes the nutrient set of each recipe (row of the recipe x nutrient incidence B) as a bitmask
+    """
+    m = B.shape[1]
+    if m <= 62:
+        return (B.astype(np.int64) @ (np.int64(1) << np.arange(m, dtype=np.int64))).tolist()
+    masks = []
+    for i in range(B.shape[0]):
+        mask = 0
+        for j in B.indices[B.indptr[i]:B.indptr[i + 1]].tolist():
+            mask |= 1 << j
+        masks.append(mask)
+    return masks
+
+
+def group_recipes_by_mask(G):
+    """
+    Groups the recipes of a recipe-nutrient graph by the set of nutrients they connect to
+    Returns the nutrient nodes (bit i of a mask is nutrient i), a dictionary from mask to the recipe nodes with
+    that mask, and the recipe nodes
+    """
+    B, recipes, nutrients = incidence_from_graph(G)
+    groups = {}
+    for recipe, mask in zip(recipes, incidence_masks(B)):
+        groups.setdefault(mask, []).append(recipe)
+    return nutrients, groups, recipes
+
+
+def mask_bits(mask):
+    """
+    Indices of the set bits of a mask
+    """
+    bits = []
+    i = 0
+    while mask:
+        if mask & 1:
+            bits.append(i)
+        mask >>= 1
+        i += 1
+    return bits
+
+
+def get_recipes_that_connect_nutrients(loc, loc_type, G=None, grouped=None, store=None, params=None):
+    """
+    G: reduced recipe-nutrient graph (loaded when not given)
+    grouped: (nutrients, groups) from group_recipes_by_mask (computed when not given)
+    store: ResultsStore the recipe titles of each nutrient pair ('recipes_connecting_nutrients' groups, named by the
+           JSON list of the pair) and their normalized counts ('recipes_connecting_nutrients_share' ranking, in pair
+           order) are saved to, keyed by params
+    """
+    if G is None:
+        G = load_nutri_graph(loc, loc_type + '_data', reduced=True, projN=False, projR=False)
+    if grouped is None:
+        nutrients, groups, _ = group_recipes_by_mask(G)
+    else:
+        nutrients, groups = grouped
+    titles = [G.nodes[u]['title'] for u in nutrients]
 
     recipe_pairs_by_nutrients = {}
-    for u, v in combinations(nutrients, 2):
-        recipe_pairs_by_nutrients[(G.nodes[u]['title'], G.nodes[v]['title'])] = set()
-    for u in nutrients:
-        recipe_pairs_by_nutrients[(G.nodes[u]['title'], G.nodes[u]['title'])] = set()
-    for recipe in recipes:
-        connects_to_2_nutrients = False
-        for u, v in combinations(nutrients, 2):
-            if G.has_edge(recipe, u) and G.has_edge(recipe, v):
-                recipe_pairs_by_nutrients[(G.nodes[u]['title'], G.nodes[v]['title'])].add(G.nodes[recipe]['title'])
-                connects_to_2_nutrients = True
-        if not connects_to_2_nutrients:
-            for u in nutrients:
-                if G.has_edge(recipe, u):
-                    recipe_pairs_by_nutrients[(G.nodes[u]['title'], G.nodes[u]['title'])].add(
-                        G.nodes[recipe]['title'])
-
-    save_file = os.path.join('figures', 'text_res', loc_type + "_" + loc + '_recipes_connecting_nutrients.txt')
-    vm = 0
-    with open(save_file, 'w') as fout:
-        for keys, values in recipe_pairs_by_nutrients.items():
-            vm = max(len(values), vm)
-            data = ['###(' + keys[0] + ', ' + keys[1] + ')###: ']
-            data.extend(['`' + val + '`' for val in values])
-            fout.write(' '.join(data))
-            fout.write('\n')
-
-    save_file = os.path.join('figures', 'text_res', 'pkl', loc_type + "_" + loc + '_recipes_connecting_nutrients.pkl')
-    with open(save_file, 'wb') as fout:
-        pickle.dump(recipe_pairs_by_nutrients, fout)
-
+    for u, v in combinations(titles, 2):
+        recipe_pairs_by_nutrients[(u, v)] = set()
+    for u in titles:
+        recipe_pairs_by_nutrients[(u, u)] = set()
+    # recipes that connect at least two nutrients belong to every pair of their nutrients,
+    # recipes with a single nutrient belong to that nutrient alone
+    for mask, group in groups.items():
+        bits = mask_bits(mask)
+        recipe_titles = [G.nodes[recipe]['title'] for recipe in group]
+        if len(bits) == 1:
+            recipe_pairs_by_nutrients[(titles[bits[0]], titles[bits[0]])].update(recipe_titles)
+        for i, j in combinations(bits, 2):
+            recipe_pairs_by_nutrients[(titles[i], titles[j])].update(recipe_titles)
+
+    vm = max(len(values) for values in recipe_pairs_by_nutrients.values())
     recipe_count_normalized = {}
     for k, v in recipe_pairs_by_nutrients.items():
         recipe_count_normalized[k] = len(v) / vm
 
-    save_file = os.path.join('figures', 'text_res', 'summaries', loc_type + "_" + loc + '_recipes_connecting_nutrients_summary.txt')
-    with open(save_file, 'w') as fout:
-        for key, value in recipe_count_normalized.items():
-            data = '(' + key[0] + ', ' + key[1] + '): ' + str(value)
-            fout.write(data)
-            fout.write('\n')
+    if store is not None:
+        names = {pair: json.dumps(list(pair)) for pair in recipe_pairs_by_nutrients}
+        store.upsert_groups(loc_type + '_data', loc, 'recipes_connecting_nutrients',
+                            {names[pair]: values for pair, values in recipe_pairs_by_nutrients.items()}, params)
+        store.upsert_ranking(loc_type + '_data', loc, 'recipes_connecting_nutrients_share',
+                             [(names[pair], '(' + pair[0] + ', ' + pair[1] + ')', value)
+                              for pair, value in recipe_count_normalized.items()], params)
 
     return recipe_pairs_by_nutrients, recipe_count_normalized
 
@@ -160,17 +220,19 @@ def main():
     _, combs_list = categories(main_nutrients)
     combs, _ = categories(main_nutrients_labels)
 
-    if analyze_country:
-        plot_nutrients_analysis(countries, 'country', individual_plots, combs, combs_list,
-                                main_nutrients, main_nutrients_labels, save_plots, show_plots)
+    # all figures are exported together at the end
+    with FigureQueue() as queue:
+        if analyze_country:
+            plot_nutrients_analysis(countries, 'country', individual_plots, combs, combs_list,
+                                    main_nutrients, main_nutrients_labels, save_plots, show_plots, queue=queue)
 
-    if analyze_region:
-        plot_nutrients_analysis(regions, 'region', individual_plots, combs, combs_list,
-                                main_nutrients, main_nutrients_labels, save_plots, show_plots)
+        if analyze_region:
+            plot_nutrients_analysis(regions, 'region', individual_plots, combs, combs_list,
+                                    main_nutrients, main_nutrients_labels, save_plots, show_plots, queue=queue)
 
-    if analyze_continent:
-        plot_nutrients_analysis(continents, 'continent', individual_plots, combs, combs_list,
-                                main_nutrients, main_nutrients_labels, save_plots, show_plots)
+        if analyze_continent:
+            plot_nutrients_analysis(continents, 'continent', individual_plots, combs, combs_list,
+                                    main_nutrients, main_nutrients_labels, save_plots, show_plots, queue=queue)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,240 @@
+"""
+End-to-end benchmark of the pipeline on synthetic data (synthetic_data.py).
+Every stage, from process_data through assortativity, runs in a work directory on a generated dataset and is timed.
+The times are compared with the stored baselines for the same scale (recipes/ingredients), and stages that are
+slower than their baseline by more than the tolerance are flagged as regressions (exit status 1).
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+import stage_profiler
+import synthetic_data
+import process_data
+import construct_graphs
+import ingredients_graph_processing
+import nutrients_graph_processing
+from nutrients_graphs_analysis import categories, nutrient_weight_tensor
+from printing_functions import print_colored
+from cli import make_dirs
+
+BASELINES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pipeline_baselines.json')
+LOC_TYPES = ['country', 'region', 'continent']
+MAIN_NUTRIENTS = ['Total fats (g)', 'Protein (g)', 'Carbohydrates (g)', 'Sugars, total (g)',
+                  'Fiber, total dietary (g)']
+
+
+# ###### #
+# Stages #
+# ###### #
+# Each stage takes the run context (a dictionary with the settings and the locations found so far) and runs in the
+# work directory
+def stage_generate(ctx):
+    df = synthetic_data.generate_recipes(ctx['n_recipes'], ctx['n_ingredients'], seed=ctx['seed'])
+    synthetic_data.save_dataset(df)
+
+
+def stage_process_data(ctx):
+    df = pd.read_pickle('RDB_full_data.pkl')
+    df = process_data.generate_normalized_nutri_info(df)
+    df.to_pickle('RDB_full_data_filtered.pkl')
+    ctx['locations'] = {}
+    for loc_type in LOC_TYPES:
+        dfs = process_data.generate_location_dfs(df, ctx['min_recip'], loc_type)
+        process_data.save_location_dfs(dfs, path=loc_type + '_data')
+        ctx['locations'][loc_type] = sorted(dfs.keys())
+
+
+def stage_construct_graphs(ctx):
+    for loc_type, loc_list in ctx['locations'].items():
+        construct_graphs.build_graph_for_list(loc_list, loc_type + '_data')
+
+
+def stage_ingredients_graph_processing(ctx):
+    for loc_type, loc_list in ctx['locations'].items():
+        for loc in loc_list[:]:
+            G = ingredients_graph_processing.load_reduce_save(loc, loc_type + '_data', 5, 3)
+            if G.number_of_nodes() == 0:
+                # every recipe used a rare ingredient, nothing is left to analyze
+                loc_list.remove(loc)
+                continue
+            ingredients_graph_processing.load_reduced_project_save(loc, loc_type + '_data')
+
+
+def stage_nutrients_graph_processing(ctx):
+    for loc_type, loc_list in ctx['locations'].items():
+        for loc in loc_list:
+            nutrients_graph_processing.load_reduce_save(loc, loc_type + '_data', MAIN_NUTRIENTS, 0.15)
+            nutrients_graph_processing.load_reduced_project_save(loc, loc_type + '_data')
+
+
+def stage_ingredients_graphs_analysis(ctx):
+    from ingredients_graphs_analysis import analyze_all_graphs
+    from results_store import ResultsStore
+    locations = [(loc, loc_type + '_data') for loc_type, loc_list in ctx['locations'].items() for loc in loc_list]
+    with ResultsStore() as store:
+        analyze_all_graphs(locations, show=False, save=True, n_jobs=ctx['n_jobs'], store=store)
+
+
+def stage_nutrients_graphs_analysis(ctx):
+    _, combs_list = categories(MAIN_NUTRIENTS)
+    for loc_type, loc_list in ctx['locations'].items():
+        nutrient_weight_tensor(loc_list, loc_type, combs_list, MAIN_NUTRIENTS)
+
+
+def stage_assortativity(ctx):
+    from assortativity import load_ingredient_macro_index, compute_modularity, modularity_significance
+    macro_index = load_ingredient_macro_index()
+    for loc_type, loc_list in ctx['locations'].items():
+        for loc in loc_list:
+            compute_modularity(loc, loc_type, [0.5, 0.8, 0.99], macro_index, bootstrap=True, n_boot=100,
+                               seed=ctx['seed'], n_jobs=ctx['n_jobs'])
+        modularity_significance(loc_list, loc_type, n_perm=1000, seed=ctx['seed'])
+
+
+STAGES = [('generate', stage_generate),
+          ('process_data', stage_process_data),
+          ('construct_graphs', stage_construct_graphs),
+          ('ingredients_graph_processing', stage_ingredients_graph_processing),
+          ('nutrients_graph_processing', stage_nutrients_graph_processing),
+          ('ingredients_graphs_analysis', stage_ingredients_graphs_analysis),
+          ('nutrients_graphs_analysis', stage_nutrients_graphs_analysis),
+          ('assortativity', stage_assortativity)]
+
+
+def run_pipeline(n_recipes, workdir, n_ingredients=20000, min_recip=None, n_jobs=1, seed=0, stages=None):
+    """
+    Runs the pipeline stages in workdir and returns a dictionary from stage name to seconds
+    The stages are recorded by the stage profiler when it is enabled
+    min_recip: minimum number of recipes of a location (default 1% of n_recipes, at least 100)
+    stages: names of the stages to time (all by default); the earlier stages still run when a later one is chosen
+    """
+    ctx = {'n_recipes': n_recipes, 'n_ingredients': n_ingredients, 'n_jobs': n_jobs, 'seed': seed,
+           'min_recip': max(100, n_recipes // 100) if min_recip is None else min_recip}
+    names = [name for name, _ in STAGES]
+    last = max(names.index(stage) for stage in stages) if stages else len(STAGES) - 1
+    cwd = os.getcwd()
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    times = {}
+    try:
+        make_dirs()
+        for name, stage in STAGES[:last + 1]:
+            print_colored(name, 'y')
+            t0 = time.perf_counter()
+            with stage_profiler.stage(name, n_recipes=n_recipes):
+                stage(ctx)
+            if not stages or name in stages:
+                times[name] = time.perf_counter() - t0
+    finally:
+        os.chdir(cwd)
+    return times
+
+
+# ######### #
+# Baselines #
+# ######### #
+# The baselines of a scale are stored with the machine they were recorded on:
+#     {'<recipes>/<ingredients>': {'machine': machine_info(), 'times': {stage: seconds}}}
+def machine_info():
+    """
+    Description of the machine and Python version the benchmark runs on
+    """
+    return {'platform': platform.platform(), 'processor': platform.processor() or platform.machine(),
+            'cpus': os.cpu_count(), 'python': platform.python_version()}
+
+
+def load_baselines(filename=BASELINES_FILE):
+    if os.path.exists(filename):
+        with open(filename, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def save_baselines(baselines, filename=BASELINES_FILE):
+    with open(filename, 'w') as f:
+        json.dump(baselines, f, indent=1, sort_keys=True)
+        f.write('\n')
+
+
+def compare_to_baseline(times, baseline, tolerance=0.25):
+    """
+    Prints the times next to the baseline and returns the stages that are slower than baseline * (1 + tolerance)
+    """
+    regressions = []
+    for name, t in times.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f'     {name:<30} {t:9.2f} s (no baseline)')
+            continue
+        slow = t > base * (1 + tolerance)
+        if slow:
+            regressions.append(name)
+        print(f"{'SLOW' if slow else 'ok  '} {name:<30} {t:9.2f} s (baseline {base:.2f} s, {t / base - 1:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end pipeline benchmark on synthetic data')
+    parser.add_argument('--scales', type=int, nargs='+', default=[10000], help='numbers of recipes')
+    parser.add_argument('--ingredients', type=int, default=20000, help='size of the ingredient vocabulary')
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', choices=[name for name, _ in STAGES])
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown over the baseline')
+    parser.add_argument('--workdir', default=None, help='keep the generated data here (temporary by default)')
+    parser.add_argument('--update-baseline', action='store_true', help='store the times as the new baselines')
+    parser.add_argument('--trace', default=None, help='JSON file for the stage profiler trace')
+    parser.add_argument('--profile-stages', nargs='+', default=[],
+                        help='stages or instrumented functions to run under a profiler (requires --trace)')
+    args = parser.parse_args()
+    profiler = None
+    if args.trace:
+        profiler = stage_profiler.enable(os.path.abspath(args.trace), args.profile_stages,
+                                         os.path.join(os.path.dirname(os.path.abspath(args.trace)), 'profiles'))
+
+    baselines = load_baselines()
+    machine = machine_info()
+    regressions = []
+    for n_recipes in args.scales:
+        print_colored('Scale: ' + str(n_recipes) + ' recipes', 'g')
+        workdir = args.workdir or tempfile.mkdtemp(prefix='recipe_bench_')
+        try:
+            times = run_pipeline(n_recipes, os.path.join(workdir, str(n_recipes)), args.ingredients,
+                                 n_jobs=args.jobs, seed=args.seed, stages=args.stages)
+        finally:
+            if args.workdir is None:
+                shutil.rmtree(workdir, ignore_errors=True)
+        key = str(n_recipes) + '/' + str(args.ingredients)
+        if key not in baselines and not args.update_baseline:
+            print_colored('No baselines for ' + key + ' (stored for ' + ', '.join(sorted(baselines)) +
+                          '); run with --update-baseline to store them', 'y')
+        elif key in baselines and baselines[key]['machine'] != machine:
+            print_colored('The baselines for ' + key + ' were recorded on another machine (' +
+                          json.dumps(baselines[key]['machine']) + '), so the times may not be comparable', 'y')
+        baseline = baselines.get(key, {}).get('times', {})
+        regressions.extend((key, name) for name in compare_to_baseline(times, baseline, args.tolerance))
+        if args.update_baseline:
+            if baselines.get(key, {}).get('machine') != machine:
+                # times from another machine are not kept next to the new ones
+                baselines[key] = {'machine': machine, 'times': {}}
+            baselines[key]['times'].update(times)
+    if args.update_baseline:
+        save_baselines(baselines)
+    if profiler is not None:
+        profiler.save()
+        profiler.summary()
+    if regressions:
+        print_colored('Regressions: ' + ', '.join(key + ' ' + name for key, name in regressions), 'r')
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
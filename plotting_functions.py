@@ -1,11 +1,87 @@
+import hashlib
+import json
+import os
+from multiprocessing import Pool
+
 import numpy as np
-import plotly.graph_objects as go
-import plotly.express as px
-import matplotlib.pyplot as plt
-from scipy import stats
+
+# plotly and matplotlib are imported inside the functions that use them, so importing this module is cheap
+
+
+# ############### #
+# Rendering queue #
+# ############### #
+def _write_image_json(args):
+    import plotly.io as pio
+    fig_json, filename = args
+    pio.from_json(fig_json).write_image(filename)
+
+
+class FigureQueue:
+    """
+    Collects plotly figures and exports them in bulk with flush(): through one long-lived image export session
+    (plotly.io.write_images) or, with n_jobs > 1, across a small process pool.
+    Figures whose content hash is unchanged since their last export (recorded in a manifest file) are skipped.
+    """
+    def __init__(self, manifest=os.path.join('figures', 'render_manifest.json'), n_jobs=1):
+        self.manifest_file = manifest
+        self.n_jobs = n_jobs
+        self.pending = []
+        self.skipped = 0
+        self.manifest = {}
+        if os.path.exists(manifest):
+            with open(manifest, 'r') as f:
+                self.manifest = json.load(f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+    def add(self, fig, filename):
+        fig_json = fig.to_json()
+        fig_hash = hashlib.sha1(fig_json.encode()).hexdigest()
+        if self.manifest.get(filename) == fig_hash and os.path.exists(filename):
+            self.skipped += 1
+            return
+        self.pending = [p for p in self.pending if p[1] != filename]
+        self.pending.append((fig_json, filename, fig_hash))
+
+    def flush(self):
+        if not self.pending:
+            return
+        import plotly.io as pio
+        if self.n_jobs > 1:
+            with Pool(self.n_jobs) as pool:
+                pool.map(_write_image_json, [(fig_json, filename) for fig_json, filename, _ in self.pending])
+        elif hasattr(pio, 'write_images'):
+            pio.write_images([pio.from_json(fig_json) for fig_json, _, _ in self.pending],
+                             [filename for _, filename, _ in self.pending])
+        else:
+            for args in self.pending:
+                _write_image_json(args[:2])
+        for _, filename, fig_hash in self.pending:
+            self.manifest[filename] = fig_hash
+        self.pending = []
+        if os.path.dirname(self.manifest_file) != '' and not os.path.exists(os.path.dirname(self.manifest_file)):
+            os.makedirs(os.path.dirname(self.manifest_file))
+        with open(self.manifest_file, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+
+
+def save_figure(fig, filename, queue=None):
+    """
+    Exports fig now, or adds it to the rendering queue if one is given
+    """
+    if queue is not None:
+        queue.add(fig, filename)
+    else:
+        fig.write_image(filename)
 
 
-def radial_graph_plot(vals_dict, theta, title, filename, save=True, show=False):
+def radial_graph_plot(vals_dict, theta, title, filename, save=True, show=False, queue=None):
+    import plotly.graph_objects as go
     fig = go.Figure()
 
     for name, vals in vals_dict.items():
@@ -32,15 +108,16 @@ def radial_graph_plot(vals_dict, theta, title, filename, save=True, show=False):
     )
 
     if save:
-        fig.write_image(filename)
+        save_figure(fig, filename, queue)
     if show:
         fig.show()
 
 
-def matrix_plot(vals, diag_vals, labels, title, filename, save=True, show=False):
+def matrix_plot(vals, diag_vals, labels, title, filename, save=True, show=False, queue=None):
     """
     Assumes that vals correspond to using the "itertools" combinations function on nutrients
     """
+    import plotly.express as px
     num_nutrients = len(labels)
     mat = np.zeros([num_nutrients, num_nutrients]) + np.nan
 
@@ -57,21 +134,13 @@ def matrix_plot(vals, diag_vals, labels, title, filename, save=True, show=False)
     fig = px.imshow(mat, x=labels, y=labels, color_continuous_scale='ice')
     fig.update_layout(title_text=title, title_x=0.5)
     if save:
-        fig.write_image(filename)
+        save_figure(fig, filename, queue)
     if show:
         fig.show()
 
 
-def diameters_plot(file_path, title, show_plot=False, save_plot=False):
-    # Read data from file
-    locations = []
-    values = []
-    with open(file_path, 'r') as f:
-        for line in f:
-            location, value = line.split(': ')
-            locations.append(location)
-            values.append(float(value))
-
+def diameters_bar_plot(locations, values, title, save_path=None, show_plot=False):
+    import matplotlib.pyplot as plt
     # Create plot
     plt.bar(locations, values)
     plt.xlabel('Location')
@@ -81,8 +150,7 @@ def diameters_plot(file_path, title, show_plot=False, save_plot=False):
     plt.xticks(rotation=90, fontsize=14)
 
     # Save and/or show the plot
-    if save_plot:
-        save_path = file_path.replace('.txt', '.png')
+    if save_path:
         plt.savefig(save_path, dpi=300, bbox_inches='tight')
     if show_plot:
         plt.show()
@@ -90,19 +158,21 @@ def diameters_plot(file_path, title, show_plot=False, save_plot=False):
         plt.close()
 
 
-def modularity_plot(data_lists, x_labels, y_labels, title=None, save_path=None, show=True):
+def modularity_plot(data_lists, x_labels, y_labels, title=None, save_path=None, show=True, queue=None):
+    import plotly.express as px
     fig = px.scatter()
     for i, data_list in enumerate(data_lists):
         fig.add_scatter(x=x_labels, y=data_list, name=y_labels[i])
     fig.update_layout(title=title, xaxis_title="locations", yaxis_title="modularity")
     if save_path:
-        fig.write_image(save_path)
+        save_figure(fig, save_path, queue)
     if show:
         fig.show()
     return fig
 
 
-def modularity_bootstrap_plot(Q, dictionary, x_labels, title='bootstrap plot', save_path=None, show=True):
+def modularity_bootstrap_plot(Q, dictionary, x_labels, title='bootstrap plot', save_path=None, show=True, queue=None):
+    import plotly.graph_objects as go
     for key, value in dictionary.items():
         data_lists = [Q, value['mode']]
         y_labels = ['Q', 'Q_sampled_' + str(key)]
@@ -110,7 +180,7 @@ def modularity_bootstrap_plot(Q, dictionary, x_labels, title='bootstrap plot', s
         fig.add_trace(go.Scatter(x=x_labels + x_labels[::-1], y=value['max'] + value['min'][::-1], fill='toself', fillcolor='rgba(0,100,80,0.2)', line=dict(color='rgba(255, 255, 255, 0)'), showlegend=False))
 
         if save_path:
-            fig.write_image(save_path[:-4] + "_" + str(key) + '.png')
+            save_figure(fig, save_path[:-4] + "_" + str(key) + '.png', queue)
 
         if show:
             fig.show()
@@ -1,4 +1,3 @@
-import matplotlib.pyplot as plt
 import pandas as pd
 import os
 from tqdm import tqdm
@@ -109,6 +108,7 @@ def plt_location_recipe_count(df, location_type='country'):
 
     recipe_count = list(location_counts.values)
 
+    import matplotlib.pyplot as plt
     plt.hist(recipe_count, 300)
     plt.title(location_type + ' num recipes')
     plt.show()
@@ -0,0 +1,167 @@
+"""
+Load test of the query service (query_service.py).
+A pool of distinct queries is drawn from the reduced graphs of the locations (ingredients are picked in proportion
+to their degree), and concurrent clients send requests sampled from the pool. The latency percentiles, the
+throughput, and the cache hit rate of the service are reported.
+Unless --url is given, the service is started in a subprocess on a free port and stopped at the end.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+import numpy as np
+
+from query_service import LOC_TYPES, LocationGraphs, QueryEngine
+from printing_functions import print_colored
+
+PERCENTILES = [50, 90, 95, 99]
+
+
+def make_queries(n_queries, loc_types=LOC_TYPES, seed=0):
+    """
+    n_queries distinct query paths over the locations with reduced graphs (in the current directory)
+    """
+    rng = np.random.default_rng(seed)
+    engine = QueryEngine()
+    graphs = [(loc_type, loc, LocationGraphs(loc, loc_type)) for loc_type in loc_types
+              for loc in engine.locations(loc_type)]
+    graphs = [(loc_type, loc, g) for loc_type, loc, g in graphs if len(g.ingredients) > 1]
+    if not graphs:
+        raise FileNotFoundError('no reduced ingredients graphs in ' + os.getcwd())
+    queries = set()
+    # the pool cannot hold more queries than there are distinct ones
+    attempts = 0
+    while len(queries) < n_queries and attempts < 20 * n_queries:
+        attempts += 1
+        loc_type, loc, g = graphs[rng.integers(len(graphs))]
+        p = (g.degree + 1) / (g.degree + 1).sum()
+        i, j = rng.choice(len(g.ingredients), size=2, replace=False, p=p)
+        kind = rng.choice(['neighbors', 'cooccurrence', 'pair', 'rank', 'recipes'])
+        params = {'loc_type': loc_type, 'loc': loc, 'ingredient': g.ingredients[i]}
+        if kind == 'cooccurrence':
+            params['k'] = 10
+        elif kind == 'pair':
+            kind, params['other'] = 'cooccurrence', g.ingredients[j]
+        elif kind == 'rank':
+            del params['loc']
+        queries.add('/' + kind + '?' + urlencode(params))
+    return sorted(queries)
+
+
+def _client(url, paths, latencies, errors):
+    for path in paths:
+        t0 = time.perf_counter()
+        try:
+            with urlopen(url + path) as response:
+                response.read()
+        except (HTTPError, URLError):
+            errors.append(path)
+            continue
+        latencies.append(time.perf_counter() - t0)
+
+
+def run_load(url, queries, n_requests, n_clients, seed=0):
+    """
+    Sends n_requests requests sampled from queries with n_clients concurrent clients
+    Returns the latencies (s), the failed paths, and the wall time
+    """
+    rng = np.random.default_rng(seed)
+    paths = [queries[k] for k in rng.integers(len(queries), size=n_requests)]
+    latencies, errors = [], []
+    threads = [threading.Thread(target=_client, args=(url, paths[c::n_clients], latencies, errors))
+               for c in range(n_clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return np.array(latencies), errors, time.perf_counter() - t0
+
+
+def report(latencies, errors, wall, stats=None):
+    ms = latencies * 1000
+    print_colored('Requests: ' + str(len(latencies)) + ' ok, ' + str(len(errors)) + ' failed', 'g')
+    print(f'throughput {len(latencies) / wall:9.1f} req/s')
+    for q in PERCENTILES:
+        print(f'p{q:<9} {np.percentile(ms, q):9.2f} ms')
+    print(f'max        {ms.max():9.2f} ms')
+    if stats is not None:
+        cache = stats['cache']
+        total = cache['hits'] + cache['misses']
+        print(f"cache hit rate {cache['hits'] / max(total, 1):.1%} ({cache['size']} cached answers)")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_service(cache_size, timeout=30.):
+    """
+    Starts the service in a subprocess (serving the current directory) and waits until it answers
+    """
+    port = _free_port()
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query_service.py')
+    proc = subprocess.Popen([sys.executable, script, '--port', str(port), '--cache-size', str(cache_size)],
+                            stdout=subprocess.DEVNULL)
+    url = 'http://127.0.0.1:' + str(port)
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < timeout:
+        try:
+            with urlopen(url + '/stats'):
+                return proc, url
+        except URLError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise TimeoutError('the query service did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of the query service')
+    parser.add_argument('--url', default=None, help='running service (started here by default)')
+    parser.add_argument('--cache-dir', default='.', help='directory with the location graphs')
+    parser.add_argument('--loc-types', nargs='+', default=LOC_TYPES, choices=LOC_TYPES)
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16], help='numbers of concurrent clients')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per run')
+    parser.add_argument('--queries', type=int, default=500, help='number of distinct queries')
+    parser.add_argument('--cache-size', type=int, default=4096, help='cache size of the started service')
+    parser.add_argument('--warmup', type=int, default=100, help='requests sent before the measured runs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='JSON file for the latencies of every run')
+    args = parser.parse_args()
+    os.chdir(args.cache_dir)
+
+    queries = make_queries(args.queries, args.loc_types, args.seed)
+    proc, url = (None, args.url) if args.url else start_service(args.cache_size)
+    results = {}
+    try:
+        run_load(url, queries, args.warmup, 1, args.seed)
+        for n_clients in args.clients:
+            print_colored(str(n_clients) + ' clients', 'y')
+            latencies, errors, wall = run_load(url, queries, args.requests, n_clients, args.seed + n_clients)
+            with urlopen(url + '/stats') as response:
+                stats = json.loads(response.read())
+            report(latencies, errors, wall, stats)
+            results[n_clients] = {'throughput': len(latencies) / wall, 'errors': len(errors),
+                                  'percentiles_ms': {q: float(np.percentile(latencies * 1000, q))
+                                                     for q in PERCENTILES}, 'cache': stats['cache']}
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""
+Local HTTP query service over the reduced ingredients graphs.
+The reduced recipe-ingredient graph and the ingredients projection of a location are loaded on its first query and
+kept in memory as CSR arrays (incidence, projection weights, and degrees), and answers are cached in an LRU cache
+keyed by the location and the query. Example:
+    python query_service.py --port 8765
+    curl 'http://127.0.0.1:8765/cooccurrence?loc_type=country&loc=Thai&ingredient=garlic&k=10'
+Queries (GET, JSON answers):
+    /locations                                              locations with reduced graphs
+    /neighbors?loc_type=&loc=&ingredient=                   neighbors of an ingredient in the projection
+    /cooccurrence?loc_type=&loc=&ingredient=[&k=][&other=]  top k co-occurring ingredients (or the weight of a pair)
+    /rank?loc_type=&ingredient=[&loc=][&metric=]            rank of an ingredient by degree, weighted_degree, or
+                                                            betweenness (from the results store) in every location
+    /recipes?loc_type=&loc=&ingredient=[&ingredient=][&limit=]   recipes that contain all the ingredients
+    /similar?loc_type=&loc=&ingredient=[&k=][&metric=]      top k similar ingredients by cosine, jaccard, or pmi
+    /stats                                                  cache hits, misses, and loaded locations
+"""
+import argparse
+import json
+import os
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import scipy.sparse as sp
+
+from ingredients_graph_processing import load_graph
+from sparse_graph_functions import graph_to_csr
+from printing_functions import print_colored
+
+LOC_TYPES = ['country', 'region', 'continent']
+RANK_METRICS = ['degree', 'weighted_degree', 'betweenness']
+
+
+class QueryError(ValueError):
+    """
+    Invalid query (answered with status 400, or 404 when the location or ingredient is unknown)
+    """
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with hit and miss counts
+    """
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return True, self._items[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._items), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+class LocationGraphs:
+    """
+    CSR structures of the reduced graphs of one location.
+    Ingredients are numbered in the order of the projection nodes, recipes in the order of the reduced graph.
+    """
+    def __init__(self, loc, loc_type):
+        G = load_graph(loc, loc_type + '_data', reduced=True)
+        G_i = load_graph(loc, loc_type + '_data', reduced=True, projI=True)
+        if G_i.number_of_nodes() > 0:
+            self.projection, nodes = graph_to_csr(G_i)
+        else:
+            # every recipe of the location was pruned
+            self.projection, nodes = sp.csr_matrix((0, 0)), []
+        self.ingredients = [G.nodes[node]['title'] for node in nodes]
+        self.index = {title: i for i, title in enumerate(self.ingredients)}
+        node_index = {node: i for i, node in enumerate(nodes)}
+
+        recipe_nodes = [node for node in G.nodes if 'url' in G.nodes[node]]
+        self.recipes = [{'title': G.nodes[node]['title'], 'url': G.nodes[node]['url']} for node in recipe_nodes]
+        indptr, indices = [0], []
+        for node in recipe_nodes:
+            indices.extend(node_index[u] for u in G.neighbors(node) if u in node_index)
+            indptr.append(len(indices))
+        data = np.ones(len(indices))
+        self.incidence_T = sp.csr_matrix(sp.csr_matrix((data, indices, indptr),
+                                                       shape=(len(recipe_nodes), len(nodes))).T)
+        self.degree = np.diff(self.projection.indptr)
+        self.weighted_degree = np.asarray(self.projection.sum(axis=1)).ravel()
+        self._similarity = None
+
+    def similarity_index(self):
+        if self._similarity is None:
+            from ingredient_similarity import SimilarityIndex
+            self._similarity = SimilarityIndex(self.incidence_T.T, names=self.ingredients)
+        return self._similarity
+
+    def ingredient(self, title):
+        if title not in self.index:
+            raise QueryError('unknown ingredient: ' + title, 404)
+        return self.index[title]
+
+    def row(self, i):
+        start, end = self.projection.indptr[i], self.projection.indptr[i + 1]
+        return self.projection.indices[start:end], self.projection.data[start:end]
+
+
+def _rank(values, i):
+    # 1 for the largest value; ties share the best rank
+    return int(np.count_nonzero(values > values[i])) + 1
+
+
+class QueryEngine:
+    """
+    Answers the queries of the service from the loaded locations and the cache
+    """
+    def __init__(self, cache_size=4096, store_path=os.path.join('results', 'results.db')):
+        self.cache = LRUCache(cache_size)
+        self.store_path = store_path
+        self._graphs = {}
+        self._load_lock = threading.Lock()
+
+    def locations(self, loc_type):
+        path = loc_type + '_data'
+        if not os.path.isdir(path):
+            return []
+        suffix = '_ingredients_reduced_ingProjI.gml'
+        return sorted(f[:-len(suffix)] for f in os.listdir(path) if f.endswith(suffix))
+
+    def graphs(self, loc_type, loc):
+        key = (loc_type, loc)
+        if key not in self._graphs:
+            with self._load_lock:
+                if key not in self._graphs:
+                    if loc not in self.locations(loc_type):
+                        raise QueryError('no reduced graphs for ' + loc_type + '/' + loc, 404)
+                    self._graphs[key] = LocationGraphs(loc, loc_type)
+        return self._graphs[key]
+
+    def query(self, name, params):
+        """
+        name: query name (path without the leading /)
+        params: dictionary from parameter name to list of values (as given by parse_qs)
+        """
+        handlers = {'locations': self.q_locations, 'neighbors': self.q_neighbors,
+                    'cooccurrence': self.q_cooccurrence, 'rank': self.q_rank, 'recipes': self.q_recipes,
+                    'similar': self.q_similar, 'stats': self.q_stats}
+        if name not in handlers:
+            raise QueryError('unknown query: ' + name, 404)
+        if name == 'stats':
+            return self.q_stats(params)
+        location = (_param(params, 'loc_type', ''), _param(params, 'loc', ''))
+        key = (location, name, tuple(sorted((k, tuple(v)) for k, v in params.items() if k not in ('loc_type', 'loc'))))
+        found, value = self.cache.get(key)
+        if not found:
+            value = handlers[name](params)
+            self.cache.put(key, value)
+        return value
+
+    # ####### #
+    # Queries #
+    # ####### #
+    def q_locations(self, params):
+        return {loc_type: self.locations(loc_type) for loc_type in LOC_TYPES}
+
+    def q_stats(self, params):
+        return {'cache': self.cache.stats(), 'loaded': [loc_type + '/' + loc for loc_type, loc in self._graphs]}
+
+    def q_neighbors(self, params):
+        g = self.graphs(_loc_type(params), _param(params, 'loc'))
+        indices, _ = g.row(g.ingredient(_param(params, 'ingredient')))
+        return sorted(g.ingredients[j] for j in indices)
+
+    def q_cooccurrence(self, params):
+        g = self.graphs(_loc_type(params), _param(params, 'loc'))
+        i = g.ingredient(_param(params, 'ingredient'))
+        indices, weights = g.row(i)
+        other = _param(params, 'other', None)
+        if other is not None:
+            j = g.ingredient(other)
+            pos = np.flatnonzero(indices == j)
+            return {'ingredient': g.ingredients[i], 'other': other,
+                    'weight': float(weights[pos[0]]) if len(pos) > 0 else 0.}
+        k = _int_param(params, 'k', 10)
+        order = np.lexsort((indices, -weights))[:k]
+        return [{'ingredient': g.ingredients[indices[j]], 'weight': float(weights[j])} for j in order]
+
+    def q_rank(self, params):
+        loc_type = _loc_type(params)
+        title = _param(params, 'ingredient')
+        metric = _param(params, 'metric', 'degree')
+        if metric not in RANK_METRICS:
+            raise QueryError('unsupported metric: ' + metric)
+        locs = [_param(params, 'loc')] if 'loc' in params else self.locations(loc_type)
+        betweenness = self._stored_ranks(loc_type, 'betweenness_centrality') if metric == 'betweenness' else None
+        ranks = {}
+        for loc in locs:
+            g = self.graphs(loc_type, loc)
+            if title not in g.index:
+                ranks[loc] = None
+            elif betweenness is not None:
+                # only the top k of the analyses are stored
+                ranks[loc] = betweenness.get(loc, {}).get(title)
+            else:
+                values = g.degree if metric == 'degree' else g.weighted_degree
+                i = g.index[title]
+                ranks[loc] = {'rank': _rank(values, i), 'of': len(values), 'value': float(values[i])}
+        return ranks
+
+    def _stored_ranks(self, loc_type, metric):
+        from results_store import ResultsStore
+        if not os.path.exists(self.store_path):
+            raise QueryError('no results store at ' + self.store_path, 404)
+        with ResultsStore(self.store_path) as store:
+            rankings = store.get_rankings(loc_type + '_data', metric)
+        return {loc: {title: {'rank': r + 1, 'of': None, 'value': value}
+                      for r, (_, title, value) in enumerate(items)} for loc, items in rankings.items()}
+
+    def q_recipes(self, params):
+        g = self.graphs(_loc_type(params), _param(params, 'loc'))
+        titles = params.get('ingredient', [])
+        if not titles:
+            raise QueryError('missing parameter: ingredient')
+        rows = None
+        for title in titles:
+            i = g.ingredient(title)
+            recipes = g.incidence_T.indices[g.incidence_T.indptr[i]:g.incidence_T.indptr[i + 1]]
+            rows = recipes if rows is None else np.intersect1d(rows, recipes, assume_unique=True)
+        limit = _int_param(params, 'limit', 50)
+        return {'count': len(rows), 'recipes': [g.recipes[r] for r in np.sort(rows)[:limit]]}
+
+    def q_similar(self, params):
+        from ingredient_similarity import METRICS
+        g = self.graphs(_loc_type(params), _param(params, 'loc'))
+        i = g.ingredient(_param(params, 'ingredient'))
+        metric = _param(params, 'metric', 'cosine')
+        if metric not in METRICS:
+            raise QueryError('unsupported metric: ' + metric)
+        return [{'ingredient': title, 'score': score}
+                for title, score in g.similarity_index().query(i, _int_param(params, 'k', 10), metric)]
+
+
+def _param(params, name, default=KeyError):
+    if name in params:
+        return params[name][0]
+    if default is KeyError:
+        raise QueryError('missing parameter: ' + name)
+    return default
+
+
+def _int_param(params, name, default, minimum=1):
+    try:
+        value = int(_param(params, name, default))
+    except ValueError:
+        raise QueryError(name + ' must be an integer')
+    if value < minimum:
+        raise QueryError(name + ' must be at least ' + str(minimum))
+    return value
+
+
+def _loc_type(params):
+    loc_type = _param(params, 'loc_type')
+    if loc_type not in LOC_TYPES:
+        raise QueryError('unsupported location type: ' + loc_type)
+    return loc_type
+
+
+# ###### #
+# Server #
+# ###### #
+class QueryHandler(BaseHTTPRequestHandler):
+    engine = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            status, body = 200, self.engine.query(url.path.strip('/'), parse_qs(url.query))
+        except QueryError as e:
+            status, body = e.status, {'error': str(e)}
+        except Exception as e:
+            # the handler thread would otherwise close the connection without a response
+            status, body = 500, {'error': type(e).__name__ + ': ' + str(e)}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class QueryServer(ThreadingHTTPServer):
+    # the default backlog of 5 connections makes concurrent clients wait for SYN retransmits
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def make_server(host='127.0.0.1', port=8765, cache_size=4096, store_path=os.path.join('results', 'results.db')):
+    """
+    Threaded HTTP server over a new QueryEngine (port 0 picks a free port, see server.server_address)
+    """
+    handler = type('Handler', (QueryHandler,), {'engine': QueryEngine(cache_size, store_path)})
+    return QueryServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query service over the reduced ingredients graphs')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--cache-size', type=int, default=4096, help='number of cached answers')
+    parser.add_argument('--cache-dir', default='.', help='directory with the location graphs and results')
+    parser.add_argument('--preload', action='store_true', help='load every location before serving')
+    args = parser.parse_args()
+    os.chdir(args.cache_dir)
+    server = make_server(args.host, args.port, args.cache_size)
+    if args.preload:
+        for loc_type in LOC_TYPES:
+            for loc in server.RequestHandlerClass.engine.locations(loc_type):
+                server.RequestHandlerClass.engine.graphs(loc_type, loc)
+    print_colored('Serving on http://' + args.host + ':' + str(server.server_address[1]), 'g')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
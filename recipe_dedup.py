@@ -0,0 +1,285 @@
+"""
+Near-duplicate recipe detection, run on the combined data before the location dataframes and graphs are built.
+Candidate pairs are the recipes that share an LSH band of the MinHash signatures of their ingredient sets (minhash.py)
+and the recipes with the same normalized title. A candidate pair is a duplicate when the Jaccard similarity of the
+ingredient sets is at least the threshold and, by default, the normalized titles and the countries are equal.
+Duplicates are grouped into clusters (connected components of the duplicate pairs), and the recipe with the most
+ingredients (the first one on ties) represents its cluster. Modes:
+    mark      adds the 'duplicate cluster' (-1 for unique recipes) and 'is duplicate' columns
+    drop      keeps the representatives only
+    collapse  keeps the representatives with the union of the ingredients of their cluster and a 'duplicates' count
+              (the other columns, such as the recipe nutrition, are those of the representative: they describe its
+              own ingredient list, not the union, and are not recomputed)
+Example:
+    python recipe_dedup.py RDB_full_data.pkl RDB_full_data_dedup.pkl --mode drop
+"""
+import argparse
+import os
+import re
+import tempfile
+import time
+import unicodedata
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse import csgraph
+
+from minhash import minhash_signatures, unique_pairs, LSHIndex
+from printing_functions import print_colored
+from stage_profiler import profiled
+
+MODES = ['mark', 'drop', 'collapse']
+TITLE_STOPWORDS = {'recipe', 'recipes', 'the', 'a', 'an', 'my', 'best', 'easy', 'homemade'}
+
+
+def normalize_title(title):
+    """
+    Lower case ASCII words of the title without punctuation and filler words ('Easy Chicken Curry Recipe!' and
+    'chicken curry' are equal)
+    """
+    title = unicodedata.normalize('NFKD', str(title)).encode('ascii', 'ignore').decode().lower()
+    words = re.sub(r'[^a-z0-9]+', ' ', title).split()
+    return ' '.join(w for w in words if w not in TITLE_STOPWORDS)
+
+
+def ingredient_incidence(df):
+    """
+    Recipe x ingredient incidence (CSR) of the 'ingredient information' dictionaries
+    """
+    vocab = {}
+    indptr, indices = [0], []
+    for info in df['ingredient information']:
+        indices.extend(sorted(vocab.setdefault(name, len(vocab)) for name in info))
+        indptr.append(len(indices))
+    return sp.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(df), len(vocab)))
+
+
+def title_pairs(titles, max_group=200):
+    """
+    Pairs of recipes with the same normalized title. Groups larger than max_group would add a quadratic number of
+    pairs, their duplicates are found through the LSH candidates only.
+    """
+    codes = pd.factorize(titles)[0]
+    order = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes)
+    pairs = []
+    start = 0
+    for size in counts:
+        if 1 < size <= max_group:
+            members = order[start:start + size]
+            i, j = np.triu_indices(size, 1)
+            pairs.append(np.stack([members[i], members[j]], axis=1))
+        start += size
+    if not pairs:
+        return np.zeros((0, 2), dtype=np.int64)
+    return np.sort(np.concatenate(pairs), axis=1)
+
+
+def pair_jaccard(B, pairs):
+    """
+    Jaccard similarity of the ingredient sets of each pair of recipes
+    """
+    if len(pairs) == 0:
+        return np.zeros(0)
+    sizes = np.diff(B.indptr)
+    inter = np.asarray(B[pairs[:, 0]].multiply(B[pairs[:, 1]]).sum(axis=1)).ravel()
+    union = sizes[pairs[:, 0]] + sizes[pairs[:, 1]] - inter
+    return np.divide(inter, union, out=np.zeros(len(pairs)), where=union > 0)
+
+
+@profiled('dedup.find_duplicates')
+def find_duplicates(df, threshold=0.8, match_titles=True, loc_type='country', num_perm=128, bands=16, seed=0,
+                    max_bucket=200, verbose=False):
+    """
+    Returns the cluster of each recipe (-1 for recipes without duplicates) and the duplicate pairs with their Jaccard
+    similarity (a dataframe with the columns i, j, jaccard; positions in df)
+    threshold: minimum Jaccard similarity of the ingredient sets
+    match_titles: duplicates must also have the same normalized title
+    loc_type: duplicates must have the same location of this type (None to compare across locations)
+    max_bucket: larger LSH buckets only pair neighbors (see LSHIndex.candidate_pairs) and larger title groups are
+                left to LSH, which keeps the number of candidates near-linear in the number of recipes
+    """
+    t0 = time.perf_counter()
+    B = ingredient_incidence(df)
+    titles = np.array([normalize_title(t) for t in df['recipe title']], dtype=object)
+    lsh = LSHIndex(minhash_signatures(B, num_perm, seed), bands)
+    pairs = unique_pairs([lsh.candidate_pairs(max_bucket), title_pairs(titles, max_bucket)], len(df))
+    n_candidates = len(pairs)
+    if match_titles and len(pairs) > 0:
+        pairs = pairs[titles[pairs[:, 0]] == titles[pairs[:, 1]]]
+    if loc_type is not None and len(pairs) > 0:
+        locs = df[loc_type].to_numpy()
+        pairs = pairs[locs[pairs[:, 0]] == locs[pairs[:, 1]]]
+    jaccard = pair_jaccard(B, pairs)
+    keep = jaccard >= threshold
+    pairs, jaccard = pairs[keep], jaccard[keep]
+
+    n = len(df)
+    A = sp.csr_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+    _, labels = csgraph.connected_components(A, directed=False)
+    # components of one recipe are not clusters
+    sizes = np.bincount(labels)
+    clusters = np.where(sizes[labels] > 1, labels, -1)
+    _, clusters[clusters >= 0] = np.unique(clusters[clusters >= 0], return_inverse=True)
+    if verbose:
+        print_colored(str(n_candidates) + ' candidate pairs, ' + str(len(pairs)) + ' duplicate pairs, ' +
+                      str(clusters.max() + 1) + ' clusters (' + f'{time.perf_counter() - t0:.1f} s)', 'g')
+    return clusters, pd.DataFrame({'i': pairs[:, 0], 'j': pairs[:, 1], 'jaccard': jaccard})
+
+
+def representatives(df, clusters):
+    """
+    Position of the representative of each cluster: the recipe with the most ingredients, the first one on ties
+    """
+    sizes = df['ingredient information'].map(len).to_numpy()
+    members = np.flatnonzero(clusters >= 0)
+    if len(members) == 0:
+        return members
+    order = members[np.lexsort((members, -sizes[members], clusters[members]))]
+    first = np.concatenate([[True], clusters[order][1:] != clusters[order][:-1]])
+    return order[first]
+
+
+def cluster_report(df, clusters, pairs):
+    """
+    One row per cluster: size, representative, normalized title, titles, url indices, locations, and the lowest
+    Jaccard similarity of its duplicate pairs
+    """
+    reps = representatives(df, clusters)
+    min_jaccard = pairs.assign(cluster=clusters[pairs['i'].to_numpy()]).groupby('cluster')['jaccard'].min() \
+        if len(pairs) > 0 else pd.Series(dtype=float)
+    grouped = df.assign(cluster=clusters)[clusters >= 0].groupby('cluster')
+    report = pd.DataFrame({
+        'size': grouped.size(),
+        'representative url idx': df['url idx'].to_numpy()[reps],
+        'normalized title': [normalize_title(t) for t in df['recipe title'].to_numpy()[reps]],
+        'titles': grouped['recipe title'].agg(lambda t: sorted(set(t))),
+        'url idx': grouped['url idx'].agg(list),
+        'countries': grouped['country'].agg(lambda t: sorted(set(t))),
+        'min jaccard': min_jaccard,
+    })
+    report.index.name = 'cluster'
+    return report.sort_values('size', ascending=False)
+
+
+def _union_ingredients(infos):
+    merged = {}
+    for info in infos:
+        for name, value in info.items():
+            merged.setdefault(name, value)
+    return merged
+
+
+def apply_mode(df, clusters, mode='mark'):
+    """
+    Marks, drops, or collapses the duplicates of df (see the module docstring). Collapsed recipes keep the nutrition
+    and other columns of their representative.
+    """
+    if mode not in MODES:
+        raise ValueError('Unsupported mode: ' + mode)
+    reps = representatives(df, clusters)
+    is_duplicate = clusters >= 0
+    is_duplicate[reps] = False
+    if mode == 'mark':
+        return df.assign(**{'duplicate cluster': clusters, 'is duplicate': is_duplicate})
+    kept = df[~is_duplicate].copy()
+    if mode == 'collapse':
+        kept_clusters = clusters[~is_duplicate]
+        grouped = df['ingredient information'].groupby(clusters)
+        # the representative's own entries come first, so its values win
+        merged = {c: _union_ingredients([df['ingredient information'].iloc[rep]] + list(grouped.get_group(c)))
+                  for c, rep in enumerate(reps)}
+        kept['ingredient information'] = [merged[c] if c >= 0 else info
+                                          for c, info in zip(kept_clusters, kept['ingredient information'])]
+        sizes = np.bincount(clusters[clusters >= 0], minlength=len(reps))
+        kept['duplicates'] = [sizes[c] - 1 if c >= 0 else 0 for c in kept_clusters]
+    return kept.reset_index(drop=True)
+
+
+@profiled('dedup.deduplicate')
+def deduplicate(df, mode='mark', threshold=0.8, match_titles=True, loc_type='country', num_perm=128, bands=16,
+                seed=0, report_file=os.path.join('results', 'dedup_report.csv'), verbose=False):
+    """
+    Finds the near-duplicate recipes of df, writes the cluster report (when report_file is not None), and returns the
+    dataframe in the given mode
+    """
+    clusters, pairs = find_duplicates(df, threshold, match_titles, loc_type, num_perm, bands, seed, verbose=verbose)
+    if report_file is not None:
+        if os.path.dirname(report_file) != '':
+            os.makedirs(os.path.dirname(report_file), exist_ok=True)
+        cluster_report(df, clusters, pairs).to_csv(report_file)
+    return apply_mode(df, clusters, mode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Near-duplicate recipe detection')
+    parser.add_argument('input', help='pickled recipe dataframe (e.g. RDB_full_data.pkl)')
+    parser.add_argument('output', help='pickle for the deduplicated dataframe')
+    parser.add_argument('--mode', default='mark', choices=MODES)
+    parser.add_argument('--threshold', type=float, default=0.8, help='minimum Jaccard similarity of the ingredients')
+    parser.add_argument('--ignore-titles', action='store_true', help='do not require equal normalized titles')
+    parser.add_argument('--loc-type', default='country', help="duplicates must share this location ('none' to not)")
+    parser.add_argument('--num-perm', type=int, default=128)
+    parser.add_argument('--bands', type=int, default=16,
+                        help='LSH bands (16 bands of 8 hashes find pairs above a Jaccard of 0.8 with p > 0.95)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report', default=os.path.join('results', 'dedup_report.csv'))
+    args = parser.parse_args()
+    df = pd.read_pickle(args.input)
+    out = deduplicate(df, args.mode, args.threshold, not args.ignore_titles,
+                      None if args.loc_type == 'none' else args.loc_type, args.num_perm, args.bands, args.seed,
+                      args.report, verbose=True)
+    print_colored(str(len(df)) + ' recipes in, ' + str(len(out)) + ' out', 'y')
+    out.to_pickle(args.output)
+
+
+# ########## #
+# Test cases #
+# ########## #
+def _with_duplicates(df, n=5):
+    """
+    df with copies of its first n recipes whose titles differ only by case and filler words
+    """
+    dups = df.iloc[:n].copy()
+    dups['recipe title'] = 'Easy ' + dups['recipe title'].str.upper() + ' Recipe!'
+    return pd.concat([df, dups], ignore_index=True)
+
+
+def test_normalize_title():
+    assert normalize_title('Easy Crème Brûlée Recipe!') == 'creme brulee'
+
+
+def test_no_duplicates():
+    import synthetic_data
+    df = synthetic_data.generate_recipes(50, 2000, seed=0)
+    clusters, pairs = find_duplicates(df)
+    assert (clusters == -1).all() and len(pairs) == 0
+    for mode in MODES:
+        assert len(deduplicate(df, mode, report_file=None)) == len(df)
+
+
+def test_modes(n=5):
+    """
+    Every mode on synthetic recipes with n planted duplicates
+    """
+    import synthetic_data
+    recipes = synthetic_data.generate_recipes(300, 2000, seed=0)
+    df = _with_duplicates(recipes, n)
+    with tempfile.TemporaryDirectory() as path:
+        for mode in MODES:
+            report_file = os.path.join(path, mode + '.csv')
+            out = deduplicate(df, mode, report_file=report_file)
+            report = pd.read_csv(report_file)
+            assert len(report) == n and (report['size'] == 2).all(), mode
+            if mode == 'mark':
+                assert len(out) == len(df) and out['is duplicate'].sum() == n
+                assert (out['duplicate cluster'] >= 0).sum() == 2 * n
+            else:
+                assert len(out) == len(recipes), mode
+            if mode == 'collapse':
+                assert out['duplicates'].sum() == n
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Indexed store for analysis results (SQLite), keyed by location type, location, metric, and run parameters.
+Scalar results (e.g. diameters), ranked node lists (e.g. top-k centralities), and groups of members (e.g. the recipes
+that connect a pair of nutrients) are upserted atomically, so runs can fill the store incrementally and tables/plots
+are produced by queries.
+"""
+import json
+import os
+import sqlite3
+from contextlib import nullcontext
+
+
+class ResultsStore:
+    def __init__(self, path=os.path.join('results', 'results.db')):
+        if os.path.dirname(path) != '' and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self.conn = sqlite3.connect(path)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS scalars ('
+                              'loc_type TEXT, loc TEXT, metric TEXT, params TEXT, value REAL, '
+                              'PRIMARY KEY (loc_type, loc, metric, params))')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS rankings ('
+                              'loc_type TEXT, loc TEXT, metric TEXT, params TEXT, rank INTEGER, '
+                              'node TEXT, title TEXT, value REAL, '
+                              'PRIMARY KEY (loc_type, loc, metric, params, rank))')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS members ('
+                              'loc_type TEXT, loc TEXT, metric TEXT, params TEXT, grp TEXT, member TEXT, '
+                              'PRIMARY KEY (loc_type, loc, metric, params, grp, member))')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    @staticmethod
+    def params_key(params):
+        """
+        Canonical string for a dictionary of run parameters
+        """
+        return json.dumps(params or {}, sort_keys=True)
+
+    def upsert_scalar(self, loc_type, loc, metric, value, params=None):
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO scalars VALUES (?, ?, ?, ?, ?)',
+                              (loc_type, loc, metric, self.params_key(params), float(value)))
+
+    def upsert_ranking(self, loc_type, loc, metric, items, params=None):
+        """
+        Replaces the ranking of (loc_type, loc, metric, params) in one transaction
+        items: list of (node, title, value) in rank order
+        """
+        key = (loc_type, loc, metric, self.params_key(params))
+        with self.conn:
+            self.conn.execute('DELETE FROM rankings WHERE loc_type=? AND loc=? AND metric=? AND params=?', key)
+            self.conn.executemany('INSERT INTO rankings VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                  [key + (rank, str(node), title, float(value))
+                                   for rank, (node, title, value) in enumerate(items)])
+
+    def get_scalars(self, loc_type, metric, params=None):
+        """
+        Returns a list of (loc, value) sorted by location
+        """
+        cur = self.conn.execute('SELECT loc, value FROM scalars WHERE loc_type=? AND metric=? AND params=? '
+                                'ORDER BY loc', (loc_type, metric, self.params_key(params)))
+        return cur.fetchall()
+
+    def get_rankings(self, loc_type, metric, params=None):
+        """
+        Returns a dictionary from location to its list of (node, title, value) in rank order
+        """
+        cur = self.conn.execute('SELECT loc, node, title, value FROM rankings WHERE loc_type=? AND metric=? '
+                                'AND params=? ORDER BY loc, rank', (loc_type, metric, self.params_key(params)))
+        rankings = {}
+        for loc, node, title, value in cur:
+            rankings.setdefault(loc, []).append((node, title, value))
+        return rankings
+
+    def upsert_groups(self, loc_type, loc, metric, groups, params=None):
+        """
+        Replaces the groups of (loc_type, loc, metric, params) in one transaction
+        groups: dictionary from group name to its members
+        """
+        key = (loc_type, loc, metric, self.params_key(params))
+        with self.conn:
+            self.conn.execute('DELETE FROM members WHERE loc_type=? AND loc=? AND metric=? AND params=?', key)
+            self.conn.executemany('INSERT INTO members VALUES (?, ?, ?, ?, ?, ?)',
+                                  [key + (group, str(member)) for group, members in groups.items()
+                                   for member in set(members)])
+
+    def get_groups(self, loc_type, loc, metric, params=None):
+        """
+        Returns a dictionary from group name to its sorted members (groups without members are not stored)
+        """
+        cur = self.conn.execute('SELECT grp, member FROM members WHERE loc_type=? AND loc=? AND metric=? AND params=? '
+                                'ORDER BY grp, member', (loc_type, loc, metric, self.params_key(params)))
+        groups = {}
+        for group, member in cur:
+            groups.setdefault(group, []).append(member)
+        return groups
+
+
+def default_store(store, save=True):
+    """
+    Context manager for the store of a function that takes an optional store: the given store (left open), or, when
+    save is True and store is None, the default ResultsStore, which is closed on exit
+    """
+    if save and store is None:
+        return ResultsStore()
+    return nullcontext(store)
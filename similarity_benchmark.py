@@ -0,0 +1,92 @@
+"""
+Recall versus speed of the MinHash LSH similarity search (ingredient_similarity.py) against the exact search.
+For a sample of query ingredients, the exact top k is computed with blocked sparse products, and for every LSH
+setting (signature length and number of bands) the build time, the query time, and the recall of the exact top k
+are reported. The incidence is a synthetic one (synthetic_data.sample_incidence) unless a dataset directory written
+by mmap_dataset.write_dataset is given.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from ingredient_similarity import SimilarityIndex, METRICS
+from printing_functions import print_colored
+import synthetic_data
+
+
+def recall(exact, approximate):
+    """
+    Mean over the queries of the fraction of the exact top k found by the approximate search
+    """
+    found = [len(np.intersect1d(e[0], a[0])) / len(e[0]) for e, a in zip(exact, approximate) if len(e[0]) > 0]
+    return float(np.mean(found)) if found else float('nan')
+
+
+def load_incidence(args):
+    if args.dataset:
+        from mmap_dataset import open_dataset
+        dataset = open_dataset(args.dataset)
+        if args.loc:
+            return dataset.location_incidence(args.loc_type, args.loc)
+        return dataset.incidence
+    rng = np.random.default_rng(args.seed)
+    return synthetic_data.sample_incidence(rng, args.recipes, args.ingredients)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall versus speed of the LSH ingredient similarity search')
+    parser.add_argument('--dataset', default=None, help='dataset directory (synthetic incidence by default)')
+    parser.add_argument('--loc-type', default='country')
+    parser.add_argument('--loc', default=None, help='location of the dataset (all recipes by default)')
+    parser.add_argument('--recipes', type=int, default=100000, help='recipes of the synthetic incidence')
+    parser.add_argument('--ingredients', type=int, default=20000, help='ingredients of the synthetic incidence')
+    parser.add_argument('--queries', type=int, default=500, help='number of query ingredients')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--metrics', nargs='+', default=['jaccard', 'cosine'], choices=METRICS)
+    parser.add_argument('--settings', nargs='+', default=['128/32', '128/64', '128/128', '256/256'],
+                        help='LSH settings as num_perm/bands')
+    parser.add_argument('--min-recipes', type=int, default=5,
+                        help='query ingredients are drawn among those with at least this many recipes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='JSON file for the results')
+    args = parser.parse_args()
+
+    B = load_incidence(args)
+    print_colored('Incidence: ' + str(B.shape[0]) + ' recipes x ' + str(B.shape[1]) + ' ingredients, ' +
+                  str(B.nnz) + ' entries', 'g')
+    t0 = time.perf_counter()
+    exact_index = SimilarityIndex(B, method='exact')
+    exact_build = time.perf_counter() - t0
+    rng = np.random.default_rng(args.seed)
+    pool = np.flatnonzero(exact_index.counts >= args.min_recipes)
+    queries = rng.choice(pool, size=min(args.queries, len(pool)), replace=False)
+
+    results = {}
+    for metric in args.metrics:
+        print_colored(metric, 'y')
+        t0 = time.perf_counter()
+        exact = exact_index.query_indices(queries, args.k, metric)
+        exact_time = time.perf_counter() - t0
+        print(f"{'exact':<12} build {exact_build:8.2f} s  query {exact_time / len(queries) * 1000:8.2f} ms/query")
+        results[metric] = {'exact': {'build': exact_build, 'query': exact_time / len(queries)}}
+        for setting in args.settings:
+            num_perm, bands = map(int, setting.split('/'))
+            t0 = time.perf_counter()
+            index = SimilarityIndex(B, method='lsh', num_perm=num_perm, bands=bands, seed=args.seed)
+            build = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            approximate = index.query_indices(queries, args.k, metric)
+            query = time.perf_counter() - t0
+            r = recall(exact, approximate)
+            print(f'{setting:<12} build {build:8.2f} s  query {query / len(queries) * 1000:8.2f} ms/query  '
+                  f'recall@{args.k} {r:.3f}')
+            results[metric][setting] = {'build': build, 'query': query / len(queries), 'recall': r}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
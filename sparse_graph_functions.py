@@ -0,0 +1,184 @@
+"""
+Graph kernels that work on the sparse (CSR) adjacency of a networkx graph
+"""
+import networkx as nx
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse import csgraph
+
+
+def graph_to_csr(G, weight='weight', nodelist=None):
+    """
+    Converts a networkx graph into a CSR adjacency matrix.
+    G: networkx graph
+    weight: edge attribute used as the matrix entries (None for an unweighted adjacency)
+    nodelist: order of the rows/columns (defaults to G.nodes())
+    Returns the CSR matrix and the node list that gives the row/column order
+    """
+    if nodelist is None:
+        nodelist = list(G.nodes())
+    A = sp.csr_matrix(nx.adjacency_matrix(G, nodelist=nodelist, weight=weight), dtype=float)
+    return A, nodelist
+
+
+# ######## #
+# Diameter #
+# ######## #
+def single_source_distances(A, source, weighted=False):
+    """
+    Distances from source to every node of the CSR graph A (BFS when unweighted, Dijkstra otherwise).
+    Unreachable nodes are at distance inf.
+    """
+    return csgraph.dijkstra(A, directed=False, indices=source, unweighted=not weighted)
+
+
+def double_sweep_lower_bound(A, nodes, weighted=False):
+    """
+    Double sweep lower bound on the diameter of the connected component given by the index array nodes.
+    Runs one search from the highest degree node and a second one from the farthest node found.
+    """
+    degrees = np.diff(A.indptr)[nodes]
+    start = nodes[np.argmax(degrees)]
+    dist = single_source_distances(A, start, weighted)[nodes]
+    far = nodes[np.argmax(dist)]
+    return single_source_distances(A, far, weighted)[nodes].max()
+
+
+def bounding_diameter(A, nodes, weighted=False):
+    """
+    Exact diameter of the connected component given by the index array nodes.
+    Uses the bounding diameters algorithm (Takes and Kosters, 2011): every search from a node v tightens the lower
+    and upper eccentricity bounds of all other nodes, and nodes that can no longer change the result are dropped.
+    In practice only a handful of searches are needed.
+    """
+    n = len(nodes)
+    if n < 2:
+        return 0.
+    degrees = np.diff(A.indptr)[nodes]
+    ecc_lo = np.zeros(n)
+    ecc_up = np.full(n, np.inf)
+    candidates = np.ones(n, dtype=bool)
+    lower = 0.
+    pick_upper = True
+    v = int(np.argmax(degrees))
+    while True:
+        dist = single_source_distances(A, nodes[v], weighted)[nodes]
+        ecc_v = dist.max()
+        ecc_lo = np.maximum(ecc_lo, np.maximum(ecc_v - dist, dist))
+        ecc_up = np.minimum(ecc_up, ecc_v + dist)
+        ecc_lo[v] = ecc_up[v] = ecc_v
+        lower = max(lower, ecc_lo.max())
+
+        # nodes whose eccentricity cannot exceed the lower bound are done, as are nodes with a known eccentricity
+        candidates &= (ecc_up > lower) & (ecc_lo < ecc_up)
+        if not candidates.any():
+            return lower
+
+        # alternate between the node with the largest upper bound and the one with the smallest lower bound
+        idx = np.flatnonzero(candidates)
+        if pick_upper:
+            order = np.lexsort((-degrees[idx], -ecc_up[idx]))
+        else:
+            order = np.lexsort((-degrees[idx], ecc_lo[idx]))
+        v = int(idx[order[0]])
+        pick_upper = not pick_upper
+
+
+def csr_diameter(A, weighted=False, approximate=False, disconnected='largest'):
+    """
+    Diameter of an undirected CSR graph
+    A: CSR adjacency matrix
+    weighted: use the matrix entries as edge lengths
+    approximate: return the double sweep lower bound instead of the exact value
+    disconnected: what to do when the graph is not connected:
+        'largest': diameter of the largest connected component
+        'max': largest diameter over all connected components
+        'inf': return inf (the diameter of a disconnected graph)
+    """
+    if disconnected not in ['largest', 'max', 'inf']:
+        raise ValueError('Unsupported disconnected option.')
+    if A.shape[0] == 0:
+        return 0
+    n_comp, labels = csgraph.connected_components(A, directed=False)
+    if n_comp > 1 and disconnected == 'inf':
+        return np.inf
+    comp_sizes = np.bincount(labels)
+    if disconnected == 'largest':
+        comps = [int(np.argmax(comp_sizes))]
+    else:
+        comps = np.flatnonzero(comp_sizes > 1)
+
+    diam = 0.
+    for comp in comps:
+        nodes = np.flatnonzero(labels == comp)
+        if approximate:
+            diam = max(diam, double_sweep_lower_bound(A, nodes, weighted))
+        else:
+            diam = max(diam, bounding_diameter(A, nodes, weighted))
+    if not weighted:
+        return int(diam)
+    return diam
+
+
+# ########## #
+# Modularity #
+# ########## #
+def communities_to_labels(c, nodelist):
+    """
+    Converts an iterable of node sets into an array of community indices ordered as nodelist
+    """
+    d = dict()
+    for k, v in enumerate(c):
+        for n in v:
+            d[n] = k
+    return np.array([d[n] for n in nodelist])
+
+
+def community_strengths(k, labels, n_comm=None):
+    """
+    Sum of the node strengths k in each community
+    """
+    return np.bincount(labels, weights=k, minlength=0 if n_comm is None else n_comm)
+
+
+def csr_modularity(A, labels, directed=False):
+    """
+    Modularity of a partition of the CSR graph A in O(edges + communities)
+    A: CSR adjacency matrix (A[u, v] is the weight of the edge u -> v)
+    labels: community index of each node
+    Returns Q and Qmax = 1 - (expected fraction of intra-community weight)
+    """
+    A = sp.csr_matrix(A)
+    if not directed:
+        # networkx counts self loops twice in the degree of undirected graphs
+        A = A + sp.diags(A.diagonal())
+    L = A.sum()
+    if L == 0:
+        return 0., 0.
+    rows = np.repeat(np.arange(A.shape[0]), np.diff(A.indptr))
+    intra = A.data[labels[rows] == labels[A.indices]].sum()
+    n_comm = labels.max() + 1
+    k_out = community_strengths(np.asarray(A.sum(axis=1)).ravel(), labels, n_comm)
+    k_in = community_strengths(np.asarray(A.sum(axis=0)).ravel(), labels, n_comm)
+    expected = np.dot(k_in, k_out) / L ** 2
+    return float(intra / L - expected), float(1 - expected)
+
+
+# ############# #
+# Assortativity #
+# ############# #
+def csr_scalar_assortativity(A, X):
+    """
+    Scalar assortativity of node attributes on the CSR graph A (A[u, v] is the weight of the edge u -> v)
+    X: attribute values, either one per node (shape (n,)) or a batch of attribute vectors (shape (n, b))
+    Returns R and Rmax (floats, or arrays of shape (b,) for a batch)
+    """
+    X = np.asarray(X, dtype=float)
+    M = 2 * A.sum()
+    k_in = np.asarray(A.sum(axis=0)).ravel()
+    k_out = np.asarray(A.sum(axis=1)).ravel()
+    mu = (k_in + k_out) @ X / M  # degree-weighted mean
+    Xc = X - mu
+    R = (Xc * (A @ Xc)).sum(axis=0) / M  # edge-wise covariance
+    Rmax = k_in @ Xc ** 2 / M
+    return R, Rmax
@@ -0,0 +1,223 @@
+"""
+Instrumentation of the pipeline stages.
+Stages (with Profiler.stage) and per-location calls (functions decorated with @profiled) record their wall time, CPU
+time, peak resident memory, and the sizes of the graphs they return or register with record_graph. The records are
+written to a JSON trace. Chosen stages can also be run under a profiler (pyinstrument's sampling profiler when it is
+installed, cProfile otherwise).
+Instrumentation is off until enable() is called, and the decorated functions then run unchanged.
+"""
+import functools
+import json
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_profiler = None
+
+
+def _reset_peak_rss():
+    # Linux resets the peak resident set size (VmHWM) of the process when '5' is written to clear_refs
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss():
+    """
+    Peak resident set size in MB (since the last reset where supported, since the process started otherwise)
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.
+    except OSError:
+        pass
+    if resource is None:
+        return float('nan')
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024. ** 2 if os.uname().sysname == 'Darwin' else rss / 1024.
+
+
+def _children_cpu():
+    if resource is None:
+        return 0.
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def graph_size(G):
+    return {'nodes': G.number_of_nodes(), 'edges': G.number_of_edges()}
+
+
+def _is_graph(obj):
+    return hasattr(obj, 'number_of_nodes') and hasattr(obj, 'number_of_edges')
+
+
+class Profiler:
+    """
+    trace_file: JSON file the records are written to by save()
+    profile_stages: names of the stages (or decorated functions) to run under a profiler
+    profile_dir: directory for the profiler outputs (<name>_<record index>.html for pyinstrument, .prof for cProfile)
+    """
+    def __init__(self, trace_file=os.path.join('results', 'trace.json'), profile_stages=(),
+                 profile_dir=os.path.join('results', 'profiles')):
+        self.trace_file = trace_file
+        self.profile_stages = set(profile_stages)
+        self.profile_dir = profile_dir
+        self.records = []
+        self._stack = []
+
+    @contextmanager
+    def stage(self, name, **info):
+        """
+        Records the block as a stage; info is added to the record (e.g. the location)
+        """
+        if self._stack:
+            # the peak of the enclosing stage so far, before the counter is reset for this one
+            self._stack[-1]['peak'] = max(self._stack[-1]['peak'], _peak_rss())
+        _reset_peak_rss()
+        frame = {'name': name, 'graphs': [], 'peak': 0.}
+        record = {'name': name, 'parent': self._stack[-1]['name'] if self._stack else None,
+                  'depth': len(self._stack)}
+        record.update(info)
+        self._stack.append(frame)
+        profiler = self._start_profiler() if name in self.profile_stages else None
+        t0, c0, cc0 = time.perf_counter(), time.process_time(), _children_cpu()
+        try:
+            yield frame
+        finally:
+            record['wall'] = time.perf_counter() - t0
+            record['cpu'] = time.process_time() - c0
+            record['cpu_children'] = _children_cpu() - cc0
+            if profiler is not None:
+                record['profile'] = self._stop_profiler(profiler, name)
+            self._stack.pop()
+            record['peak_rss_mb'] = max(frame['peak'], _peak_rss())
+            record['graphs'] = frame['graphs']
+            if self._stack:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], record['peak_rss_mb'])
+            self.records.append(record)
+
+    def record_graph(self, G, label=None):
+        """
+        Adds the size of graph G to the innermost running stage
+        """
+        if self._stack:
+            size = graph_size(G)
+            if label is not None:
+                size['label'] = label
+            self._stack[-1]['graphs'].append(size)
+
+    def _start_profiler(self):
+        try:
+            from pyinstrument import Profiler as SamplingProfiler
+            profiler = SamplingProfiler()
+        except ImportError:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return profiler
+        profiler.start()
+        return profiler
+
+    def _stop_profiler(self, profiler, name):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        # decorated functions run once per location, so the outputs are numbered
+        filename = os.path.join(self.profile_dir, name.replace(os.sep, '_') + '_' + str(len(self.records)))
+        if hasattr(profiler, 'output_html'):
+            profiler.stop()
+            filename += '.html'
+            with open(filename, 'w') as f:
+                f.write(profiler.output_html())
+        else:
+            profiler.disable()
+            filename += '.prof'
+            profiler.dump_stats(filename)
+        return filename
+
+    def save(self):
+        if os.path.dirname(self.trace_file) != '' and not os.path.exists(os.path.dirname(self.trace_file)):
+            os.makedirs(os.path.dirname(self.trace_file))
+        with open(self.trace_file, 'w') as f:
+            json.dump(self.records, f, indent=1)
+
+    def summary(self, depth=0):
+        """
+        Prints the wall time, CPU time, and peak memory of the stages at the given depth
+        """
+        for r in self.records:
+            if r['depth'] == depth:
+                print(f"{r['name']:<40} wall {r['wall']:9.2f} s  cpu {r['cpu'] + r['cpu_children']:9.2f} s  "
+                      f"peak {r['peak_rss_mb']:9.1f} MB")
+
+
+# ################## #
+# Module-level hooks #
+# ################## #
+def enable(trace_file=os.path.join('results', 'trace.json'), profile_stages=(),
+           profile_dir=os.path.join('results', 'profiles')):
+    """
+    Turns on the instrumentation of the decorated functions and returns the profiler
+    """
+    global _profiler
+    _profiler = Profiler(trace_file, profile_stages, profile_dir)
+    return _profiler
+
+
+def disable():
+    global _profiler
+    _profiler = None
+
+
+def get_profiler():
+    return _profiler
+
+
+@contextmanager
+def stage(name, **info):
+    """
+    Profiler.stage of the enabled profiler (does nothing when the instrumentation is off)
+    """
+    if _profiler is None:
+        yield None
+    else:
+        with _profiler.stage(name, **info) as frame:
+            yield frame
+
+
+def record_graph(G, label=None):
+    if _profiler is not None:
+        _profiler.record_graph(G, label)
+
+
+def profiled(name=None):
+    """
+    Decorator that records every call of the function as a stage when the instrumentation is on.
+    The string arguments (e.g. the location and location type) are added to the record, and the sizes of the
+    graphs the function returns are recorded.
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            str_args = [a for a in args if isinstance(a, str)]
+            str_args.extend(v for v in kwargs.values() if isinstance(v, str))
+            with _profiler.stage(stage_name, args=str_args):
+                result = func(*args, **kwargs)
+                for obj in (result if isinstance(result, tuple) else (result,)):
+                    if _is_graph(obj):
+                        _profiler.record_graph(obj)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,160 @@
+"""
+Generates synthetic datasets with the shape of the scraped RecipeDB data (see get_dataRDB.py), for benchmarking the
+pipeline without the scrape.
+Recipes get a country (and the matching region and continent), a set of ingredients drawn with Zipf-distributed
+popularity, the nested 'ingredient information' dictionaries, and 'nutritional information' totals that are
+consistent with their ingredients.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+# continent >> region >> countries
+LOCATIONS = {
+    'North American': {'US': ['US'], 'Canadian': ['Canadian']},
+    'European': {'French': ['French'], 'Italian': ['Italian'], 'British Isles': ['English', 'Irish'],
+                 'Eastern European': ['German', 'Greek']},
+    'Asian': {'Chinese and Mongolian': ['Chinese'], 'Indian Subcontinent': ['Indian'], 'Thai': ['Thai']},
+    'Latin American': {'Mexican': ['Mexican'], 'South American': ['Argentine']},
+    'Australasian': {'Australian': ['Australian']},
+    'African': {'West African': ['Nigerian']},
+}
+NUTRIENTS = ['Energy (kcal)', 'Total fats (g)', 'Protein (g)', 'Carbohydrates (g)', 'Sugars, total (g)',
+             'Fiber, total dietary (g)', 'Fatty acids, total saturated (g)', 'Cholesterol (mg)', 'Sodium, Na (mg)',
+             'Calcium, Ca (mg)', 'Iron, Fe (mg)', 'Vitamin C, total ascorbic acid (mg)', 'Water (g)']
+STATES = ['', 'chopped', 'sliced', 'minced', 'ground', 'fresh', 'dried', 'grated', 'diced']
+
+
+def location_table():
+    """
+    Returns the countries and the region and continent of each country
+    """
+    countries, regions, continents = [], [], []
+    for continent, region_dict in LOCATIONS.items():
+        for region, country_list in region_dict.items():
+            for country in country_list:
+                countries.append(country)
+                regions.append(region)
+                continents.append(continent)
+    return countries, regions, continents
+
+
+def zipf_probabilities(n, a):
+    p = 1. / np.arange(1, n + 1) ** a
+    return p / p.sum()
+
+
+def sample_incidence(rng, n_recipes, n_ingredients, mean_size=9, zipf_a=1.3):
+    """
+    Recipe x ingredient incidence (CSR) with Poisson recipe sizes and Zipf-distributed ingredient popularity
+    (ingredient 0 is the most popular). Ingredients drawn twice for a recipe are kept once.
+    """
+    sizes = rng.poisson(mean_size - 1, n_recipes) + 1
+    indptr = np.concatenate([[0], np.cumsum(sizes)])
+    draws = rng.choice(n_ingredients, indptr[-1], p=zipf_probabilities(n_ingredients, zipf_a))
+    B = sp.csr_matrix((np.ones(len(draws)), draws, indptr), shape=(n_recipes, n_ingredients))
+    B.sum_duplicates()
+    B.data[:] = 1
+    return B
+
+
+def ingredient_profiles(rng, n_ingredients):
+    """
+    Fat, carbohydrate, and protein content (per gram) of each ingredient, each with a random dominant macro-nutrient
+    """
+    profiles = rng.gamma(1., 0.05, (n_ingredients, 3))
+    profiles[np.arange(n_ingredients), rng.integers(0, 3, n_ingredients)] += rng.gamma(2., 0.1, n_ingredients)
+    return profiles
+
+
+def _format(values, missing=None):
+    values = [f'{x:.2f}' for x in values.tolist()]
+    if missing is not None:
+        for i in np.flatnonzero(missing).tolist():
+            values[i] = '-'
+    return values
+
+
+def generate_recipes(n_recipes=10000, n_ingredients=20000, mean_size=9, zipf_a=1.3, location_a=1., missing=0.02,
+                     seed=0):
+    """
+    Generates a RecipeDB-like dataframe with the columns of the scraped data
+    n_ingredients: size of the ingredient vocabulary
+    mean_size: mean number of ingredients per recipe
+    zipf_a: exponent of the ingredient popularity
+    location_a: exponent of the (Zipf) distribution of recipes over the countries, in the order of LOCATIONS
+    missing: fraction of ingredient nutrient values that are missing ('-')
+    """
+    rng = np.random.default_rng(seed)
+    B = sample_incidence(rng, n_recipes, n_ingredients, mean_size, zipf_a)
+    names = ['ingredient ' + str(k) for k in range(n_ingredients)]
+    profiles = ingredient_profiles(rng, n_ingredients)
+
+    # one entry per (recipe, ingredient) pair, in CSR order
+    cols = B.indices
+    rows = np.repeat(np.arange(n_recipes), np.diff(B.indptr))
+    quantity = np.round(rng.gamma(2., 50., len(cols)), 1)
+    fat, carbs, protein = (profiles[cols] * quantity[:, None]).T
+    energy = 9 * fat + 4 * carbs + 4 * protein
+    entry = {'quantity': _format(quantity), 'energy (kcal)': _format(energy, rng.random(len(cols)) < missing),
+             'carbohydrates': _format(carbs, rng.random(len(cols)) < missing),
+             'protein (g)': _format(protein, rng.random(len(cols)) < missing),
+             'lipid (fat) (g)': _format(fat, rng.random(len(cols)) < missing)}
+    states = rng.integers(0, len(STATES), len(cols)).tolist()
+
+    ingredient_info = []
+    for i in range(n_recipes):
+        info = {}
+        for e in range(B.indptr[i], B.indptr[i + 1]):
+            info[names[cols[e]]] = {'quantity': entry['quantity'][e], 'unit': 'g', 'state': STATES[states[e]],
+                                    'energy (kcal)': entry['energy (kcal)'][e],
+                                    'carbohydrates': entry['carbohydrates'][e],
+                                    'protein (g)': entry['protein (g)'][e],
+                                    'lipid (fat) (g)': entry['lipid (fat) (g)'][e]}
+        ingredient_info.append(info)
+
+    # recipe totals, with the remaining nutrients as random fractions of them
+    totals = {'Energy (kcal)': np.bincount(rows, energy, n_recipes),
+              'Total fats (g)': np.bincount(rows, fat, n_recipes),
+              'Protein (g)': np.bincount(rows, protein, n_recipes),
+              'Carbohydrates (g)': np.bincount(rows, carbs, n_recipes)}
+    totals['Sugars, total (g)'] = totals['Carbohydrates (g)'] * rng.beta(2, 5, n_recipes)
+    totals['Fiber, total dietary (g)'] = totals['Carbohydrates (g)'] * rng.beta(1, 10, n_recipes)
+    totals['Fatty acids, total saturated (g)'] = totals['Total fats (g)'] * rng.beta(2, 4, n_recipes)
+    for nutrient in NUTRIENTS:
+        if nutrient not in totals:
+            totals[nutrient] = rng.gamma(1., 100., n_recipes) * (rng.random(n_recipes) > 0.1)
+    totals = {nutrient: _format(totals[nutrient]) for nutrient in NUTRIENTS}
+    nutri_info = [{nutrient: totals[nutrient][i] for nutrient in NUTRIENTS} for i in range(n_recipes)]
+
+    countries, regions, continents = location_table()
+    loc = rng.choice(len(countries), n_recipes, p=zipf_probabilities(len(countries), location_a))
+    return pd.DataFrame({'url idx': [str(i) for i in range(2610, 2610 + n_recipes)],
+                         'status': np.ones(n_recipes, dtype=int),
+                         'recipe title': ['synthetic recipe ' + str(i) for i in range(n_recipes)],
+                         'continent': [continents[k] for k in loc.tolist()],
+                         'region': [regions[k] for k in loc.tolist()],
+                         'country': [countries[k] for k in loc.tolist()],
+                         'recipe time': [str(t) + ' min' for t in rng.integers(5, 180, n_recipes).tolist()],
+                         'nutritional information': nutri_info,
+                         'ingredient information': ingredient_info})
+
+
+def save_dataset(df, path=''):
+    """
+    Saves the dataframe as the combined data file of combine_pkl_files.py (RDB_full_data.pkl)
+    """
+    if path != '' and not os.path.exists(path):
+        os.makedirs(path)
+    df.to_pickle(os.path.join(path, 'RDB_full_data.pkl'))
+
+
+def main():
+    df = generate_recipes(n_recipes=10000, seed=0)
+    save_dataset(df, path='synthetic')
+
+
+if __name__ == "__main__":
+    main()